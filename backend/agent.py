@@ -1,18 +1,45 @@
 import os
 import json
-import requests
-from typing import List, Dict
+import asyncio
+import logging
+import httpx
+from typing import Callable, List, Dict, Optional, Tuple
 
 from serper import web_brief
-
-from dotenv import load_dotenv
-load_dotenv() # your secure system prompt and API KEYS
+from http_client import http, host_of, HTTP_RETRIES
+from cache import get_cache, content_key, LLM_CACHE
+from context_builder import build_context, OLLAMA_NUM_CTX, OLLAMA_NUM_PREDICT
+from inference import InferenceScheduler, PRIORITY_ANSWER, PRIORITY_BACKGROUND, PRIORITY_CLASSIFY
+from metrics import span, record_llm, LLM_CALLS
+import env  # your secure system prompt and API KEYS, from .env
 
 # ------- Config ----------
 
 # Ollama (local)
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "cas/nous-hermes-2-mistral-7b-dpo:latest")
+# max in-flight chat calls across all workers; match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+# the search decider only emits a line of JSON; a small model answers it far faster
+DECIDER_MODEL = os.getenv("DECIDER_MODEL") or OLLAMA_MODEL
+# join identical in-flight calls instead of sending them twice
+INFERENCE_COALESCE = os.getenv("INFERENCE_COALESCE", "1") == "1"
+# per-model slots (OLLAMA_CONCURRENCY unless MODEL_SLOTS says otherwise)
+scheduler = InferenceScheduler(OLLAMA_CONCURRENCY)
+# the scheduler does the per-model limiting; the host limit only has to cover all models
+http.set_host_limit(host_of(OLLAMA_URL), sum(scheduler.slots(m) for m in {OLLAMA_MODEL, DECIDER_MODEL}))
+# 222s: change tokens and timeout when using stronger servers in production
+_OLLAMA_TIMEOUT = httpx.Timeout(222, connect=10)
+# stream the final answer token by token (set OLLAMA_STREAM=0 for one blocking reply)
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "1") == "1"
+# the search decider only needs a glimpse of the context
+DECIDER_BUDGET_TOKENS = int(os.getenv("DECIDER_BUDGET_TOKENS", "512"))
+# how long Ollama keeps a model loaded after a call: OLLAMA_KEEP_ALIVE while the
+# queue is empty, OLLAMA_KEEP_ALIVE_BUSY while tasks are waiting or running
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "3m")
+OLLAMA_KEEP_ALIVE_BUSY = os.getenv("OLLAMA_KEEP_ALIVE_BUSY", "30m")
+# load the models at startup so the first task does not pay for it
+OLLAMA_PREWARM = os.getenv("OLLAMA_PREWARM", "1") == "1"
 
 # ---------- System brief (concise, actionable) ----------
 DEFAULT_SYSTEM_BRIEF = """
@@ -38,23 +65,94 @@ def _pack_messages(prompt: str, memory_docs: str = "") -> List[Dict[str, str]]:
     ]
 
 # ---------- Providers ----------
-def _ask_ollama(messages: List[Dict[str, str]]) -> str:
+def _ollama_payload(messages: List[Dict[str, str]], stream: bool, model: str = OLLAMA_MODEL) -> dict:
+    return {
+        "model": model,
+        "messages": messages,
+        "stream": stream,
+        "options": {"num_predict": OLLAMA_NUM_PREDICT, "num_ctx": OLLAMA_NUM_CTX},
+        "keep_alive": _residency["keep_alive"],
+    }
+
+
+# ---------- Model residency ----------
+_residency = {"keep_alive": OLLAMA_KEEP_ALIVE, "queued": 0, "loads": 0, "load_failures": 0, "last_load_sec": None}
+
+
+async def load_models(keep_alive: Optional[str] = None) -> bool:
+    """Load the answer and decider models (an empty chat only loads), or
+    refresh how long they stay loaded. Failures are logged, not raised.
+    """
+    keep_alive = keep_alive or _residency["keep_alive"]
+    t = asyncio.get_running_loop().time()
+    try:
+        await asyncio.gather(*(http.post_json(OLLAMA_URL, {"model": m, "messages": [], "keep_alive": keep_alive},
+                                              timeout=_OLLAMA_TIMEOUT)
+                               for m in {OLLAMA_MODEL, DECIDER_MODEL}))
+    except Exception as e:
+        _residency["load_failures"] += 1
+        logging.warning(f"Model load failed: {e}")
+        return False
+    _residency["loads"] += 1
+    _residency["last_load_sec"] = round(asyncio.get_running_loop().time() - t, 3)
+    return True
+
+
+async def track_queue(queued: int):
+    """Pick keep_alive from the queue depth (tasks pending or running). Going
+    busy re-sends it at once, so a model about to expire stays loaded (or is
+    loaded again) before the next task; going idle only shortens later calls.
+    """
+    _residency["queued"] = queued
+    keep_alive = OLLAMA_KEEP_ALIVE_BUSY if queued else OLLAMA_KEEP_ALIVE
+    if keep_alive == _residency["keep_alive"]:
+        return
+    _residency["keep_alive"] = keep_alive
+    if queued:
+        await load_models(keep_alive)
+
+
+def residency_stats() -> dict:
+    return {**_residency, "prewarm": OLLAMA_PREWARM,
+            "policy": {"idle": OLLAMA_KEEP_ALIVE, "busy": OLLAMA_KEEP_ALIVE_BUSY}}
+
+
+async def _ask_ollama(messages: List[Dict[str, str]], on_token: Optional[Callable[[str], None]] = None,
+                      model: str = OLLAMA_MODEL, priority: int = PRIORITY_ANSWER) -> str:
     """
-    Non-streaming Ollama chat call: one complete JSON reply.
+    Ollama chat call on the shared pooled client, admitted by the inference
+    scheduler (per-model slots, cheap calls first, identical in-flight calls
+    joined). Without on_token: one complete JSON reply. With on_token: consume
+    the NDJSON stream, calling on_token per chunk. Replies are cached by
+    (model, messages, options).
     """
-    resp = requests.post(
-        OLLAMA_URL,
-        json={ 
-            "model": OLLAMA_MODEL,
-            "messages": messages,
-            "stream": False,
-            "options": {"num_predict": 1050, "num_ctx": 2048},
-            "keep_alive": "3m",
-        },
-        timeout=222 #Change tokens and timeout when using stronger servers in production
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    payload = _ollama_payload(messages, stream=False, model=model)
+    key = content_key(payload["model"], payload["messages"], payload["options"])
+    if LLM_CACHE:
+        hit = await get_cache("llm").aget(key)
+        if hit is not None:
+            LLM_CALLS.inc(model=model, source="cache")
+            if on_token is not None:
+                on_token(hit)
+            return hit
+
+    async def call(emit: Callable[[str], None]) -> str:
+        LLM_CALLS.inc(model=model, source="server")
+        # streams whenever someone listens; a joiner may want tokens the leader didn't
+        if on_token is not None:
+            text = await _ask_ollama_stream(messages, emit, model)
+        else:
+            data = await http.post_json(OLLAMA_URL, payload, timeout=_OLLAMA_TIMEOUT)
+            record_llm(model, data)
+            text = _reply_text(data)
+        if LLM_CACHE and text:
+            await get_cache("llm").aset(key, text)
+        return text
+
+    return await scheduler.run(model, key if INFERENCE_COALESCE else None, call, on_token, priority)
+
+
+def _reply_text(data: dict) -> str:
     # Ollama returns: {"message": {"role": "...", "content": "..."}, ...}
     # or choices-like in some versions; prefer "message"
     if "message" in data and isinstance(data["message"], dict):
@@ -64,6 +162,37 @@ def _ask_ollama(messages: List[Dict[str, str]]) -> str:
         return data["messages"][-1].get("content", "")
     return ""
 
+
+async def _ask_ollama_stream(messages: List[Dict[str, str]], on_token: Callable[[str], None],
+                             model: str = OLLAMA_MODEL) -> str:
+    """Streaming chat call: one JSON object per line, {"message": {"content": "<chunk>"}, "done": bool}.
+    The read timeout applies between chunks, not to the whole generation.
+    A dropped connection is retried only if no token has been emitted yet.
+    """
+    parts = []
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            async with http.stream_post(OLLAMA_URL, _ollama_payload(messages, stream=True, model=model),
+                                        timeout=_OLLAMA_TIMEOUT) as resp:
+                async for line in resp.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise RuntimeError(f"Ollama error: {data['error']}")
+                    chunk = (data.get("message") or {}).get("content", "")
+                    if chunk:
+                        parts.append(chunk)
+                        on_token(chunk)
+                    if data.get("done"):
+                        record_llm(model, data)  # the final line carries the timings
+                        break
+            return "".join(parts)
+        except (httpx.ReadError, httpx.RemoteProtocolError):
+            if parts or attempt == HTTP_RETRIES:
+                raise
+            await asyncio.sleep(0.5 * (2 ** attempt))
+
 # _________ WebSearch ___________  
 _DECIDER = (
     'Return STRICT JSON only: {"do_search": true|false, "query": "<short query or empty>"} '
@@ -72,13 +201,13 @@ _DECIDER = (
     '(c) add a disambiguator (year/product/library/site) when useful, (d) no quotes, no punctuation.'
 )
 
-def _decide_search(prompt: str, context: str) -> tuple[bool, str]:
+async def _decide_search(prompt: str, context: str) -> tuple[bool, str]:
     """Ask the LLM if web is needed. Uses your same roles: system + task."""
     messages = [
         {"role": "system", "content": _DECIDER},
         {"role": "task", "content": f"{prompt.strip()}\n\nContext (past tasks/results):\n{(context or '').strip()}"},
     ]
-    raw = _ask_ollama(messages).strip()
+    raw = (await _ask_ollama(messages, model=DECIDER_MODEL, priority=PRIORITY_CLASSIFY)).strip()
     print("[WEBSEARCH] Raw decider output:", raw)
 
     try:
@@ -89,33 +218,63 @@ def _decide_search(prompt: str, context: str) -> tuple[bool, str]:
 
 
 
+# _________ Memory summaries ___________
+_SUMMARIZER = (
+    "Merge these task results into one concise summary for later retrieval. Keep every distinct "
+    "finding, name, number and source; drop repetition. Plain text, at most 200 words."
+)
+
+async def summarize(texts: List[str]) -> str:
+    """One summary of several texts (memory retention), packed into the context
+    budget and queued behind all task work.
+    """
+    context, _ = build_context(_SUMMARIZER, [(t, 0.0) for t in texts])
+    messages = [{"role": "system", "content": _SUMMARIZER}, {"role": "task", "content": context}]
+    return (await _ask_ollama(messages, priority=PRIORITY_BACKGROUND)).strip()
+
+
 # ---------- Public API ----------
-def agent_response(prompt: str, memory_docs: str = "", allow_web: bool = True) -> str:
+async def agent_response(prompt: str, memory_docs: str = "", allow_web: bool = True,
+                   on_token: Optional[Callable[[str], None]] = None,
+                   memory_chunks: Optional[List[Tuple[str, float]]] = None) -> str:
     """
     Called by autonomous_agent.py. Keep it simple:
-      - We always pack past memory into the context window.
+      - We pack past memory into the context window, best-scoring chunks first,
+        within the token budget (memory_chunks are (text, score) pairs;
+        a plain memory_docs string counts as one chunk).
       - If allowed and needed, we may fetch a small WebBrief first.
+      - If on_token is given (and OLLAMA_STREAM is on), the answer is streamed to it.
     """
+    chunks = list(memory_chunks) if memory_chunks is not None else [(memory_docs, 0.0)]
+
     do_search, query = (False, "")
     if allow_web and os.getenv("SERPER_API_KEY"):
-        do_search, query = _decide_search(prompt, memory_docs)
+        decider_ctx, _ = build_context(_DECIDER + prompt, chunks, budget=DECIDER_BUDGET_TOKENS)
+        with span("decide"):
+            do_search, query = await _decide_search(prompt, decider_ctx)
         print(f"[WEBSEARCH] Search decision: {do_search}, query='{query}+?'")
 
+    brief = ""
     if do_search and query:
         print(f"[WEBSEARCH] Sending request to Serper with query: {query}")
-        brief = web_brief(query)  # sync HTTP; your caller can thread this
+        with span("search"):
+            brief = await web_brief(query)
         if brief:
             print(f"[WEBSEARCH] Got Serper response length: {len(brief)} chars")
-            addon = "WebBrief:\n" + brief
-            memory_docs = (memory_docs + "\n\n" + addon) if memory_docs.strip() else addon
         else:
             print("[WEBSEARCH] No response from Serper")
 
-    messages = _pack_messages(prompt, memory_docs)
+    with span("context"):
+        context, report = build_context(SYSTEM_BRIEF + prompt, chunks, brief=brief)
+    logging.info(f"Context packed: {report['used']}/{report['available']} tokens, "
+                 f"{report['included']}/{report['candidates']} chunks, {report['deduped']} deduped, "
+                 f"{report['dropped_tokens']} tokens dropped")
+    messages = _pack_messages(prompt, context)
     print(f"[WEBSEARCH] Messages packed, roles={[m['role'] for m in messages]}")
-    return _ask_ollama(messages)
+    with span("generate"):
+        return await _ask_ollama(messages, on_token=on_token if OLLAMA_STREAM else None)
 
 
 if __name__ == "__main__":
     # Quick smoke test (set env first)
-    print(agent_response("List 3 minimal changes to harden the kill-switch logic.", memory_docs="(no results)"))
\ No newline at end of file
+    print(asyncio.run(agent_response("List 3 minimal changes to harden the kill-switch logic.", memory_docs="(no results)")))
\ No newline at end of file
@@ -1,204 +1,290 @@
-import os, json, asyncio, logging, uuid
-from datetime import datetime, timedelta
+import os, json, time, asyncio, logging, uuid
 from typing import Optional
-from file_processor import extract_text
-from memory import add_to_memory, retrieve_from_memory, add_relationship, add_node
+from memory import add_to_memory, retrieve_scored, add_relationship, add_node
 from agent import agent_response
 from notifier import notify
-from config import UPLOAD_FOLDER, RESULTS_FOLDER, TASK_FILE
-
-# POSIX file locking (macOS/Linux)
-import fcntl
+from events import token_streams
+from config import RESULTS_FOLDER
+from task_store import get_task_store
+from result_store import save_result
+from metrics import span, record, start_trace, current_trace, TASK_TRACE, TASKS, TASK_SECONDS
+from startup import mark
 
 logging.basicConfig(filename='agentic_lab.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-PROCESSED_FILES = set()
-
 # intra-process locks
 _TASKS_LOCK = asyncio.Lock()
 _PROCESS_LOCK = asyncio.Lock()
 
 # worker identity & lease timeout
 WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
-LEASE_TTL_SEC = 15 * 60  # 15 minutes
+# a running task's lease is renewed every LEASE_RENEW_SEC, so the TTL only
+# bounds how long a crashed worker's task stays stuck, not how long a task may run
+LEASE_TTL_SEC = float(os.getenv("LEASE_TTL_SEC", "300"))
+LEASE_RENEW_SEC = float(os.getenv("LEASE_RENEW_SEC", str(LEASE_TTL_SEC / 3)))
 
+# worker pool (LAB_WORKERS=0 keeps the one-task-per-loop behaviour)
+LAB_WORKERS = int(os.getenv("LAB_WORKERS", "0"))
+TASK_POLL_SEC = float(os.getenv("TASK_POLL_SEC", "5"))
+RETRIEVE_K = int(os.getenv("RETRIEVE_K", "8"))
+_TASKS_AVAILABLE = asyncio.Event()
+# task change feed: one reader of the task_events table per process
+TASK_FEED_POLL_SEC = float(os.getenv("TASK_FEED_POLL_SEC", "1"))
+_TASKS_CHANGED = asyncio.Event()
 
-def _now_iso() -> str:
-    return datetime.utcnow().isoformat() + "Z"
 
+# ---------- task helpers (indexed store) ----------
+def _store_call(fn, *args):
+    """Run a task-store call off the event loop (it may wait on another process's write lock)."""
+    return asyncio.to_thread(fn, *args)
 
-# ---------- atomic helpers ----------
-def _atomic_write_json(path: str, data: list):
-    tmp = f"{path}.tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-        f.flush()
-        os.fsync(f.fileno())
-    os.replace(tmp, path)
 
+async def _task_store():
+    """The task store; opening it (schema migration, tasks.json import) happens off the loop too."""
+    return await _store_call(get_task_store)
 
-# ---------- file ingestion ----------
-def monitor_new_files():
-    global PROCESSED_FILES
-    files = [f for f in os.listdir(UPLOAD_FOLDER) if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))]
-    new_files = [f for f in files if f not in PROCESSED_FILES]
 
-    for file in new_files:
-        file_path = os.path.join(UPLOAD_FOLDER, file)
-        file_type = file.rsplit(".", 1)[-1].lower() if "." in file else ""
-        text = extract_text(file_path, file_type) or ""
-        if not text.strip():
-            logging.info(f"Skipped (no extractable text): {file}")
-            PROCESSED_FILES.add(file)
-            continue
+async def _claim_next_task() -> Optional[dict]:
+    """Claim exactly one pending task under the store's write lock.
+    Also recovers stale 'running' tasks whose lease expired. Starts the
+    task's trace, so the claim is its first span.
+    """
+    start_trace()
+    t = time.perf_counter()
+    async with _TASKS_LOCK:
+        record("claim_wait", time.perf_counter() - t, start=t)
+        store = await _task_store()
+        with span("claim"):  # includes waiting on other processes' write locks
+            await _store_call(store.sync_json)
+            task = await _store_call(store.claim, WORKER_ID, LEASE_TTL_SEC)
+    _TASKS_CHANGED.set()
+    return task
 
-        CHUNK = 4000
-        for i in range(0, len(text), CHUNK):
-            add_to_memory(text[i:i+CHUNK], {"filename": file, "offset": i})
 
-        add_node(f"doc_{file}", node_type="document", label=file)
-        PROCESSED_FILES.add(file)
-        logging.info(f"Ingested new file: {file}")
+async def _complete_task(task: dict) -> bool:
+    async with _TASKS_LOCK:
+        ok = await _store_call((await _task_store()).complete, task["id"], WORKER_ID, task["fence"])
+    _TASKS_CHANGED.set()
+    if not ok:
+        logging.warning(f"Task {task['id']}: lease lost before completion; result not recorded as done.")
+    return ok
 
 
-# ---------- task helpers (file-locked) ----------
-def _read_tasks_with_lock(f) -> list:
-    try:
-        f.seek(0)
-        data = json.load(f)
-        if not isinstance(data, list):
-            data = []
-    except Exception:
-        data = []
-    return data
+async def _fail_task(task: dict, error: str):
+    async with _TASKS_LOCK:
+        lines = (error or "").splitlines()
+        # releases the lease; the store requeues with backoff until TASK_MAX_ATTEMPTS
+        await _store_call((await _task_store()).fail, task["id"], WORKER_ID, task["fence"],
+                          lines[-1][:500] if lines else "")
+    _TASKS_CHANGED.set()
 
 
-async def _claim_next_task() -> Optional[dict]:
-    """Claim exactly one pending task with an exclusive file lock.
-    Also recovers stale 'running' tasks whose lease expired.
+async def _keep_lease(task: dict, work: asyncio.Task):
+    """Renew the task's lease until cancelled; if it is lost (we stalled past
+    the TTL and another worker re-claimed it), cancel the work.
     """
-    async with _TASKS_LOCK:
-        with open(TASK_FILE, "r+", encoding="utf-8") as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            tasks = _read_tasks_with_lock(f)
-
-            # recover stale running tasks
-            now = datetime.utcnow()
-            for t in tasks:
-                if t.get("status") == "running":
-                    lease_at = t.get("lease_at")
-                    if lease_at:
-                        try:
-                            lease_dt = datetime.fromisoformat(lease_at.replace('Z',''))
-                        except Exception:
-                            lease_dt = now - timedelta(seconds=LEASE_TTL_SEC + 1)
-                    else:
-                        lease_dt = now - timedelta(seconds=LEASE_TTL_SEC + 1)
-
-                    if (now - lease_dt).total_seconds() > LEASE_TTL_SEC:
-                        t["status"] = "pending"
-                        t.pop("owner", None)
-                        t.pop("lease_at", None)
-
-            pending = sorted([t for t in tasks if t.get("status") == "pending"], key=lambda x: x["id"])
-            if not pending:
-                # persist any recovery changes
-                f.seek(0); f.truncate()
-                json.dump(tasks, f, indent=2); f.flush(); os.fsync(f.fileno())
-                fcntl.flock(f, fcntl.LOCK_UN)
-                return None
-
-            task = pending[0]
-            task["status"] = "running"
-            task.setdefault("started_at", _now_iso())
-            task["owner"] = WORKER_ID
-            task["lease_at"] = _now_iso()
-
-            f.seek(0); f.truncate()
-            json.dump(tasks, f, indent=2); f.flush(); os.fsync(f.fileno())
-            fcntl.flock(f, fcntl.LOCK_UN)
-            return task
-
-
-async def _complete_task(task_id: int):
-    async with _TASKS_LOCK:
-        with open(TASK_FILE, "r+", encoding="utf-8") as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            tasks = _read_tasks_with_lock(f)
-            for t in tasks:
-                if t.get("id") == task_id and t.get("owner") == WORKER_ID:
-                    t["status"] = "completed"
-                    t["completed_at"] = _now_iso()
-                    t.pop("owner", None)
-                    t.pop("lease_at", None)
-                    break
-            f.seek(0); f.truncate()
-            json.dump(tasks, f, indent=2); f.flush(); os.fsync(f.fileno())
-            fcntl.flock(f, fcntl.LOCK_UN)
+    while True:
+        await asyncio.sleep(LEASE_RENEW_SEC)
+        try:
+            ok = await _store_call((await _task_store()).renew, task["id"], WORKER_ID, task["fence"])
+        except Exception:
+            logging.exception(f"Task {task['id']}: lease renewal failed; retrying")
+            continue
+        if not ok:
+            logging.warning(f"Task {task['id']}: lease lost; abandoning it to the new owner.")
+            work.cancel()
+            return
 
 
-async def _fail_task(task_id: int, error: str):
-    async with _TASKS_LOCK:
-        with open(TASK_FILE, "r+", encoding="utf-8") as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            tasks = _read_tasks_with_lock(f)
-            for t in tasks:
-                if t.get("id") == task_id and t.get("owner") == WORKER_ID:
-                    t["status"] = "failed"
-                    t["error"] = (error or "").splitlines()[-1][:500]
-                    t["failed_at"] = _now_iso()
-                    # keep owner/lease; recovery loop will requeue after TTL
-                    break
-            f.seek(0); f.truncate()
-            json.dump(tasks, f, indent=2); f.flush(); os.fsync(f.fileno())
-            fcntl.flock(f, fcntl.LOCK_UN)
+class LeaseLost(Exception):
+    """Another worker owns the task now (its lease expired and was re-claimed)."""
+
+
+async def _check_lease(task: dict):
+    """Renew the lease once more, so what follows runs with a full TTL; raise
+    LeaseLost if the task is no longer ours.
+    """
+    if not await _store_call((await _task_store()).renew, task["id"], WORKER_ID, task["fence"]):
+        raise LeaseLost(f"task {task['id']}")
 
 
 async def get_pending_tasks():
     async with _TASKS_LOCK:
-        with open(TASK_FILE, "r", encoding="utf-8") as f:
-            fcntl.flock(f, fcntl.LOCK_SH)
-            tasks = _read_tasks_with_lock(f)
-            fcntl.flock(f, fcntl.LOCK_UN)
-    return sorted([t for t in tasks if t.get("status") == "pending"], key=lambda x: x["id"])
+        return await _store_call((await _task_store()).pending)
 
 
 # ---------- single task ----------
+def partial_result_path(task_id: int) -> str:
+    """Where a running task's output accumulates while it streams."""
+    return os.path.join(RESULTS_FOLDER, f"task_{task_id:06d}.partial")
+
+
 async def process_single_task(task):
     task_id = task["id"]
     logging.info(f"Processing task {task_id}: {task['description']}")
-    ctx = "\n\n".join(retrieve_from_memory(task["description"], k=5))
-    response = await asyncio.to_thread(agent_response, prompt=task["description"], memory_docs=ctx)
+    # over-fetch; the context builder keeps what fits the token budget
+    with span("retrieve"):
+        # embedding (an HTTP call with EMBEDDER=ollama) and the store lock stay off the event loop
+        chunks = await asyncio.to_thread(retrieve_scored, task["description"], RETRIEVE_K)
+
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    part = partial_result_path(task_id)
+    stream = token_streams.open(task_id)
+    try:
+        # the partial file only feeds late joiners of the live stream; the result store holds the result
+        with open(part, "wb") as out:
+            def on_token(chunk: str):
+                # write first, then publish: a subscriber that read the file up to
+                # `pos` can skip every event that starts before it
+                pos = out.tell()
+                out.write(chunk.encode("utf-8"))
+                out.flush()
+                stream.publish({"pos": pos, "text": chunk})
+
+            response = await agent_response(prompt=task["description"], memory_chunks=chunks, on_token=on_token)
+        # a fenced-out attempt must not save or remember anything: the new owner will
+        with span("lease_check"):
+            await _check_lease(task)
+        with span("result_write"):
+            result = await save_result(task_id, task["description"], response or "",
+                                       worker=WORKER_ID, attempt=task.get("attempts"))
+    finally:
+        token_streams.close(task_id)
+        if os.path.exists(part):
+            os.remove(part)
+
+    with span("memory_insert"):
+        await asyncio.to_thread(_remember, task, response)
+    if TASK_TRACE:
+        _write_trace(task, result["id"])
+
+    logging.info(f"Completed task {task_id} -> result {result['id']}")
+    notify(f"Task {task_id} Completed", f"Result saved for task: {task['description']}")
+
+
+def _remember(task: dict, response: str):
+    """Store the result and its graph nodes (fsyncs, and waits on the store lock: run in a thread)."""
+    task_id = task["id"]
     add_to_memory(response, {"task_id": task_id})
     add_node(f"task_{task_id}", node_type="task", label=task["description"])
     add_node(f"insight_{task_id}", node_type="insight", label=f"Insight {task_id}")
     add_relationship(f"task_{task_id}", f"insight_{task_id}", relation_type="produces")
 
-    os.makedirs(RESULTS_FOLDER, exist_ok=True)
-    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    fname = f"task_{task_id:06d}_{stamp}.txt"
-    dst = os.path.join(RESULTS_FOLDER, fname)
-    tmp = dst + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        f.write(response)
-        f.flush(); os.fsync(f.fileno())
-    os.replace(tmp, dst)
 
-    logging.info(f"Completed task {task_id} -> {fname}")
-    notify(f"Task {task_id} Completed", f"Result saved for task: {task['description']}", method="console")
+def _write_trace(task: dict, result_id: int):
+    """Store the task's spans in RESULTS_FOLDER as task_<id>_r<result>.trace.json."""
+    trace = current_trace()
+    if trace is None:
+        return
+    path = os.path.join(RESULTS_FOLDER, f"task_{task['id']:06d}_r{result_id}.trace.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"task_id": task["id"], "worker": WORKER_ID, "attempt": task.get("attempts"),
+                   **trace.to_dict()}, f, indent=1)
 
 
 # ---------- batch ----------
+async def _run_claimed_task(task):
+    t = time.perf_counter()
+    work = asyncio.create_task(process_single_task(task))
+    heartbeat = asyncio.create_task(_keep_lease(task, work))
+    try:
+        await work
+        outcome = "completed"
+    except asyncio.CancelledError:
+        if not work.cancelled() or not heartbeat.done():
+            raise  # we are being cancelled, not just the lost-lease work
+        outcome = "lost"
+    except LeaseLost:
+        logging.warning(f"Task {task['id']}: lease lost before saving; result dropped for the new owner.")
+        outcome = "lost"
+    except Exception as e:
+        logging.exception("Task failed")
+        await _fail_task(task, str(e))
+        outcome = "failed"
+    finally:
+        heartbeat.cancel()
+    if outcome == "completed" and not await _complete_task(task):
+        outcome = "lost"
+    TASKS.inc(outcome=outcome)
+    TASK_SECONDS.observe(time.perf_counter() - t, outcome=outcome)
+    if outcome == "completed":
+        mark("first_task")
+
+
 async def process_all_tasks():
     async with _PROCESS_LOCK:
         task = await _claim_next_task()
         if not task:
             return
+        await _run_claimed_task(task)
+
+
+# ---------- worker pool ----------
+def wake_workers():
+    """Tell idle pool workers that new tasks were queued in this process."""
+    _TASKS_AVAILABLE.set()
+    _TASKS_CHANGED.set()
+
+
+async def _wait_any(*events: asyncio.Event, timeout: float):
+    waiters = [asyncio.create_task(e.wait()) for e in events]
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for w in waiters:
+            w.cancel()
+
+
+async def _worker(n: int, shutdown_event: asyncio.Event):
+    logging.info(f"Worker {WORKER_ID}/{n} started.")
+    while not shutdown_event.is_set():
+        # clear before claiming so a wake-up that lands mid-claim is not lost
+        _TASKS_AVAILABLE.clear()
+        task = await _claim_next_task()
+        if task is None:
+            # tasks queued by other processes are picked up on the poll timeout
+            await _wait_any(_TASKS_AVAILABLE, shutdown_event, timeout=TASK_POLL_SEC)
+            continue
+        await _run_claimed_task(task)
+    logging.info(f"Worker {WORKER_ID}/{n} drained.")
+
+
+async def run_worker_pool(shutdown_event: asyncio.Event, workers: int = LAB_WORKERS):
+    """Run `workers` claim loops back-to-back until shutdown_event is set.
+    Each worker finishes its in-flight task before exiting (graceful drain).
+    """
+    await asyncio.gather(*(_worker(n, shutdown_event) for n in range(workers)))
+
+
+# ---------- task change feed ----------
+async def run_task_feed(feed, shutdown_event: asyncio.Event):
+    """Read new task_events rows and publish each {"seq", "kind", "task"} to
+    `feed` (a Broadcaster). Runs once per process however many clients
+    listen; wakes on this process's own changes and polls for other writers.
+    """
+    store = await _task_store()
+    seq = await _store_call(store.last_event_seq)
+    last_prune = 0.0
+    loop = asyncio.get_running_loop()
+    while not shutdown_event.is_set():
+        await _wait_any(_TASKS_CHANGED, shutdown_event, timeout=TASK_FEED_POLL_SEC)
+        _TASKS_CHANGED.clear()
         try:
-            await process_single_task(task)
-        except Exception as e:
-            logging.exception("Task failed")
-            await _fail_task(task["id"], str(e))
-            return
-        await _complete_task(task["id"])
\ No newline at end of file
+            while True:
+                events = await _store_call(store.events_since, seq)
+                if events is None:
+                    # another writer outran the pruning window; clients resync on their next reconnect
+                    seq = await _store_call(store.last_event_seq)
+                    break
+                if not events:
+                    break
+                for ev in events:
+                    feed.publish(ev)
+                seq = events[-1]["seq"]
+            if loop.time() - last_prune > 60:
+                await _store_call(store.prune_events)
+                last_prune = loop.time()
+        except Exception:
+            logging.exception("Task feed error")
+
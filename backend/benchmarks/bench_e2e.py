@@ -0,0 +1,258 @@
+"""End-to-end benchmark: the real main.lab_loop against the stub Ollama/Serper.
+
+    cd backend && python -m benchmarks.bench_e2e [--tasks 60] [--workers 4] [--uploads 8]
+    python -m benchmarks.bench_e2e --out before.json
+    python -m benchmarks.bench_e2e --compare before.json   # after a change; exit 1 on regression
+
+A fresh directory per run gets a synthetic task queue and upload corpus (both
+seeded), then lab_loop runs with its worker pool and ingestion until every
+benchmark task has finished and every upload is in memory. Reported:
+tasks/s, p50/p99 task latency (claim to done, from the per-task traces) and
+queue latency (created to done), lock wait (in-process lock + store claim),
+mean time per stage, memory growth (rows, bytes on disk, peak RSS) and ingest
+throughput. --out/--json write the results with the commit they ran on, so
+runs can be compared across commits.
+"""
+import argparse, asyncio, json, math, multiprocessing, os, platform, queue, random, subprocess, sys, tempfile, time
+
+from benchmarks.stub_server import StubServer
+
+# higher is better for these; everything else compared is lower-is-better
+_HIGHER_BETTER = {"tasks_per_sec", "ingest_mb_per_sec", "ingest_chunks_per_sec"}
+_COMPARED = ("tasks_per_sec", "task_p50_sec", "task_p99_sec", "queue_p50_sec", "queue_p99_sec",
+             "lock_wait_mean_ms", "lock_wait_p99_ms", "ingest_mb_per_sec", "ingest_chunks_per_sec",
+             "rss_growth_mb")
+
+_WORDS = ("agent memory retrieval vector index graph latency throughput queue worker lease "
+          "ollama context token budget chunk embedding upload result insight benchmark").split()
+
+
+def _percentile(values, q):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def _dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _write_corpus(folder, files, kb, rng):
+    for i in range(files):
+        words = []
+        size = 0
+        while size < kb * 1024:
+            line = " ".join(rng.choice(_WORDS) for _ in range(12))
+            words.append(line)
+            size += len(line) + 1
+        with open(os.path.join(folder, f"corpus_{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(words))
+
+
+def _rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KiB on Linux
+
+
+def _child(workdir, url, cfg, out):
+    os.chdir(workdir)
+    os.environ.update(
+        OLLAMA_URL=url + "/api/chat", SERPER_URL=url + "/search", SERPER_API_KEY="bench",
+        LAB_WORKERS=str(cfg["workers"]), LAB_LOOP_INTERVAL="1", TASK_POLL_SEC="0.5", TASK_TRACE="1",
+        RETRY_BASE_SEC="0.2", LLM_CACHE="0", OLLAMA_CONCURRENCY=str(cfg["concurrency"]),
+    )
+    sys.stdout = open(os.devnull, "w")  # notify() and the decider print per task
+    import main
+    from ingest import ingest_stats, shutdown_ingest
+    from http_client import http
+    from memory import memory_count
+    from task_store import get_task_store
+
+    rss0 = _rss_mb()
+    store = get_task_store()
+    rng = random.Random(cfg["seed"])
+    ids = [t["id"] for t in store.add_tasks({"description": f"benchmark task {i}: explain {rng.choice(_WORDS)}"}
+                                           for i in range(cfg["tasks"]))]
+
+    async def run():
+        mem0 = await asyncio.to_thread(memory_count)
+        bytes0 = _dir_bytes("memory_store")
+        t0 = time.perf_counter()
+        lab = asyncio.create_task(main.lab_loop())
+        marks = ",".join("?" * len(ids))
+        while True:
+            await asyncio.sleep(0.1)
+            done = store._conn().execute(
+                f"SELECT COUNT(*) FROM tasks WHERE id IN ({marks}) AND status IN ('completed', 'failed')",
+                ids).fetchone()[0]
+            ingested = ingest_stats()
+            if done == len(ids) and ingested["files"] + ingested["skipped"] + ingested["failed"] >= cfg["uploads"]:
+                break
+            if lab.done():
+                lab.result()  # surface the crash
+        elapsed = time.perf_counter() - t0
+        main.shutdown_event.set()
+        await lab
+        if main._worker_pool is not None:
+            await main._worker_pool
+        if main._ingest_run is not None:
+            await main._ingest_run
+        shutdown_ingest()
+        await http.aclose()
+        return elapsed, mem0, bytes0
+
+    elapsed, mem0, bytes0 = asyncio.run(run())
+
+    rows = store._conn().execute(
+        f"SELECT id, status, created_at, completed_at FROM tasks WHERE id IN ({','.join('?' * len(ids))})",
+        ids).fetchall()
+    from task_store import _parse_iso
+    waited = [(_parse_iso(r["completed_at"]) - _parse_iso(r["created_at"])).total_seconds()
+             for r in rows if r["status"] == "completed"]
+    mine = set(ids)
+    traces = []
+    for name in os.listdir("results"):
+        if name.endswith(".trace.json"):
+            with open(os.path.join("results", name), encoding="utf-8") as f:
+                trace = json.load(f)
+            if trace["task_id"] in mine:
+                traces.append(trace)
+    latency = [t["seconds"] for t in traces]
+    lock_ms = [1000 * sum(s["seconds"] for s in t["spans"] if s["stage"] in ("claim_wait", "claim")) for t in traces]
+    stages = {}
+    for t in traces:
+        for s in t["spans"]:
+            stages.setdefault(s["stage"], []).append(s["seconds"])
+    ingested = ingest_stats()
+    completed = sum(1 for r in rows if r["status"] == "completed")
+    out.put({
+        "tasks": len(ids), "completed": completed, "failed": len(ids) - completed,
+        "seconds": round(elapsed, 3), "tasks_per_sec": round(completed / elapsed, 3),
+        "task_p50_sec": _round(_percentile(latency, 50)), "task_p99_sec": _round(_percentile(latency, 99)),
+        "queue_p50_sec": _round(_percentile(waited, 50)), "queue_p99_sec": _round(_percentile(waited, 99)),
+        "lock_wait_mean_ms": _round(sum(lock_ms) / len(lock_ms) if lock_ms else None),
+        "lock_wait_p99_ms": _round(_percentile(lock_ms, 99)),
+        "stage_mean_ms": {k: round(1000 * sum(v) / len(v), 2) for k, v in sorted(stages.items())},
+        "memory_rows_added": memory_count() - mem0,
+        "memory_bytes_added": _dir_bytes("memory_store") - bytes0,
+        "rss_growth_mb": round(_rss_mb() - rss0, 1),
+        "ingest_files": ingested["files"], "ingest_chunks": ingested["chunks"],
+        "ingest_mb_per_sec": ingested["mb_per_sec"], "ingest_chunks_per_sec": ingested["chunks_per_sec"],
+    })
+
+
+def _round(v, nd=4):
+    return None if v is None else round(v, nd)
+
+
+def bench(cfg) -> dict:
+    stub = StubServer(first_token_ms=cfg["first_token_ms"], tokens_per_sec=cfg["tokens_per_sec"],
+                      reply_tokens=cfg["reply_tokens"], fail_rate=cfg["fail_rate"], parallel=cfg["stub_parallel"],
+                      seed=cfg["seed"]).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for d in ("uploads", "results"):
+                os.makedirs(os.path.join(tmp, d))
+            _write_corpus(os.path.join(tmp, "uploads"), cfg["uploads"], cfg["upload_kb"], random.Random(cfg["seed"]))
+            ctx = multiprocessing.get_context("spawn")  # a clean import of the app per run
+            out = ctx.Queue()
+            p = ctx.Process(target=_child, args=(tmp, stub.url, cfg, out))
+            p.start()
+            while True:
+                try:
+                    result = out.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not p.is_alive():
+                        raise RuntimeError(f"benchmark process exited with code {p.exitcode}")
+            p.join()
+    finally:
+        stub.stop()
+    result["stub"] = {k: v for k, v in stub.stats.items() if k != "in_flight"}
+    return result
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """Print the compared metrics side by side; return the regressed ones."""
+    regressed = []
+    print(f"{'metric':<24}{old['commit']:>12}{new['commit']:>12}   change")
+    for key in _COMPARED:
+        a, b = old["results"].get(key), new["results"].get(key)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a if a else 0.0
+        worse = -change if key in _HIGHER_BETTER else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        if flag:
+            regressed.append(key)
+        print(f"{key:<24}{a:>12}{b:>12}   {change:+.1%}{flag}")
+    return regressed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=60)
+    ap.add_argument("--workers", type=int, default=4, help="LAB_WORKERS for the pool")
+    ap.add_argument("--concurrency", type=int, default=4, help="OLLAMA_CONCURRENCY")
+    ap.add_argument("--uploads", type=int, default=8, help="synthetic .txt files in uploads/")
+    ap.add_argument("--upload-kb", type=int, default=256)
+    ap.add_argument("--first-token-ms", type=float, default=100)
+    ap.add_argument("--tokens-per-sec", type=float, default=200)
+    ap.add_argument("--reply-tokens", type=int, default=32)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of stub chat calls answered 503")
+    ap.add_argument("--stub-parallel", type=int, default=0, help="stub chats generating at once per model")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write the JSON results here")
+    ap.add_argument("--json", action="store_true", help="print the JSON results")
+    ap.add_argument("--compare", help="earlier --out file; exit 1 if a metric regressed past --threshold")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args()
+
+    cfg = {k: v for k, v in vars(args).items() if k not in ("out", "json", "compare", "threshold")}
+    report = {"commit": _commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "config": cfg, "results": bench(cfg)}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        r = report["results"]
+        print(f"{r['completed']}/{r['tasks']} tasks in {r['seconds']}s: {r['tasks_per_sec']} tasks/s, "
+              f"task p50 {r['task_p50_sec']}s p99 {r['task_p99_sec']}s, "
+              f"queue p50 {r['queue_p50_sec']}s p99 {r['queue_p99_sec']}s")
+        print(f"lock wait mean {r['lock_wait_mean_ms']}ms p99 {r['lock_wait_p99_ms']}ms; "
+              f"stages (ms): {r['stage_mean_ms']}")
+        print(f"memory +{r['memory_rows_added']} rows, +{r['memory_bytes_added'] / 1e6:.1f} MB on disk, "
+              f"RSS +{r['rss_growth_mb']} MB; ingest {r['ingest_files']} files, {r['ingest_chunks']} chunks, "
+              f"{r['ingest_mb_per_sec']} MB/s, {r['ingest_chunks_per_sec']} chunks/s")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        if old.get("config") != cfg:
+            print("note: configs differ; the comparison is only indicative")
+        if compare(old, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Per-call requests.post in threads vs. the pooled async client, against the stub server.
+
+    cd backend && python -m benchmarks.bench_http [--calls 400] [--concurrency 32] [--first-token-ms 100]
+
+Reports calls/s and how many TCP connections the stub saw (keep-alive reuse).
+The defaults model what the pooled client is for: many concurrent calls to a
+backend that takes a while to answer, where threads run out before sockets
+do. With a near-instant backend (--first-token-ms 5) the per-call thread
+version can be faster, because the event loop's overhead is not hidden.
+"""
+import argparse, asyncio, json, threading, time
+
+import requests
+
+from benchmarks.stub_server import StubServer
+from http_client import http, host_of
+
+
+async def _run(calls, concurrency, call):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await call(i)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return time.perf_counter() - t
+
+
+def bench(kind, calls, concurrency, first_token_ms):
+    stub = StubServer(first_token_ms=first_token_ms, tokens_per_sec=0).start()
+    url = stub.url + "/api/chat"
+    payload = {"model": "stub", "messages": [{"role": "task", "content": "hi"}], "stream": False}
+    peak_threads = [threading.active_count()]
+
+    async def legacy(i):
+        # what agent._ask_ollama used to do: module-level requests.post in a worker thread
+        resp = await asyncio.to_thread(requests.post, url, json=payload, timeout=30)
+        resp.raise_for_status()
+        peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    async def pooled(i):
+        await http.post_json(url, payload)
+        peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    async def main():
+        http.set_host_limit(host_of(url), concurrency)
+        elapsed = await _run(calls, concurrency, legacy if kind == "requests+threads" else pooled)
+        await http.aclose()
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    stub.stop()
+    return {"client": kind, "calls": calls, "concurrency": concurrency,
+            "calls_per_s": round(calls / elapsed, 1), "tcp_connections": stub.stats["connections"],
+            "peak_threads": peak_threads[0]}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--first-token-ms", type=float, default=100, help="stub server latency per call")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+    rows = [bench(k, args.calls, args.concurrency, args.first_token_ms) for k in ("requests+threads", "pooled-async")]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    for r in rows:
+        print(f"{r['client']:>17}: {r['calls_per_s']:>8} calls/s  {r['tcp_connections']:>5} connections  "
+              f"{r['peak_threads']:>3} threads")
+
+
+if __name__ == "__main__":
+    main()
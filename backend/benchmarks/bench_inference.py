@@ -0,0 +1,103 @@
+"""Tasks/minute through agent_response as the worker count rises.
+
+    cd backend && python -m benchmarks.bench_inference [--tasks 48] [--workers 1,2,4,8]
+
+Each task is the real agent path against the stub: decider call -> stub Serper
+-> streamed answer. The stub generates at most --parallel chats per model at
+once, like OLLAMA_NUM_PARALLEL. Three setups are compared per worker count:
+
+  baseline   decider on the answer model, identical prompts sent separately
+  coalesce   identical in-flight prompts joined (--dup-rate of tasks repeat one)
+  scheduled  coalescing + decider routed to a faster small model, admitted first
+
+The LLM cache is off, so only in-flight coalescing can save a call.
+"""
+import argparse, asyncio, json, os, random, time
+
+from benchmarks.stub_server import StubServer
+
+DECIDER_STUB_MODEL = "stub-small"
+
+
+def _tasks(n: int, dup_rate: float, seed: int = 0):
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        if out and rng.random() < dup_rate:
+            out.append(rng.choice(out[-8:]))  # a recent task again, likely still in flight
+        else:
+            out.append(f"benchmark task {i}: summarise topic {i}")
+    return out
+
+
+async def _run(agent, prompts, workers: int) -> float:
+    queue = asyncio.Queue()
+    for p in prompts:
+        queue.put_nowait(p)
+
+    async def worker():
+        while not queue.empty():
+            prompt = queue.get_nowait()
+            await agent.agent_response(prompt, memory_chunks=[("shared context", 1.0)], on_token=lambda _: None)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return time.perf_counter() - t
+
+
+def bench(args):
+    stub = StubServer(first_token_ms=args.first_token_ms, tokens_per_sec=args.tokens_per_sec,
+                      reply_tokens=args.reply_tokens, parallel=args.parallel,
+                      model_first_token_ms={DECIDER_STUB_MODEL: args.first_token_ms / 4}).start()
+    os.environ.update(OLLAMA_URL=stub.url + "/api/chat", SERPER_URL=stub.url + "/search", SERPER_API_KEY="bench",
+                      OLLAMA_CONCURRENCY=str(args.parallel), LLM_CACHE="0", CACHE_DISK="0")
+    import agent
+    from http_client import http, host_of
+
+    setups = {
+        "baseline": dict(DECIDER_MODEL=agent.OLLAMA_MODEL, INFERENCE_COALESCE=False),
+        "coalesce": dict(DECIDER_MODEL=agent.OLLAMA_MODEL, INFERENCE_COALESCE=True),
+        "scheduled": dict(DECIDER_MODEL=DECIDER_STUB_MODEL, INFERENCE_COALESCE=True),
+    }
+    http.set_host_limit(host_of(stub.url), 2 * args.parallel)
+    prompts = _tasks(args.tasks, args.dup_rate)
+    rows = []
+    for workers in (int(n) for n in args.workers.split(",")):
+        for name, attrs in setups.items():
+            for k, v in attrs.items():
+                setattr(agent, k, v)
+            before = stub.stats["requests"]
+            # a fresh prefix per run, so web briefs cached by an earlier run don't carry over
+            elapsed = asyncio.run(_run(agent, [f"[{name} x{workers}] {p}" for p in prompts], workers))
+            stats = agent.scheduler.stats()
+            rows.append({"workers": workers, "setup": name, "tasks": len(prompts),
+                         "tasks_per_min": round(len(prompts) / elapsed * 60, 1),
+                         "model_calls": stub.stats["requests"] - before,
+                         "coalesced": sum(s["coalesced"] for s in stats.values())})
+            agent.scheduler._stats.clear()
+    stub.stop()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=48)
+    ap.add_argument("--workers", default="1,2,4,8")
+    ap.add_argument("--parallel", type=int, default=4, help="stub chats generating at once per model")
+    ap.add_argument("--dup-rate", type=float, default=0.25)
+    ap.add_argument("--first-token-ms", type=float, default=200)
+    ap.add_argument("--tokens-per-sec", type=float, default=100)
+    ap.add_argument("--reply-tokens", type=int, default=32)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+    rows = bench(args)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    for r in rows:
+        print(f"{r['workers']:>2} worker(s) {r['setup']:<10} {r['tasks_per_min']:>7} tasks/min  "
+              f"model+search calls {r['model_calls']:>4}  coalesced {r['coalesced']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Memory footprint under sustained load, with and without retention.
+
+    cd backend && python -m benchmarks.bench_retention [--rounds 40] [--per-round 500]
+
+Each round appends --per-round task-result documents (plus their task/insight
+graph nodes), runs a few retrievals, then one retention pass, the way lab_loop
+interleaves them. Reported per checkpoint: documents, text bytes on disk,
+graph nodes, store directory size and peak RSS. With caps, all of them should
+level off; without, they grow with every round.
+"""
+import argparse, asyncio, json, multiprocessing, os, random, resource, tempfile, time
+
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def _child(workdir, env, args, out):
+    os.environ.update(env, MEMORY_DIR=os.path.join(workdir, "memory_store"), EMBEDDER="hashing")
+    import memory, retention
+
+    rng = random.Random(0)
+    words = "agent memory vector graph latency queue worker lease context token chunk result insight".split()
+    rows, task_id = [], 0
+    t = time.perf_counter()
+    for r in range(1, args.rounds + 1):
+        texts, metas = [], []
+        for _ in range(args.per_round):
+            task_id += 1
+            texts.append(" ".join(rng.choice(words) for _ in range(args.words)) + f". Task {task_id} done.")
+            metas.append({"task_id": task_id})
+        memory.add_many_to_memory(texts, metas)
+        for i in range(task_id - args.per_round + 1, task_id + 1, max(1, args.per_round // 20)):
+            memory.add_node(f"task_{i}", "task", f"Task {i}")
+            memory.add_relationship(f"task_{i}", f"insight_{i}", "produces")
+        for _ in range(10):
+            memory.retrieve_scored(" ".join(rng.choice(words) for _ in range(5)), k=8)
+        asyncio.run(retention.run_retention())
+        if r % max(1, args.rounds // 8) == 0 or r == args.rounds:
+            stats = memory.memory_stats()
+            rows.append({"round": r, "docs_added": task_id, "docs": stats["memory_count"],
+                         "text_mb": round(stats["memory_bytes"] / 1e6, 2), "graph_nodes": stats["graph_nodes"],
+                         "store_mb": round(_dir_bytes(os.environ["MEMORY_DIR"]) / 1e6, 2),
+                         "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)})
+    out.put({"rows": rows, "seconds": round(time.perf_counter() - t, 2), "retention": retention.retention_stats()})
+
+
+def run(env, args):
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    with tempfile.TemporaryDirectory() as tmp:
+        p = ctx.Process(target=_child, args=(tmp, env, args, out))
+        p.start()
+        result = out.get()
+        p.join()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=40)
+    ap.add_argument("--per-round", type=int, default=500)
+    ap.add_argument("--words", type=int, default=120, help="words per synthetic task result")
+    ap.add_argument("--max-docs", type=int, default=5000)
+    ap.add_argument("--graph-max-nodes", type=int, default=500)
+    ap.add_argument("--summarize", default="extract")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+    setups = {
+        "unbounded": {},
+        "retention": {"MEMORY_MAX_DOCS": str(args.max_docs), "GRAPH_MAX_NODES": str(args.graph_max_nodes),
+                      "MEMORY_SUMMARIZE": args.summarize},
+    }
+    results = {name: run(env, args) for name, env in setups.items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, res in results.items():
+        print(f"{name} ({res['seconds']}s):")
+        for row in res["rows"]:
+            print(f"  round {row['round']:>3}: {row['docs_added']:>6} added, {row['docs']:>6} docs, "
+                  f"{row['text_mb']:>6} MB text, {row['store_mb']:>7} MB store, "
+                  f"{row['graph_nodes']:>5} nodes, peak RSS {row['rss_mb']} MB")
+        r = res["retention"]
+        print(f"  evicted {r['evicted_ttl']} expired + {r['evicted_lru']} LRU, {r['summaries']} summaries, "
+              f"{r['graph_pruned']} nodes pruned, retention time {r['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Query latency of memory retrieval at 10k / 100k / 1M chunks.
+
+    cd backend && python -m benchmarks.bench_retrieval [--sizes 10000,100000,1000000] [--dim 128]
+
+Vectors are random unit rows (embedding cost is measured separately on a
+small batch of real text via the hashing embedder).
+"""
+import argparse, json, time
+
+import numpy as np
+
+from embeddings import HashingEmbedder
+from vector_index import VectorIndex
+
+
+def _percentiles(samples_ms):
+    arr = np.asarray(samples_ms)
+    return {"p50_ms": round(float(np.percentile(arr, 50)), 3), "p99_ms": round(float(np.percentile(arr, 99)), 3)}
+
+
+def _random_unit(rng, n, dim):
+    v = rng.standard_normal((n, dim), dtype=np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return v
+
+
+def bench_size(n, dim, queries, k, ivf_min_rows, batch=50_000):
+    rng = np.random.default_rng(n)
+    index = VectorIndex(dim, ivf_min_rows=ivf_min_rows)
+    t0 = time.perf_counter()
+    for i in range(0, n, batch):
+        index.add(_random_unit(rng, min(batch, n - i), dim))
+    build_s = time.perf_counter() - t0
+
+    qs = _random_unit(rng, queries, dim)
+    lat = []
+    for q in qs:
+        t = time.perf_counter()
+        index.search(q, k)
+        lat.append((time.perf_counter() - t) * 1000)
+    mode = "ivf" if index._centroids is not None else "exact"
+    return {"chunks": n, "dim": dim, "mode": mode, "build_s": round(build_s, 2), **_percentiles(lat)}
+
+
+def bench_embedder(dim, n=1000):
+    texts = [f"chunk {i} about vector retrieval latency and memory packing for task {i % 97}" for i in range(n)]
+    emb = HashingEmbedder(dim)
+    t = time.perf_counter()
+    emb.embed(texts)
+    return {"embed_texts_per_s": round(n / (time.perf_counter() - t), 1)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    ap.add_argument("--dim", type=int, default=128)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--ivf-min-rows", type=int, default=50_000)
+    ap.add_argument("--json", action="store_true", help="print one JSON document instead of a table")
+    args = ap.parse_args()
+
+    rows = [bench_size(int(s), args.dim, args.queries, args.k, args.ivf_min_rows) for s in args.sizes.split(",")]
+    embed = bench_embedder(args.dim)
+    if args.json:
+        print(json.dumps({"retrieval": rows, **embed}, indent=2))
+        return
+    print(f"{'chunks':>10} {'mode':>6} {'build_s':>8} {'p50_ms':>8} {'p99_ms':>8}")
+    for r in rows:
+        print(f"{r['chunks']:>10} {r['mode']:>6} {r['build_s']:>8} {r['p50_ms']:>8} {r['p99_ms']:>8}")
+    print(f"hashing embedder: {embed['embed_texts_per_s']} texts/s")
+
+
+if __name__ == "__main__":
+    main()
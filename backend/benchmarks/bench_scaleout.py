@@ -0,0 +1,99 @@
+"""Tasks/s with 1..N worker processes sharing one task store and memory store.
+
+    cd backend && python -m benchmarks.bench_scaleout [--tasks 120] [--procs 1,2,4]
+
+Each process runs the real worker pool (claim -> retrieve -> stream from the
+stub model -> write result -> memory/graph -> complete) with LAB_SINGLETON=0,
+as `uvicorn main:app --workers N` would. The stub's latency dominates, so
+throughput should grow close to linearly with the process count. Also checks
+that every task completed exactly once and that the shared memory store
+holds every result.
+"""
+import argparse, asyncio, json, multiprocessing, os, sys, tempfile, time
+
+from benchmarks.stub_server import StubServer
+
+
+def _child(workdir, url, ready, go):
+    os.chdir(workdir)
+    os.environ.update(OLLAMA_URL=url + "/api/chat", SERPER_API_KEY="", LAB_SINGLETON="0",
+                      MEMORY_DIR=os.path.join(workdir, "memory_store"), CACHE_DISK="0", LLM_CACHE="0")
+    sys.stdout = open(os.devnull, "w")  # notify() prints per task
+    import autonomous_agent
+    from task_store import get_task_store
+
+    async def run():
+        shutdown = asyncio.Event()
+        store = get_task_store()
+
+        async def stop_when_drained():
+            while await asyncio.to_thread(store.has_pending):
+                await asyncio.sleep(0.05)
+            shutdown.set()
+
+        ready.wait()  # barrier: every process has finished importing
+        go.wait()
+        await asyncio.gather(autonomous_agent.run_worker_pool(shutdown, 1), stop_when_drained())
+
+    asyncio.run(run())
+
+
+def bench(procs, tasks, first_token_ms, tokens_per_sec):
+    stub = StubServer(first_token_ms=first_token_ms, tokens_per_sec=tokens_per_sec, reply_tokens=32).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "results"))
+        with open(os.path.join(tmp, "tasks.json"), "w") as f:
+            json.dump([{"id": i, "description": f"benchmark task {i}", "status": "pending"}
+                       for i in range(1, tasks + 1)], f)
+
+        ctx = multiprocessing.get_context("spawn")
+        ready, go = ctx.Barrier(procs + 1), ctx.Event()
+        workers = [ctx.Process(target=_child, args=(tmp, stub.url, ready, go)) for _ in range(procs)]
+        for p in workers:
+            p.start()
+        ready.wait()
+        t = time.perf_counter()
+        go.set()
+        for p in workers:
+            p.join()
+        elapsed = time.perf_counter() - t
+
+        from task_store import TaskStore
+        store = TaskStore(os.path.join(tmp, "tasks.db"), json_path=None)
+        db = store._conn()
+        completed = db.execute("SELECT COUNT(*) FROM tasks WHERE status = 'completed'").fetchone()[0]
+        claims = db.execute("SELECT COUNT(*) FROM task_events WHERE kind = 'claimed'").fetchone()[0]
+        from result_store import ResultStore
+        results = ResultStore(os.path.join(tmp, "results", "results.db"),
+                              os.path.join(tmp, "results", "segments")).stats()["results"]
+        from memory_store import MemoryStore
+        memory = MemoryStore(os.path.join(tmp, "memory_store"), shared=True)
+        rows, nodes = memory.refresh(), len(memory.node_metadata)
+        memory.close()
+    stub.stop()
+    return {"procs": procs, "tasks": tasks, "tasks_per_s": round(tasks / elapsed, 2), "completed": completed,
+            "claims": claims, "results": results,
+            "memory_rows": rows, "graph_nodes": nodes, "max_in_flight": stub.stats["max_in_flight"]}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=120)
+    ap.add_argument("--procs", default="1,2,4")
+    ap.add_argument("--first-token-ms", type=float, default=200, help="stub model latency before the first token")
+    ap.add_argument("--tokens-per-sec", type=float, default=200)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+    rows = [bench(int(n), args.tasks, args.first_token_ms, args.tokens_per_sec) for n in args.procs.split(",")]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    base = rows[0]["tasks_per_s"] / rows[0]["procs"]
+    for r in rows:
+        print(f"{r['procs']:>2} proc(s): {r['tasks_per_s']:>7} tasks/s  ({r['tasks_per_s'] / base / r['procs']:.0%} "
+              f"of linear)  completed {r['completed']}/{r['tasks']}, claims {r['claims']}, "
+              f"results {r['results']}, memory rows {r['memory_rows']}, graph nodes {r['graph_nodes']}")
+
+
+if __name__ == "__main__":
+    main()
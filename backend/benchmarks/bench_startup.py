@@ -0,0 +1,125 @@
+"""Startup: time to the first request and the first completed task.
+
+    cd backend && python -m benchmarks.bench_startup [--docs 50000] [--nodes 20000] [--load-ms 2000]
+
+Builds one persisted state (a memory store with --docs documents and a
+knowledge graph of --nodes nodes, one queued task), then boots the app in a
+fresh process per mode, with the stub model server charging --load-ms the
+first time a model is used (or after its keep_alive ran out):
+
+  eager  LAB_LAZY_START=0, OLLAMA_PREWARM=0: import and restore before serving
+  lazy   LAB_LAZY_START=1, OLLAMA_PREWARM=1: serve first, restore and load the
+         model in the background
+
+The app runs its real startup event under Starlette's TestClient, so the
+milestones are the ones /startup_metrics reports, in seconds since the
+process started.
+"""
+import argparse, json, multiprocessing, os, queue, shutil, sys, tempfile, time
+
+from benchmarks.stub_server import StubServer
+
+_MODES = {"eager": {"LAB_LAZY_START": "0", "OLLAMA_PREWARM": "0"},
+          "lazy": {"LAB_LAZY_START": "1", "OLLAMA_PREWARM": "1"}}
+
+
+def _fixture(path, docs, nodes):
+    from memory_store import MemoryStore
+    from embeddings import HashingEmbedder
+    store = MemoryStore(os.path.join(path, "memory_store"))
+    embedder = HashingEmbedder()
+    for start in range(0, docs, 5000):
+        texts = [f"fixture document {i} about retrieval, latency and queues" for i in range(start, min(docs, start + 5000))]
+        store.add_many(texts, [{"source": "upload"}] * len(texts), embedder.embed(texts))
+    ops = []
+    for i in range(nodes):
+        ops.append({"op": "node", "id": f"doc_{i}", "type": "document", "label": f"doc {i}"})
+        if i:
+            ops.append({"op": "edge", "source": f"doc_{i}", "target": f"doc_{i // 2}", "type": "related"})
+    with store._guard(exclusive=True):
+        store._log_graph_ops(ops)
+    store.close()
+    os.makedirs(os.path.join(path, "results"))
+    os.makedirs(os.path.join(path, "uploads"))
+    with open(os.path.join(path, "tasks.json"), "w", encoding="utf-8") as f:
+        json.dump([{"id": 1, "description": "startup benchmark task", "status": "pending"}], f)
+
+
+def _child(workdir, url, env, timeout, out):
+    os.chdir(workdir)
+    os.environ.update(OLLAMA_URL=url + "/api/chat", SERPER_API_KEY="", LAB_WORKERS="1", LAB_LOOP_INTERVAL="1",
+                      TASK_POLL_SEC="0.2", LLM_CACHE="0", **env)
+    sys.stdout = open(os.devnull, "w")
+    from starlette.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        client.get("/startup_metrics")
+        deadline = time.time() + timeout
+        while True:
+            stats = client.get("/startup_metrics").json()
+            if "first_task" in stats["phases"] or time.time() > deadline:
+                break
+            time.sleep(0.05)
+    out.put(stats)
+
+
+def run_mode(fixture, url, mode, timeout):
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.join(tmp, "lab")
+        shutil.copytree(fixture, workdir)
+        ctx = multiprocessing.get_context("spawn")  # a clean import of the app per run
+        out = ctx.Queue()
+        p = ctx.Process(target=_child, args=(workdir, url, _MODES[mode], timeout, out))
+        p.start()
+        while True:
+            try:
+                stats = out.get(timeout=1)
+                break
+            except queue.Empty:
+                if not p.is_alive():
+                    raise RuntimeError(f"{mode} run exited with code {p.exitcode}")
+        p.join()
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=50000)
+    ap.add_argument("--nodes", type=int, default=20000)
+    ap.add_argument("--load-ms", type=float, default=2000, help="stub model load time")
+    ap.add_argument("--first-token-ms", type=float, default=100)
+    ap.add_argument("--modes", default="eager,lazy")
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture = os.path.join(tmp, "fixture")
+        t = time.perf_counter()
+        _fixture(fixture, args.docs, args.nodes)
+        print(f"fixture: {args.docs} docs, {args.nodes} graph nodes in {time.perf_counter() - t:.1f}s",
+              file=sys.stderr)
+        for mode in args.modes.split(","):
+            # a fresh stub per run, so no model is resident from the previous one
+            stub = StubServer(first_token_ms=args.first_token_ms, load_ms=args.load_ms).start()
+            try:
+                results[mode] = run_mode(fixture, stub.url, mode, args.timeout)
+                results[mode]["stub_loads"] = dict(stub.stats["loads"])
+            finally:
+                stub.stop()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    phases = ("app_imported", "serving", "first_request", "pipeline_loaded", "state_restored", "model_loaded",
+              "first_task")
+    print(f"{'seconds since start':<20}" + "".join(f"{m:>10}" for m in results))
+    for phase in phases:
+        print(f"{phase:<20}" + "".join(f"{results[m]['phases'].get(phase, '-'):>10}" for m in results))
+    for mode, r in results.items():
+        print(f"{mode}: {r['durations']}, model loads {r['stub_loads']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Local SMTP and webhook sink for testing notifications offline.
+
+Accepts mail on one port (plain SMTP, no auth or TLS) and JSON POSTs on
+another, records each delivery and can fail a fraction of them, so batching,
+rate limits, retries and the dead-letter file can be exercised without a mail
+server or Slack:
+
+    cd backend && python -m benchmarks.notify_sink --smtp-port 2525 --http-port 8025 [--fail-rate 0.3]
+    NOTIFY_CHANNELS=console,webhook,email NOTIFY_WEBHOOK_URL=http://127.0.0.1:8025/hook \\
+        NOTIFY_SMTP_HOST=127.0.0.1 NOTIFY_SMTP_PORT=2525 NOTIFY_SMTP_TLS=0 uvicorn main:app
+
+    python -m benchmarks.notify_sink --check   # queue 200 notifications through the real dispatcher
+
+In-process use: NotifySink().start() serves on a background thread; see
+`received` and `stats`.
+"""
+import argparse, asyncio, json, os, random, sys, tempfile, threading, time
+
+
+class NotifySink:
+    def __init__(self, host: str = "127.0.0.1", smtp_port: int = 0, http_port: int = 0,
+                 fail_rate: float = 0.0, delay_ms: float = 0, seed: int = 0, echo: bool = False):
+        self.host = host
+        self.smtp_port = smtp_port
+        self.http_port = http_port
+        self.fail_rate = fail_rate
+        self.delay_ms = delay_ms
+        self.echo = echo
+        self._rng = random.Random(seed)
+        self.received = []  # {"kind": "smtp"|"http", "at", ...}
+        self.stats = {"smtp": 0, "http": 0, "failed": 0}
+        self._loop = None
+        self._servers = []
+        self._thread = None
+
+    @property
+    def webhook_url(self) -> str:
+        return f"http://{self.host}:{self.http_port}/hook"
+
+    def _fail(self) -> bool:
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            self.stats["failed"] += 1
+            return True
+        return False
+
+    def _record(self, entry: dict):
+        entry["at"] = time.time()
+        self.received.append(entry)
+        self.stats[entry["kind"]] += 1
+        if self.echo:
+            print(json.dumps(entry), flush=True)
+
+    # ---------- SMTP (the subset smtplib uses without auth or TLS) ----------
+    async def _smtp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def reply(line: str):
+            writer.write((line + "\r\n").encode("ascii"))
+
+        mail_from, rcpt = None, []
+        reply("220 notify-sink ESMTP")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                cmd = line.decode("utf-8", "replace").strip()
+                verb = cmd.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    reply("250-notify-sink")
+                    reply("250 8BITMIME")
+                elif verb == "HELO":
+                    reply("250 notify-sink")
+                elif verb == "MAIL":
+                    mail_from, rcpt = cmd.split(":", 1)[1].strip(), []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt.append(cmd.split(":", 1)[1].strip())
+                    reply("250 OK")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    lines = []
+                    while True:
+                        raw = await reader.readline()
+                        if raw in (b".\r\n", b".\n", b""):
+                            break
+                        lines.append(raw[1:] if raw.startswith(b"..") else raw)
+                    await asyncio.sleep(self.delay_ms / 1000)
+                    if self._fail():
+                        reply("451 Temporary failure (notify-sink)")
+                    else:
+                        message = b"".join(lines).decode("utf-8", "replace")
+                        self._record({"kind": "smtp", "from": mail_from, "to": rcpt, "message": message})
+                        reply("250 OK queued")
+                elif verb == "RSET":
+                    mail_from, rcpt = None, []
+                    reply("250 OK")
+                elif verb == "NOOP":
+                    reply("250 OK")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    # ---------- webhook (HTTP/1.1 POST, keep-alive) ----------
+    async def _http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = line.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                await asyncio.sleep(self.delay_ms / 1000)
+                if method != "POST":
+                    status, raw = "404 Not Found", b"not found"
+                elif self._fail():
+                    status, raw = "503 Service Unavailable", b"notify-sink failure"
+                else:
+                    self._record({"kind": "http", "path": path, "payload": json.loads(body or b"{}")})
+                    status, raw = "200 OK", b"ok"  # what Slack answers
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(raw)}\r\n\r\n"
+                             .encode("latin-1") + raw)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    # ---------- lifecycle ----------
+    async def serve(self):
+        smtp = await asyncio.start_server(self._smtp, self.host, self.smtp_port)
+        web = await asyncio.start_server(self._http, self.host, self.http_port)
+        self.smtp_port = smtp.sockets[0].getsockname()[1]
+        self.http_port = web.sockets[0].getsockname()[1]
+        self._servers = [smtp, web]
+
+    def start(self) -> "NotifySink":
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            for server in self._servers:
+                self._loop.call_soon_threadsafe(server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+def _check(args):
+    """Push notifications through the real dispatcher into a sink and report what arrived."""
+    sink = NotifySink(fail_rate=args.fail_rate).start()
+    dead = os.path.join(tempfile.mkdtemp(), "dead_letter.jsonl")
+    os.environ.update(NOTIFY_CHANNELS="webhook,email", NOTIFY_WEBHOOK_URL=sink.webhook_url,
+                      NOTIFY_SMTP_HOST=sink.host, NOTIFY_SMTP_PORT=str(sink.smtp_port), NOTIFY_SMTP_TLS="0",
+                      NOTIFY_EMAIL_TO="lab@localhost", NOTIFY_BATCH_MAX="webhook=20,email=50",
+                      NOTIFY_BATCH_SEC="webhook=0.5,email=1", NOTIFY_RATE_PER_MIN="webhook=600,email=120",
+                      NOTIFY_BACKOFF_SEC="0.05", NOTIFY_RETRIES=str(args.retries), NOTIFY_DEAD_LETTER=dead)
+    from notifier import dispatcher, notify
+    from http_client import http
+
+    async def run():
+        t0 = time.perf_counter()
+        for i in range(args.count):
+            notify(f"Task {i} Completed", f"Result saved for task: check {i}")
+        enqueue_ms = (time.perf_counter() - t0) * 1000
+        await asyncio.sleep(args.wait)
+        await dispatcher.aclose()
+        await http.aclose()
+        return enqueue_ms
+
+    enqueue_ms = asyncio.run(run())
+    sink.stop()
+    dead_count = 0
+    if os.path.exists(dead):
+        with open(dead, encoding="utf-8") as f:
+            dead_count = sum(len(json.loads(line)["notifications"]) for line in f)
+    hooked = sum(len(r["payload"].get("notifications", [])) for r in sink.received if r["kind"] == "http")
+    print(f"{args.count} notifications queued in {enqueue_ms:.2f} ms ({1000 * enqueue_ms / args.count:.1f} us each)")
+    print(f"webhook: {sink.stats['http']} posts carrying {hooked} notifications; "
+          f"email: {sink.stats['smtp']} messages; sink failures injected: {sink.stats['failed']}")
+    print(f"dead-lettered: {dead_count} ({dead})")
+    print(json.dumps(dispatcher.stats(), indent=2))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--smtp-port", type=int, default=2525)
+    ap.add_argument("--http-port", type=int, default=8025)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of deliveries answered with a failure")
+    ap.add_argument("--delay-ms", type=float, default=0)
+    ap.add_argument("--check", action="store_true", help="run notifications through the dispatcher and exit")
+    ap.add_argument("--count", type=int, default=200)
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--wait", type=float, default=3.0, help="--check: seconds to let batches go out")
+    args = ap.parse_args()
+    if args.check:
+        return _check(args)
+    sink = NotifySink(smtp_port=args.smtp_port, http_port=args.http_port, fail_rate=args.fail_rate,
+                      delay_ms=args.delay_ms, echo=True)
+
+    async def run():
+        await sink.serve()
+        print(f"notify sink: SMTP on {sink.host}:{sink.smtp_port}, webhook on {sink.webhook_url}",
+              file=sys.stderr, flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
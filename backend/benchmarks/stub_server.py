@@ -0,0 +1,246 @@
+"""Local stand-in for Ollama (/api/chat) and Serper (/search).
+
+Plain asyncio HTTP/1.1 with keep-alive and chunked NDJSON streaming, so the
+real client code paths (pooling, streaming, retries) run unchanged offline.
+
+    cd backend && python -m benchmarks.stub_server --port 11434 --first-token-ms 200 --tokens-per-sec 40
+
+In-process use (e.g. from a benchmark):
+
+    stub = StubServer(first_token_ms=50).start()   # serves on a background thread
+    os.environ["OLLAMA_URL"] = stub.url + "/api/chat"
+    ...
+    stub.stop()
+"""
+import argparse, asyncio, json, random, threading
+
+
+class StubServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, first_token_ms: float = 50,
+                 tokens_per_sec: float = 200, reply_tokens: int = 32, fail_rate: float = 0.0,
+                 search_ms: float = 20, seed: int = 0, parallel: int = 0, model_first_token_ms=None,
+                 load_ms: float = 0):
+        self.host = host
+        self.port = port
+        self.first_token_ms = first_token_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.fail_rate = fail_rate
+        self.search_ms = search_ms
+        # like OLLAMA_NUM_PARALLEL: chats per model generating at once, the rest wait (0 = unlimited)
+        self.parallel = parallel
+        self.model_first_token_ms = dict(model_first_token_ms or {})  # e.g. a small decider model
+        self._model_slots = {}
+        # like Ollama's model residency: a call to a model that is not loaded waits load_ms,
+        # and each call keeps it loaded for its keep_alive; an empty chat only loads
+        self.load_ms = load_ms
+        self._resident = {}     # model -> loop time it unloads
+        self._load_locks = {}
+        self._rng = random.Random(seed)
+        self.stats = {"connections": 0, "requests": 0, "failures": 0, "in_flight": 0, "max_in_flight": 0,
+                      "chats": {}, "loads": {}}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._handlers = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # ---------- HTTP plumbing ----------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = line.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                self.stats["requests"] += 1
+                self.stats["in_flight"] += 1
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+                try:
+                    await self._route(method, path, json.loads(body or b"{}"), writer)
+                finally:
+                    self.stats["in_flight"] -= 1
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    @staticmethod
+    def _head(writer, status: int, content_type: str, length=None):
+        reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}.get(status, "OK")
+        lines = [f"HTTP/1.1 {status} {reason}", f"Content-Type: {content_type}"]
+        lines.append(f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    def _send_json(self, writer, status: int, obj):
+        raw = json.dumps(obj).encode("utf-8")
+        self._head(writer, status, "application/json", len(raw))
+        writer.write(raw)
+
+    @staticmethod
+    async def _send_chunk(writer, raw: bytes):
+        writer.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+        await writer.drain()
+
+    # ---------- routes ----------
+    async def _route(self, method: str, path: str, body: dict, writer):
+        if path.startswith("/api/chat"):
+            await self._chat(body, writer)
+        elif path.startswith("/search"):
+            await asyncio.sleep(self.search_ms / 1000)
+            q = body.get("q", "")
+            rows = [{"title": f"{q} result {i}", "link": f"https://example.com/{i}",
+                     "snippet": f"Snippet {i} about {q}."} for i in range(int(body.get("num", 3)))]
+            self._send_json(writer, 200, {"organic": rows})
+        else:
+            self._send_json(writer, 404, {"error": "not found"})
+        await writer.drain()
+
+    def _reply_for(self, body: dict) -> str:
+        last = (body.get("messages") or [{}])[-1].get("content", "")
+        system = (body.get("messages") or [{}])[0].get("content", "")
+        if "do_search" in system:  # agent._DECIDER
+            return json.dumps({"do_search": True, "query": " ".join((last.splitlines() or [""])[0].split()[:5])})
+        return " ".join(f"tok{i}" for i in range(self.reply_tokens))
+
+    @staticmethod
+    def _keep_alive_sec(value) -> float:
+        """Ollama's keep_alive: seconds, or a duration like "30s", "3m", "1h"; negative = forever."""
+        if value is None:
+            return 300.0
+        if isinstance(value, str) and value[-1:] in ("s", "m", "h"):
+            sec = float(value[:-1]) * {"s": 1, "m": 60, "h": 3600}[value[-1]]
+        else:
+            sec = float(value)
+        return float("inf") if sec < 0 else sec
+
+    async def _load(self, body: dict):
+        model = body.get("model", "")
+        loop = asyncio.get_running_loop()
+        async with self._load_locks.setdefault(model, asyncio.Lock()):
+            if self._resident.get(model, 0) <= loop.time():
+                self.stats["loads"][model] = self.stats["loads"].get(model, 0) + 1
+                await asyncio.sleep(self.load_ms / 1000)
+            self._resident[model] = loop.time() + self._keep_alive_sec(body.get("keep_alive"))
+
+    async def _chat(self, body: dict, writer):
+        model = body.get("model", "")
+        await self._load(body)
+        if not body.get("messages"):
+            self._send_json(writer, 200, {"model": model, "done": True, "done_reason": "load",
+                                          "message": {"role": "assistant", "content": ""}})
+            return
+        self.stats["chats"][model] = self.stats["chats"].get(model, 0) + 1
+        if not self.parallel:
+            return await self._generate(body, writer)
+        slots = self._model_slots.setdefault(model, asyncio.Semaphore(self.parallel))
+        async with slots:
+            await self._generate(body, writer)
+
+    async def _generate(self, body: dict, writer):
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            self.stats["failures"] += 1
+            self._send_json(writer, 503, {"error": "stub failure"})
+            return
+        reply = self._reply_for(body)
+        first_token_ms = self.model_first_token_ms.get(body.get("model"), self.first_token_ms)
+        words = reply.split(" ")
+        gen_s = len(words) / self.tokens_per_sec if self.tokens_per_sec else 0
+        stats = {"prompt_eval_count": sum(len(m.get("content", "")) // 4 for m in body.get("messages", [])),
+                 "prompt_eval_duration": int(first_token_ms * 1e6),
+                 "eval_count": len(words), "eval_duration": int(gen_s * 1e9)}
+        await asyncio.sleep(first_token_ms / 1000)
+        if not body.get("stream"):
+            await asyncio.sleep(gen_s)
+            self._send_json(writer, 200, {"model": body.get("model"), "done": True,
+                                          "message": {"role": "assistant", "content": reply}, **stats})
+            return
+        self._head(writer, 200, "application/x-ndjson")
+        for i, word in enumerate(words):
+            piece = word if i == 0 else " " + word
+            await self._send_chunk(writer, (json.dumps({"message": {"role": "assistant", "content": piece},
+                                                         "done": False}) + "\n").encode())
+            if self.tokens_per_sec:
+                await asyncio.sleep(1 / self.tokens_per_sec)
+        await self._send_chunk(writer, (json.dumps({"message": {"role": "assistant", "content": ""},
+                                                     "done": True, **stats}) + "\n").encode())
+        writer.write(b"0\r\n\r\n")
+
+    # ---------- lifecycle ----------
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self) -> "StubServer":
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    async def _shutdown(self):
+        self._server.close()
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+            self._thread.join(timeout=5)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--first-token-ms", type=float, default=200)
+    ap.add_argument("--tokens-per-sec", type=float, default=40)
+    ap.add_argument("--reply-tokens", type=int, default=64)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--parallel", type=int, default=0, help="chats generating at once per model (0 = unlimited)")
+    ap.add_argument("--load-ms", type=float, default=0, help="model load time when it is not resident")
+    args = ap.parse_args()
+    stub = StubServer(port=args.port, first_token_ms=args.first_token_ms, tokens_per_sec=args.tokens_per_sec,
+                      reply_tokens=args.reply_tokens, fail_rate=args.fail_rate, parallel=args.parallel,
+                      load_ms=args.load_ms)
+
+    async def run():
+        server = await stub.serve()
+        print(f"stub Ollama/Serper on {stub.url} (chat: /api/chat, search: /search)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import os, json, time, asyncio, hashlib, sqlite3, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# ------- Config ----------
+CACHE_DB = os.getenv("CACHE_DB", "./cache.db")       # on-disk tier, shared by all caches
+CACHE_DISK = os.getenv("CACHE_DISK", "1") == "1"      # 0 = memory only
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "512"))
+LLM_CACHE_DISK_BYTES = int(os.getenv("LLM_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+WEB_CACHE_TTL_SEC = float(os.getenv("WEB_CACHE_TTL_SEC", "3600"))
+WEB_CACHE_ENTRIES = int(os.getenv("WEB_CACHE_ENTRIES", "256"))
+WEB_CACHE_DISK_BYTES = int(os.getenv("WEB_CACHE_DISK_BYTES", str(32 * 1024 * 1024)))
+_TOUCH_BATCH = 64  # disk-tier reads whose access times are written together
+
+
+def content_key(*parts) -> str:
+    """Stable hash of JSON-serialisable parts (dict key order does not matter)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-memory LRU bounded by entry count and total string length, with optional TTL."""
+
+    def __init__(self, max_entries: int, max_bytes: int = 64 * 1024 * 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, size, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            self._pop(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, expires_at: Optional[float] = None):
+        if key in self._data:
+            self._pop(key)
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        size = len(value)
+        self._data[key] = (value, size, expires_at)
+        self._bytes += size
+        while len(self._data) > self.max_entries or (self._bytes > self.max_bytes and len(self._data) > 1):
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def _pop(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+@contextmanager
+def _tx(db: sqlite3.Connection):
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+class DiskCache:
+    """SQLite tier: one table per namespace, evicting least-recently-used rows past max_bytes.
+
+    Blocking (and the file may be locked by another process): TieredCache
+    calls it from worker threads. The byte total is kept in the DB, so
+    processes sharing the file share the limit. Reads note their access
+    time in memory; the times are written with the next set, or once
+    _TOUCH_BATCH have piled up, so a hit is no write of its own.
+    """
+
+    def __init__(self, path: str, namespace: str, max_bytes: int):
+        self.path = path
+        self.namespace = namespace
+        self.table = f"cache_{namespace}"
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = None  # opened on first use, in the calling thread
+        self._touched = {}  # key -> last read, not yet written
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")  # a lost cache write is harmless
+            db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT, "
+                       f"size INTEGER, expires_at REAL, accessed_at REAL)")
+            db.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_accessed ON {self.table}(accessed_at)")
+            db.execute("CREATE TABLE IF NOT EXISTS cache_sizes (namespace TEXT PRIMARY KEY, bytes INTEGER)")
+            with _tx(db):  # a file from before the totals were kept: count once
+                db.execute(f"INSERT OR IGNORE INTO cache_sizes SELECT ?, COALESCE(SUM(size), 0) FROM {self.table}",
+                           (self.namespace,))
+            self._db = db
+        return self._db
+
+    def get(self, key: str):
+        """Return (value, expires_at) or None."""
+        with self._lock:
+            db = self._conn()
+            row = db.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < time.time():
+                with _tx(db):
+                    self._delete(db, key)
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= _TOUCH_BATCH:
+                with _tx(db):
+                    self._write_touched(db)
+            return row
+
+    def set(self, key: str, value: str, expires_at: Optional[float]):
+        with self._lock:
+            db = self._conn()
+            with _tx(db):
+                self._write_touched(db)
+                self._delete(db, key)
+                db.execute(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                           (key, value, len(value), expires_at, time.time()))
+                db.execute("UPDATE cache_sizes SET bytes = bytes + ? WHERE namespace = ?", (len(value), self.namespace))
+                total = db.execute("SELECT bytes FROM cache_sizes WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+                while total > self.max_bytes:
+                    row = db.execute(f"SELECT key FROM {self.table} ORDER BY accessed_at LIMIT 1").fetchone()
+                    if row is None:
+                        break
+                    total -= self._delete(db, row[0])
+                    self.evictions += 1
+
+    def _write_touched(self, db: sqlite3.Connection):
+        if self._touched:
+            db.executemany(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                           [(at, key) for key, at in self._touched.items()])
+            self._touched = {}
+
+    def _delete(self, db: sqlite3.Connection, key: str) -> int:
+        row = db.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return 0
+        db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        db.execute("UPDATE cache_sizes SET bytes = bytes - ? WHERE namespace = ?", (row[0], self.namespace))
+        return row[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class TieredCache:
+    """Memory LRU in front of an optional disk tier; disk hits are promoted to memory.
+    From the event loop use aget/aset, which go to the disk tier in a worker thread.
+    """
+
+    def __init__(self, name: str, max_entries: int, disk_bytes: int, ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl=ttl)
+        self.disk = DiskCache(CACHE_DB, name, disk_bytes) if CACHE_DISK else None
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    def _from_memory(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits["memory"] += 1
+        return value
+
+    def _from_disk(self, key: str, row) -> Optional[str]:
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits["disk"] += 1
+        self.memory.set(key, row[0], expires_at=row[1])
+        return row[0]
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._from_memory(key)
+        if value is None:
+            value = self._from_disk(key, self.disk.get(key) if self.disk is not None else None)
+        return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        value = self._from_memory(key)
+        if value is None:
+            row = await asyncio.to_thread(self.disk.get, key) if self.disk is not None else None
+            value = self._from_disk(key, row)
+        return value
+
+    def _to_memory(self, key: str, value: str) -> Optional[float]:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        self.memory.set(key, value, expires_at=expires_at)
+        return expires_at
+
+    def set(self, key: str, value: str):
+        expires_at = self._to_memory(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value, expires_at)
+
+    async def aset(self, key: str, value: str):
+        expires_at = self._to_memory(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value, expires_at)
+
+    def stats(self) -> dict:
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "hits_memory": self.hits["memory"],
+            "hits_disk": self.hits["disk"],
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+            "entries_memory": len(self.memory),
+            "entries_disk": len(self.disk) if self.disk is not None else 0,
+            "evictions_memory": self.memory.evictions,
+            "evictions_disk": self.disk.evictions if self.disk is not None else 0,
+        }
+
+
+# ---------- named caches ----------
+_caches: Dict[str, TieredCache] = {}
+
+
+def get_cache(name: str) -> TieredCache:
+    if name not in _caches:
+        if name == "llm":
+            _caches[name] = TieredCache("llm", LLM_CACHE_ENTRIES, LLM_CACHE_DISK_BYTES)
+        elif name == "web":
+            _caches[name] = TieredCache("web", WEB_CACHE_ENTRIES, WEB_CACHE_DISK_BYTES, ttl=WEB_CACHE_TTL_SEC)
+        else:
+            raise KeyError(name)
+    return _caches[name]
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
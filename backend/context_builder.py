@@ -0,0 +1,104 @@
+import os, re, zlib
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# ------- Config ----------
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "1050"))
+# prompt-side budget (system + task + context); the rest of num_ctx is left for the reply
+CONTEXT_BUDGET_TOKENS = int(os.getenv("CONTEXT_BUDGET_TOKENS", str(OLLAMA_NUM_CTX - OLLAMA_NUM_PREDICT)))
+DEDUPE_OVERLAP = float(os.getenv("CONTEXT_DEDUPE_OVERLAP", "0.6"))  # shingle containment that counts as a repeat
+MIN_PARTIAL_TOKENS = 48  # don't bother including a chunk tail shorter than this
+_SHINGLE = 5
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# ---------- token counting ----------
+def approx_tokens(text: str) -> int:
+    """Tokenizer-free estimate: one token per punctuation mark or short word,
+    roughly one per 4 characters of longer words (close to BPE on English prose).
+    """
+    return sum(max(1, (len(p) + 3) // 4) for p in _PIECE_RE.findall(text or ""))
+
+
+_counter: Callable[[str], int] = approx_tokens
+
+
+def count_tokens(text: str) -> int:
+    return _counter(text)
+
+
+def set_token_counter(fn: Callable[[str], int]):
+    """Plug in a real tokenizer, e.g. lambda s: len(tok.encode(s))."""
+    global _counter
+    _counter = fn
+
+
+# ---------- helpers ----------
+def _shingles(text: str) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < _SHINGLE:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + _SHINGLE]).encode("utf-8")) for i in range(len(words) - _SHINGLE + 1)}
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Longest prefix (cut at a word boundary) that fits in max_tokens."""
+    words = text.split(" ")
+    lo, hi = 0, len(words)
+    while lo < hi:  # binary search on the number of words kept
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo])
+
+
+# ---------- builder ----------
+def build_context(fixed_text: str, chunks: Iterable[Tuple[str, float]], brief: str = "",
+                  budget: Optional[int] = None) -> Tuple[str, dict]:
+    """Pack retrieved chunks (and an optional WebBrief) into what is left of the
+    token budget after `fixed_text` (system brief + task prompt).
+
+    Chunks are taken best score first; the brief ranks above all of them since
+    it was fetched for this task. A chunk mostly covered by one already taken
+    is skipped, and the last chunk that does not fit is cut at a word boundary.
+    Returns (context text, report) where report counts what was dropped.
+    """
+    budget = CONTEXT_BUDGET_TOKENS if budget is None else budget
+    available = max(0, budget - count_tokens(fixed_text))
+    candidates: List[Tuple[str, float, str]] = []
+    if brief and brief.strip():
+        candidates.append(("WebBrief:\n" + brief.strip(), float("inf"), "brief"))
+    candidates += sorted(((t.strip(), s, "memory") for t, s in chunks if t and t.strip()), key=lambda c: -c[1])
+
+    report = {"budget": budget, "available": available, "used": 0, "candidates": len(candidates),
+              "included": 0, "truncated": 0, "deduped": 0, "dropped": 0, "dropped_tokens": 0}
+    picked, seen = [], []
+    for text, _, kind in candidates:
+        tokens = count_tokens(text)
+        sh = _shingles(text)
+        if kind == "memory" and sh and any(len(sh & s) / min(len(sh), len(s)) >= DEDUPE_OVERLAP for s in seen if s):
+            report["deduped"] += 1
+            report["dropped_tokens"] += tokens
+            continue
+        room = available - report["used"]
+        if tokens <= room:
+            picked.append(text)
+            report["used"] += tokens
+        elif room >= MIN_PARTIAL_TOKENS:
+            cut = _truncate(text, room)
+            used = count_tokens(cut)
+            picked.append(cut)
+            report["used"] += used
+            report["truncated"] += 1
+            report["dropped_tokens"] += tokens - used
+        else:
+            report["dropped"] += 1
+            report["dropped_tokens"] += tokens
+            continue
+        seen.append(sh)
+        report["included"] += 1
+    return "\n\n".join(picked), report
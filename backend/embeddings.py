@@ -0,0 +1,77 @@
+import os, re, hashlib
+from typing import List, Optional
+
+import numpy as np
+
+# ------- Config ----------
+EMBEDDER = os.getenv("EMBEDDER", "hashing")  # "hashing" (offline) or "ollama"
+EMBED_DIM = int(os.getenv("EMBED_DIM", "256"))
+OLLAMA_EMBED_URL = os.getenv("OLLAMA_EMBED_URL", "http://localhost:11434/api/embed")
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vecs / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder: unigrams + bigrams, signed buckets.
+    No model and no network, so tests and offline runs get stable vectors.
+    """
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        toks = _TOKEN_RE.findall((text or "").lower())
+        return toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+                out[row, h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return _normalize(out)
+
+
+class OllamaEmbedder:
+    """Embeddings from a local Ollama server (/api/embed). Dim is learned on first call.
+    Blocking (one HTTP round-trip per call): call it from a worker thread, not the event loop.
+    """
+
+    def __init__(self, url: str = OLLAMA_EMBED_URL, model: str = OLLAMA_EMBED_MODEL):
+        self.url = url
+        self.model = model
+        self.dim: Optional[int] = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        import requests
+        resp = requests.post(self.url, json={"model": self.model, "input": list(texts)}, timeout=60)
+        resp.raise_for_status()
+        vecs = np.asarray(resp.json().get("embeddings") or [], dtype=np.float32)
+        if vecs.ndim != 2 or len(vecs) != len(texts):
+            raise ValueError("Ollama returned no embeddings")
+        self.dim = vecs.shape[1]
+        return _normalize(vecs)
+
+
+# ---------- pluggable default ----------
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        _embedder = OllamaEmbedder() if EMBEDDER == "ollama" else HashingEmbedder()
+    return _embedder
+
+
+def set_embedder(embedder):
+    """Swap the embedder (anything with .embed(list[str]) -> (n, dim) float32, L2-normalized)."""
+    global _embedder
+    _embedder = embedder
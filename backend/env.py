@@ -0,0 +1,4 @@
+"""Loads .env into the environment once per process; import it before reading settings."""
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Dict, Optional
+
+# Sentinels delivered to subscriber queues
+END = object()     # stream finished
+LAGGED = object()  # subscriber fell too far behind and was dropped; reconnect to resync
+
+SUBSCRIBER_QUEUE = 1024
+
+
+class Broadcaster:
+    """In-process fan-out: every published event goes to every subscriber queue.
+
+    Queues are bounded; a subscriber that cannot keep up gets LAGGED and is
+    dropped instead of stalling the publisher or growing without limit.
+    Must be created on the event loop; publish_threadsafe() may be called
+    from worker threads.
+    """
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE):
+        self.maxsize = maxsize
+        self._subs = set()
+        self._loop = asyncio.get_running_loop()
+
+    def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue(self.maxsize)
+        self._subs.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self._subs.discard(q)
+
+    def publish(self, event):
+        for q in list(self._subs):
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                self._subs.discard(q)
+                q.get_nowait()  # make room for the marker
+                q.put_nowait(LAGGED)
+
+    def publish_threadsafe(self, event):
+        self._loop.call_soon_threadsafe(self.publish, event)
+
+    def close(self):
+        self.publish(END)
+        self._subs.clear()
+
+
+class TaskStreams:
+    """One Broadcaster per running task, for token-level output streaming."""
+
+    def __init__(self):
+        self._streams: Dict[int, Broadcaster] = {}
+
+    def open(self, task_id: int) -> Broadcaster:
+        self._streams[task_id] = Broadcaster()
+        return self._streams[task_id]
+
+    def close(self, task_id: int):
+        stream = self._streams.pop(task_id, None)
+        if stream is not None:
+            stream.close()
+
+    def subscribe(self, task_id: int) -> Optional[asyncio.Queue]:
+        stream = self._streams.get(task_id)
+        return stream.subscribe() if stream is not None else None
+
+    def unsubscribe(self, task_id: int, q: asyncio.Queue):
+        stream = self._streams.get(task_id)
+        if stream is not None:
+            stream.unsubscribe(q)
+
+
+token_streams = TaskStreams()
@@ -1,30 +1,230 @@
-import os
+import re, hashlib
+from typing import Iterable, Iterator, List, Tuple
 
-def extract_text(file_path, file_type):
+import numpy as np
+
+from context_builder import count_tokens
+
+TEXT_BLOCK = 1 << 20  # chars read per step from plain-text files
+PAGE_BREAK = "\f"     # between PDF pages in the text stream
+
+_BREAK_RE = re.compile(r"\f|\n[ \t]*\n")  # page or paragraph boundary
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_MD_HEADING_RE = re.compile(r"#{1,6}\s+\S")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_HEADING_MAX_CHARS = 80
+
+
+def iter_text(file_path, file_type):
+    """Yield a file's text piece by piece (pages for PDF, blocks for txt)
+    so large uploads never sit in memory whole.
+    """
     ft = (file_type or "").lower()
 
-    if ft == "txt":
+    if ft in ("txt", "md"):
         with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+            for block in iter(lambda: f.read(TEXT_BLOCK), ""):
+                yield block
+        return
 
     if ft == "pdf":
         try:
             from pypdf import PdfReader  # pip install pypdf
         except ImportError:
-            return ""
-        text = []
+            return
         with open(file_path, "rb") as f:
             reader = PdfReader(f)
-            for page in reader.pages:
-                text.append(page.extract_text() or "")
-        return "\n".join(text).strip()
+            for i, page in enumerate(reader.pages):
+                yield (PAGE_BREAK if i else "") + (page.extract_text() or "")
+        return
 
     if ft in ("docx",):
         try:
             import docx2txt  # pip install docx2txt
         except ImportError:
-            return ""
-        return (docx2txt.process(file_path) or "").strip()
+            return
+        yield (docx2txt.process(file_path) or "").strip()
+        return
 
     # TODO: add OCR for scanned PDFs (pytesseract) if needed
-    return ""
\ No newline at end of file
+
+
+def extract_text(file_path, file_type):
+    return "".join(iter_text(file_path, file_type)).replace(PAGE_BREAK, "\n").strip()
+
+
+# ---------- structure-aware chunking ----------
+def _is_heading(line: str) -> bool:
+    """A markdown heading, or a short title-like line (capitalized, no closing punctuation)."""
+    if _MD_HEADING_RE.match(line):
+        return True
+    return (len(line) <= _HEADING_MAX_CHARS and line[:1].isupper() and line[-1:] not in ".!?,;:\"')"
+            and len(line.split()) <= 12)
+
+
+def _blocks_of(text: str, offset: int, page: int):
+    lead = len(text) - len(text.lstrip())
+    text, offset = text.strip(), offset + lead
+    if not text:
+        return
+    first, _, rest = text.partition("\n")
+    first = first.strip()
+    if _MD_HEADING_RE.match(first) or (not rest and _is_heading(first)):
+        yield offset, page, first.lstrip("#").strip(), True
+        if rest.strip():
+            yield from _blocks_of(rest, offset + len(text) - len(rest), page)
+        return
+    yield offset, page, text, False
+
+
+def iter_blocks(pieces: Iterable[str]) -> Iterator[Tuple[int, int, str, bool]]:
+    """Split a stream of text pieces at paragraph and page boundaries into
+    (offset, page, text, is_heading); offsets are chars into the stream, pages count from 1.
+    """
+    buf, base, page = "", 0, 1
+    for piece in pieces:
+        buf += piece
+        pos = 0
+        for m in _BREAK_RE.finditer(buf):
+            yield from _blocks_of(buf[pos:m.start()], base + pos, page)
+            if m.group() == PAGE_BREAK:
+                page += 1
+            pos = m.end()
+        buf, base = buf[pos:], base + pos
+        if len(buf) > TEXT_BLOCK:
+            # no paragraph break in sight: cut at a line end rather than buffer the file
+            cut = buf.rfind("\n", 0, TEXT_BLOCK) + 1 or TEXT_BLOCK
+            yield from _blocks_of(buf[:cut], base, page)
+            buf, base = buf[cut:], base + cut
+    yield from _blocks_of(buf, base, page)
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Word windows of at most max_tokens, for a sentence too long to keep whole."""
+    out, words, used = [], [], 0
+    for word in text.split():
+        n = count_tokens(word)
+        if words and used + n > max_tokens:
+            out.append(" ".join(words))
+            words, used = [], 0
+        words.append(word)
+        used += n
+    if words:
+        out.append(" ".join(words))
+    return out
+
+
+def _units(text: str, offset: int, page: int, max_tokens: int):
+    """A paragraph as (offset, page, sep, text, tokens) sentence units; sep joins it to
+    the previous unit: a blank line before the paragraph's first, a space inside it.
+    """
+    pos, sep = 0, "\n\n"
+    for sentence in _SENTENCE_RE.split(text):
+        at = text.find(sentence, pos)
+        pos = at + len(sentence)
+        sentence = " ".join(sentence.split())
+        n = count_tokens(sentence)
+        parts = [sentence] if n <= max_tokens else _split_long(sentence, max_tokens)
+        for part in parts:
+            yield offset + at, page, sep, part, (n if len(parts) == 1 else count_tokens(part))
+            sep = " "
+
+
+def iter_chunks(pieces: Iterable[str], max_tokens: int = 384, overlap: int = 48
+                ) -> Iterator[Tuple[int, str, dict]]:
+    """Pack a stream of text pieces into (offset, chunk, info) windows of up to
+    `max_tokens`, breaking at paragraph ends where possible and at sentence ends
+    otherwise. Each window repeats up to `overlap` tokens of trailing sentences
+    from the one before; a heading starts a new window and prefixes every window
+    of its section. info: {"page": first page, "heading": section heading or None}.
+    """
+    window, used, fresh = [], 0, 0  # fresh: units not carried over from the previous window
+    heading, head_tokens = None, 0
+
+    def emit():
+        body = "".join(u[2] + u[3] if i else u[3] for i, u in enumerate(window))
+        text = f"{heading}\n\n{body}" if heading else body
+        return window[0][0], text, {"page": window[0][1], "heading": heading}
+
+    def carry():
+        kept, n = [], 0
+        for u in reversed(window):
+            if n + u[4] > overlap:
+                break
+            kept.insert(0, u)
+            n += u[4]
+        return kept, n
+
+    for offset, page, text, is_heading in iter_blocks(pieces):
+        if is_heading:
+            if fresh:
+                yield emit()
+            window, used, fresh = [], 0, 0
+            heading = text[:_HEADING_MAX_CHARS * 2]
+            head_tokens = count_tokens(heading) + 1
+            continue
+        budget = max(16, max_tokens - head_tokens)
+        para_tokens = count_tokens(text)
+        # a paragraph that fits a window of its own starts one rather than
+        # being cut, once the current window is at least half full
+        if fresh and used + para_tokens > budget and para_tokens <= budget - overlap and used >= budget // 2:
+            yield emit()
+            window, used = carry()
+            fresh = 0
+        for unit in _units(text, offset, page, budget):
+            if fresh and used + unit[4] > budget:
+                yield emit()
+                window, used = carry()
+                fresh = 0
+                while window and used + unit[4] > budget:
+                    used -= window.pop(0)[4]
+            window.append(unit)
+            used += unit[4]
+            fresh += 1
+    if fresh:
+        yield emit()
+
+
+# ---------- near-duplicate fingerprints ----------
+def simhash(text: str) -> int:
+    """64-bit SimHash over word trigrams; near-identical texts differ in few bits."""
+    words = _WORD_RE.findall(text.lower())
+    grams = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))] if words else []
+    if not grams:
+        return 0
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little")
+                          for g in grams), dtype=np.uint64, count=len(grams))
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(grams)
+    return int(np.packbits(votes, bitorder="little").view("<u8")[0])
+
+
+def file_sha256(file_path) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extract_chunks(file_path, file_type, max_tokens, overlap, known_hash=None):
+    """Pool-process entry point: hash the file and, unless the hash equals
+    `known_hash` (touched but unchanged), stream its text into chunks.
+    Returns (sha256, iterator of (offset, chunk, info), or None); info carries
+    the page (PDFs only) and section heading when there is one.
+    """
+    digest = file_sha256(file_path)
+    if digest == known_hash:
+        return digest, None
+    return digest, _file_chunks(file_path, file_type, max_tokens, overlap)
+
+
+def _file_chunks(file_path, file_type, max_tokens, overlap):
+    pdf = (file_type or "").lower() == "pdf"
+    for offset, chunk, info in iter_chunks(iter_text(file_path, file_type), max_tokens, overlap):
+        if chunk.strip():
+            if not pdf:
+                info.pop("page")
+            if info["heading"] is None:
+                info.pop("heading")
+            yield offset, chunk, info
@@ -0,0 +1,141 @@
+import os, asyncio, random, logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+# ------- Config ----------
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_KEEPALIVE = int(os.getenv("HTTP_KEEPALIVE", "32"))            # idle pooled connections kept open
+HTTP_DEFAULT_HOST_LIMIT = int(os.getenv("HTTP_HOST_LIMIT", "8"))   # in-flight requests per host
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_SEC = float(os.getenv("HTTP_BACKOFF_SEC", "0.5"))
+
+# httpx logs every request at INFO; keep agentic_lab.log readable
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+_RETRY_STATUS = {429, 502, 503, 504}
+# connection-level failures; a read timeout is not retried (the backend may still be generating)
+_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout,
+                 httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP {response.status_code} from {response.request.url}")
+        self.response = response
+
+
+class AsyncHTTP:
+    """One pooled httpx.AsyncClient for the whole process.
+
+    Keep-alive connections are reused across calls. Each host gets its own
+    semaphore, so a slow backend (Ollama) can't take every slot from a fast
+    one (Serper). Transport errors and 429/5xx responses are retried with
+    exponential backoff plus jitter.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self._limits: Dict[str, int] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def set_host_limit(self, host: str, limit: int):
+        self._limits[host] = limit
+        self._slots.pop(host, None)
+
+    def _ensure_loop(self):
+        # clients and semaphores belong to one event loop; start fresh on a new one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._client = None
+            self._slots = {}
+            self._loop = loop
+
+    @staticmethod
+    def _new_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_KEEPALIVE))
+
+    def client(self) -> httpx.AsyncClient:
+        self._ensure_loop()
+        if self._client is None:
+            self._client = self._new_client()
+        return self._client
+
+    async def open(self):
+        """Build the client off the event loop (loading the TLS trust store takes a while)."""
+        self._ensure_loop()
+        if self._client is None:
+            client = await asyncio.to_thread(self._new_client)
+            if self._client is None:
+                self._client = client
+            else:
+                await client.aclose()
+
+    def slots(self, url: str) -> asyncio.Semaphore:
+        self._ensure_loop()
+        host = host_of(url)
+        if host not in self._slots:
+            self._slots[host] = asyncio.Semaphore(self._limits.get(host, HTTP_DEFAULT_HOST_LIMIT))
+        return self._slots[host]
+
+    async def _backoff(self, attempt: int, err: Exception, url: str):
+        delay = HTTP_BACKOFF_SEC * (2 ** attempt) * (0.5 + random.random())
+        logging.warning(f"HTTP retry {attempt + 1}/{HTTP_RETRIES} for {url} in {delay:.2f}s: {err}")
+        await asyncio.sleep(delay)
+
+    async def post_json(self, url: str, payload: dict, headers: Optional[dict] = None,
+                        timeout: Optional[httpx.Timeout] = None, retries: int = HTTP_RETRIES) -> dict:
+        for attempt in range(retries + 1):
+            try:
+                async with self.slots(url):
+                    resp = await self.client().post(url, json=payload, headers=headers, timeout=timeout)
+                if resp.status_code in _RETRY_STATUS:
+                    raise RetryableStatus(resp)
+                resp.raise_for_status()
+                return resp.json()
+            except (*_RETRY_ERRORS, RetryableStatus) as e:
+                if attempt == retries:
+                    raise
+                await self._backoff(attempt, e, url)
+
+    @asynccontextmanager
+    async def stream_post(self, url: str, payload: dict, headers: Optional[dict] = None,
+                          timeout: Optional[httpx.Timeout] = None, retries: int = HTTP_RETRIES):
+        """POST and yield the response with its body unread; the host slot is held
+        until the caller is done. Failures before the response is handed over are
+        retried; once the caller has it, errors propagate (partial output may
+        already have been consumed).
+        """
+        yielded = False
+        for attempt in range(retries + 1):
+            async with self.slots(url):
+                try:
+                    async with self.client().stream("POST", url, json=payload, headers=headers,
+                                                    timeout=timeout) as resp:
+                        if resp.status_code in _RETRY_STATUS:
+                            raise RetryableStatus(resp)
+                        resp.raise_for_status()
+                        yielded = True
+                        yield resp
+                        return
+                except (*_RETRY_ERRORS, RetryableStatus) as e:
+                    if yielded or attempt == retries:
+                        raise
+                    err = e
+            await self._backoff(attempt, err, url)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+http = AsyncHTTP()
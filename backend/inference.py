@@ -0,0 +1,169 @@
+import os, time, heapq, asyncio, itertools
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import record
+
+# ------- Config ----------
+# per-model parallel slots, e.g. "nous-hermes:latest=2,qwen2.5:0.5b=4"; models not
+# listed get the default passed to the scheduler (OLLAMA_CONCURRENCY)
+MODEL_SLOTS = os.getenv("MODEL_SLOTS", "")
+
+# admission priority when slots are full: lower runs first
+PRIORITY_CLASSIFY = 0   # short JSON decisions (the search decider)
+PRIORITY_ANSWER = 1     # full task answers
+PRIORITY_BACKGROUND = 2  # housekeeping (memory summaries); only runs in otherwise idle slots
+
+Emit = Callable[[str], None]
+
+
+class _Abandoned(Exception):
+    """The request a caller had joined was cancelled; the caller should retry it."""
+
+
+class _Flight:
+    """One in-flight request that identical requests can join."""
+
+    def __init__(self, loop):
+        self.future = loop.create_future()
+        self.chunks: List[str] = []
+        self.listeners: List[Emit] = []
+
+    def emit(self, chunk: str):
+        self.chunks.append(chunk)
+        for fn in list(self.listeners):
+            fn(chunk)
+
+
+class InferenceScheduler:
+    """Admission control between agent_response and the model server.
+
+    Each model gets a fixed number of slots (its server-side parallelism, e.g.
+    OLLAMA_NUM_PARALLEL); up to that many requests are sent at once, and the
+    server batches them across its slots. Requests beyond that wait, cheap
+    classification calls ahead of full answers, FIFO within a priority.
+    An identical request (same key) already in flight is joined instead of
+    re-sent: the joiner replays the tokens seen so far, then follows live.
+    """
+
+    def __init__(self, default_slots: int):
+        self.default_slots = default_slots
+        self._slots: Dict[str, int] = {}
+        for item in filter(None, (s.strip() for s in MODEL_SLOTS.split(","))):
+            model, _, n = item.rpartition("=")
+            self._slots[model] = int(n)
+        self._loop = None
+        self._seq = itertools.count()
+        self._reset()
+        self._stats: Dict[str, dict] = {}
+
+    def _reset(self):
+        self._active: Dict[str, int] = {}
+        self._waiting: Dict[str, list] = {}
+        self._inflight: Dict[str, _Flight] = {}
+
+    def _ensure_loop(self):
+        # futures belong to one event loop; start fresh on a new one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset()
+            self._loop = loop
+        return loop
+
+    def set_slots(self, model: str, n: int):
+        self._slots[model] = n
+
+    def slots(self, model: str) -> int:
+        return self._slots.get(model, self.default_slots)
+
+    def _stat(self, model: str) -> dict:
+        return self._stats.setdefault(model, {"requests": 0, "coalesced": 0, "queued": 0, "max_queued": 0,
+                                              "max_active": 0})
+
+    # ---------- slots ----------
+    async def _acquire(self, model: str, priority: int):
+        stat = self._stat(model)
+        if self._active.get(model, 0) < self.slots(model):
+            self._active[model] = self._active.get(model, 0) + 1
+        else:
+            waiter = self._loop.create_future()
+            heap = self._waiting.setdefault(model, [])
+            heapq.heappush(heap, (priority, next(self._seq), waiter))
+            stat["queued"] += 1
+            stat["max_queued"] = max(stat["max_queued"], len(heap))
+            t = time.perf_counter()
+            try:
+                await waiter  # the releasing request hands its slot over
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release(model)  # slot was handed to us just as we were cancelled
+                raise
+            record("llm_queue", time.perf_counter() - t, start=t, model=model)
+        stat["max_active"] = max(stat["max_active"], self._active[model])
+
+    def _release(self, model: str):
+        heap = self._waiting.get(model)
+        while heap:
+            _, _, waiter = heapq.heappop(heap)
+            if not waiter.done():
+                waiter.set_result(None)  # slot passes over; _active is unchanged
+                return
+        self._active[model] -= 1
+
+    # ---------- requests ----------
+    async def run(self, model: str, key: Optional[str], call: Callable[[Emit], Awaitable[str]],
+                  on_token: Optional[Emit] = None, priority: int = PRIORITY_ANSWER) -> str:
+        """Run call(emit) -> text in one of `model`'s slots. `key` identifies the
+        request for coalescing (None disables it); emit forwards streamed chunks.
+        """
+        loop = self._ensure_loop()
+        stat = self._stat(model)
+        while key is not None and key in self._inflight:
+            flight = self._inflight[key]
+            stat["coalesced"] += 1
+            if on_token:
+                for chunk in flight.chunks:
+                    on_token(chunk)
+                flight.listeners.append(on_token)
+            try:
+                text = await asyncio.shield(flight.future)
+                if on_token and text and not flight.chunks:
+                    on_token(text)  # the leader didn't stream; hand over the whole reply, like a cache hit
+                return text
+            except _Abandoned:
+                if on_token and flight.chunks:
+                    raise RuntimeError("joined request was cancelled mid-stream")
+                continue  # nothing emitted yet: run it ourselves
+            finally:
+                if on_token in flight.listeners:
+                    flight.listeners.remove(on_token)
+
+        stat["requests"] += 1
+        flight = _Flight(loop)
+        if on_token:
+            flight.listeners.append(on_token)
+        if key is not None:
+            self._inflight[key] = flight
+        try:
+            await self._acquire(model, priority)
+            try:
+                text = await call(flight.emit)
+            finally:
+                self._release(model)
+            flight.future.set_result(text)
+            return text
+        except asyncio.CancelledError:
+            flight.future.set_exception(_Abandoned())
+            raise
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        finally:
+            if flight.future.done():
+                flight.future.exception()  # mark retrieved: nobody may have joined
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {model: {**s, "slots": self.slots(model), "active": self._active.get(model, 0),
+                        "waiting": len(self._waiting.get(model, ()))}
+                for model, s in self._stats.items()}
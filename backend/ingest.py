@@ -0,0 +1,485 @@
+import os, json, time, queue, asyncio, logging, multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import UPLOAD_FOLDER
+from embeddings import get_embedder
+from file_processor import extract_chunks, simhash
+from memory import add_many_to_memory, add_node, retention_view, memory_records, evict_rows, MEMORY_DIR
+
+# ------- Config ----------
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "64"))        # chunks per memory insert
+INGEST_QUEUE = int(os.getenv("INGEST_QUEUE", "2"))         # batches a file's job may run ahead of its inserts
+# chunk windows in tokens (context_builder.approx_tokens); each repeats the tail of the one before
+INGEST_CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "384"))
+INGEST_CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "48"))
+# skip a chunk whose SimHash is within this many bits of an ingested one (-1 = keep everything)
+INGEST_DEDUP_BITS = int(os.getenv("INGEST_DEDUP_BITS", "3"))
+# lives next to the memory it describes, so wiping memory_store/ re-ingests everything
+INGEST_MANIFEST = os.getenv("INGEST_MANIFEST", os.path.join(MEMORY_DIR, "ingest_manifest.json"))
+INGEST_FINGERPRINTS = os.getenv("INGEST_FINGERPRINTS", os.path.join(MEMORY_DIR, "ingest_simhash.u64"))
+
+
+class Manifest:
+    """Persistent record of ingested uploads: filename -> size, mtime_ns, sha256.
+
+    An unchanged size+mtime skips the file without reading it; a touched file
+    is hashed and only re-ingested if its content changed.
+    """
+
+    def __init__(self, path: str = INGEST_MANIFEST):
+        self.path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries: Dict[str, dict] = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def status(self, name: str, st: os.stat_result) -> str:
+        """'same', 'touched' (metadata changed, content may not have) or 'new'."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return "new"
+        if entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return "same"
+        return "touched"
+
+    def known_hash(self, name: str) -> Optional[str]:
+        entry = self.entries.get(name)
+        return entry["sha256"] if entry else None
+
+    def record(self, name: str, st: os.stat_result, digest: str, chunks: Optional[int] = None):
+        entry = self.entries.get(name, {})
+        entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns, sha256=digest)
+        if chunks is not None:
+            entry.update(chunks=chunks, ingested_at=datetime.now().isoformat())
+        self.entries[name] = entry
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class Fingerprints:
+    """SimHashes of every ingested chunk, for near-duplicate checks across uploads.
+
+    Lookup is by bands: the 64 bits are split into max_bits + 1 bands, and two
+    hashes within max_bits of each other agree exactly on at least one of them,
+    so only hashes sharing a band are compared. Persisted as an append-only
+    file of little-endian uint64s (path None: in memory only); a crash before
+    an append only means a later duplicate is stored once more.
+    """
+
+    def __init__(self, path: Optional[str] = INGEST_FINGERPRINTS, max_bits: int = INGEST_DEDUP_BITS):
+        self.path = path
+        self.max_bits = max_bits
+        self._width = 64 // (max_bits + 1) if max_bits >= 0 else 64
+        self._bands: List[Dict[int, list]] = [{} for _ in range(max_bits + 1)] if max_bits >= 0 else []
+        for h in self._load():
+            self._index(h)
+
+    def _load(self) -> List[int]:
+        try:
+            return np.fromfile(self.path, dtype="<u8").tolist() if self.path else []
+        except FileNotFoundError:
+            return []
+
+    def _keys(self, h: int):
+        mask = (1 << self._width) - 1
+        return [(h >> (i * self._width)) & mask for i in range(len(self._bands))]
+
+    def _index(self, h: int):
+        for band, key in zip(self._bands, self._keys(h)):
+            band.setdefault(key, []).append(h)
+
+    def near(self, h: int) -> bool:
+        for band, key in zip(self._bands, self._keys(h)):
+            for other in band.get(key, ()):
+                if bin(h ^ other).count("1") <= self.max_bits:
+                    return True
+        return False
+
+    def add(self, h: int):
+        """Index `h` for near(); it is persisted by save(), once its chunk is in memory."""
+        self._index(h)
+
+    def save(self, hashes: List[int]):
+        if not hashes:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(np.asarray(hashes, dtype="<u8").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def discard(self, hashes: List[int]):
+        """Forget the saved `hashes` (one occurrence each) of chunks no longer in
+        memory, so their text can be ingested again. Rewrites the file and
+        rebuilds the index from it: anything added but not saved is dropped.
+        """
+        if not hashes:
+            return
+        drop = Counter(hashes)
+        keep = []
+        for h in self._load():
+            if drop[h]:
+                drop[h] -= 1
+            else:
+                keep.append(h)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(np.asarray(keep, dtype="<u8").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._bands = [{} for _ in self._bands]
+        for h in keep:
+            self._index(h)
+
+
+# ---------- pipeline ----------
+_pool: Optional[ProcessPoolExecutor] = None
+_manager = None  # serves the queues pool jobs stream batches back through
+_manifest: Optional[Manifest] = None
+_fingerprints: Optional[Fingerprints] = None
+_stats = {"runs": 0, "files": 0, "unchanged": 0, "skipped": 0, "failed": 0, "superseded": 0,
+          "bytes": 0, "chunks": 0, "duplicates": 0, "seconds": 0.0, "last_run": None}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the server process has threads, and forking those is unsafe
+        _pool = ProcessPoolExecutor(max_workers=max(1, INGEST_WORKERS),
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _get_manager():
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    return _manager
+
+
+def _get_manifest() -> Manifest:
+    global _manifest
+    if _manifest is None:
+        _manifest = Manifest()
+    return _manifest
+
+
+def _get_fingerprints() -> Fingerprints:
+    global _fingerprints
+    if _fingerprints is None:
+        _fingerprints = Fingerprints()
+    return _fingerprints
+
+
+def _drop_unsaved_fingerprints():
+    global _fingerprints
+    _fingerprints = None  # reloaded from disk on next use
+
+
+def _scan(manifest: Manifest):
+    """Uploads that are new or whose metadata changed, as (name, path, stat)."""
+    out = []
+    for name in sorted(os.listdir(UPLOAD_FOLDER)):
+        path = os.path.join(UPLOAD_FOLDER, name)
+        if not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        if manifest.status(name, st) != "same":
+            out.append((name, path, st))
+    return out
+
+
+def _batches(items, size: int):
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _extract_job(path: str, file_type: str, known_hash: Optional[str], out) -> bool:
+    """Runs in a pool process: extract, chunk, fingerprint and embed one file,
+    so the CPU-heavy part (embedding, for the hashing embedder) is parallel too.
+    Puts the file's sha256 on `out`, then (chunks, vecs, hashes) per
+    INGEST_BATCH as they are ready, then None; `out` is bounded, so the file
+    never piles up ahead of its inserts. Returns False if it was unchanged.
+    The embedder and token counter come from env; set_embedder() and
+    set_token_counter() do not reach here.
+    """
+    try:
+        digest, chunks = extract_chunks(path, file_type, INGEST_CHUNK_TOKENS, INGEST_CHUNK_OVERLAP, known_hash)
+        out.put(digest)
+        if chunks is None:
+            return False
+        embedder = get_embedder()
+        for batch in _batches(chunks, INGEST_BATCH):
+            hashes = [simhash(c) for _, c, _ in batch] if INGEST_DEDUP_BITS >= 0 else None
+            out.put((batch, embedder.embed([c for _, c, _ in batch]), hashes))
+        return True
+    finally:
+        out.put(None)
+
+
+def _receive(out, job):
+    """Next message from a running _extract_job; raises its error if it died without sending one."""
+    while True:
+        try:
+            return out.get(timeout=1)
+        except queue.Empty:
+            if job.done():
+                try:
+                    return out.get_nowait()
+                except queue.Empty:
+                    job.result()
+                    return None
+
+
+def _drain(out, job):
+    """Let an abandoned job run to its end (its puts would block on the full queue)."""
+    with suppress(Exception):  # its error, if any, is raised by whoever awaits it
+        while _receive(out, job) is not None:
+            pass
+
+
+def _dedupe(chunks, vecs, hashes):
+    """Drop chunks near-identical to one already ingested (or earlier in the same file);
+    returns the rest, their vectors and hashes, and how many were dropped.
+    """
+    if hashes is None:
+        return chunks, vecs, [], 0
+    fingerprints = _get_fingerprints()
+    keep = []
+    for i, h in enumerate(hashes):
+        if not fingerprints.near(h):
+            fingerprints.add(h)
+            keep.append(i)
+    return [chunks[i] for i in keep], vecs[keep], [hashes[i] for i in keep], len(chunks) - len(keep)
+
+
+async def _ingest_file(name: str, path: str, st: os.stat_result, manifest: Manifest, run: dict,
+                       superseded: dict, save_lock: asyncio.Lock):
+    """Insert one file's batches as its pool job sends them. A changed file
+    goes into `superseded` (name -> sha256, stat, chunks, every chunk hash)
+    for _supersede to record; anything else is recorded in the manifest here.
+    """
+    file_type = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    known = manifest.known_hash(name)
+    out = _get_manager().Queue(maxsize=max(1, INGEST_QUEUE))
+    job = _get_pool().submit(_extract_job, path, file_type, known, out)
+    chunks, dupes, read_all, seen, saved, digest = 0, 0, False, [], [], None
+    try:
+        digest = await asyncio.to_thread(_receive, out, job)
+        while (item := await asyncio.to_thread(_receive, out, job)) is not None:
+            batch, vecs, hashes = item
+            if known is not None:
+                seen += hashes or []
+            batch, vecs, kept, skipped = _dedupe(batch, vecs, hashes)
+            dupes += skipped
+            if batch:
+                await asyncio.to_thread(add_many_to_memory, (c for _, c, _ in batch),
+                                        ({"filename": name, "sha256": digest, "offset": off, **info}
+                                         for off, _, info in batch), vecs)
+                chunks += len(batch)
+                saved += kept
+        read_all = True
+        changed = await asyncio.wrap_future(job)  # the job's own error, if it failed after its last batch
+    except BaseException:
+        _drop_unsaved_fingerprints()  # they would mark this file's retry as duplicates
+        if not read_all:
+            await asyncio.to_thread(_drain, out, job)
+        if chunks:
+            await _roll_back(name, digest)
+        raise
+    if chunks:
+        await asyncio.to_thread(add_node, f"doc_{name}", node_type="document", label=name)
+
+    if not changed:
+        manifest.record(name, st, digest)
+        run["unchanged"] += 1
+    elif not chunks and not dupes:
+        logging.info(f"Skipped (no extractable text): {name}")
+        run["skipped"] += 1
+    else:
+        run["files"] += 1
+        run["chunks"] += chunks
+        run["duplicates"] += dupes
+        run["bytes"] += st.st_size
+        logging.info(f"Ingested new file: {name} ({chunks} chunks, {dupes} near-duplicates skipped)")
+    async with save_lock:
+        # fingerprints only after the insert: a crash in between re-ingests, never loses text
+        await asyncio.to_thread(_get_fingerprints().save, saved)
+        if changed and known is not None:
+            superseded[name] = (digest, st, chunks, seen)
+        elif changed:
+            manifest.record(name, st, digest, chunks=chunks)
+        await asyncio.to_thread(manifest.save)
+
+
+def _upload_rows(pick):
+    """Uploaded chunks whose metadata passes pick(metadata), as (gen, rows,
+    records), or None if the store was compacted while reading.
+    """
+    view = retention_view()
+    if "upload" not in view["sources"]:
+        return view["gen"], [], []
+    candidates = np.flatnonzero(view["source"] == view["sources"].index("upload"))
+    rows, found = [], []
+    for batch in _batches(candidates, INGEST_BATCH * 16):
+        records = memory_records(view["gen"], batch)
+        if records is None:
+            return None
+        for row, rec in zip(batch, records):
+            if pick(rec.get("metadata") or {}):
+                rows.append(int(row))
+                found.append(rec)
+    return view["gen"], rows, found
+
+
+def _superseded_rows(versions: Dict[str, tuple]):
+    """Rows of earlier versions of re-ingested files, and their SimHashes.
+    A row whose chunk is still in the new version (so it was skipped there as
+    a duplicate) stays. Returns (gen, rows, hashes), or None if the store
+    was compacted while reading.
+    """
+    found = _upload_rows(lambda md: md.get("filename") in versions
+                         and md.get("sha256") != versions[md["filename"]][0])
+    if found is None:
+        return None
+    current = {}
+    for name, (_, _, _, hashes) in versions.items():
+        current[name] = Fingerprints(None)
+        for h in hashes:
+            current[name].add(h)
+    gen, rows, hashes = found[0], [], []
+    for row, rec in zip(found[1], found[2]):
+        h = simhash(rec["text"])
+        if not current[rec["metadata"]["filename"]].near(h):
+            rows.append(row)
+            hashes.append(h)
+    return gen, rows, hashes
+
+
+async def _roll_back(name: str, digest: str):
+    """Evict the chunks a failed attempt at `name` already stored (their
+    fingerprints were never saved), so its retry neither repeats nor skips them.
+    """
+    for _ in range(3):
+        found = await asyncio.to_thread(
+            _upload_rows, lambda md: md.get("filename") == name and md.get("sha256") == digest)
+        if found is None:
+            continue  # compacted while reading: look again
+        gen, rows, _ = found
+        if not rows or await asyncio.to_thread(evict_rows, gen, rows) is not None:
+            logging.info(f"Rolled back {len(rows)} chunk(s) of the failed ingest of {name}")
+            return
+    logging.warning(f"Could not roll back the partial ingest of {name}; its retry may store chunks twice")
+
+
+async def _supersede(versions: Dict[str, tuple], manifest: Manifest, run: dict):
+    """Evict what an edited file's earlier version left in memory, then record
+    the new version. Runs after its chunks are in, so a crash in between leaves
+    duplicates, never a gap; the file stays out of the manifest until this is
+    done, so the next run finishes the job.
+    """
+    for _ in range(3):
+        plan = await asyncio.to_thread(_superseded_rows, versions)
+        if plan is None:
+            continue  # compacted while reading: plan again
+        gen, rows, hashes = plan
+        # forgotten first: a crash before the eviction leaves a duplicate at worst
+        await asyncio.to_thread(_get_fingerprints().discard, hashes)
+        if not rows or await asyncio.to_thread(evict_rows, gen, rows) is not None:
+            break
+    else:
+        logging.warning(f"Could not evict earlier versions of {len(versions)} file(s); retrying next run")
+        return
+    for name, (digest, st, chunks, _) in versions.items():
+        manifest.record(name, st, digest, chunks=chunks)
+    await asyncio.to_thread(manifest.save)
+    run["superseded"] += len(rows)
+    if rows:
+        logging.info(f"Evicted {len(rows)} chunk(s) of earlier versions of {len(versions)} file(s)")
+
+
+async def ingest_uploads() -> dict:
+    """Ingest new or changed files from UPLOAD_FOLDER.
+
+    Extraction, chunking and embedding run in a process pool, one job per
+    file and up to INGEST_WORKERS files at a time, each streaming back
+    INGEST_BATCH-chunk batches as they are ready. Chunks that near-duplicate
+    ingested text are dropped, and the rest go into memory batch by batch
+    off the event loop. An edited file then replaces its earlier version.
+    Returns this run's throughput.
+    """
+    manifest = _get_manifest()
+    todo = await asyncio.to_thread(_scan, manifest)
+    run = {"files": 0, "unchanged": 0, "skipped": 0, "failed": 0, "superseded": 0,
+           "bytes": 0, "chunks": 0, "duplicates": 0}
+    if not todo:
+        return run
+
+    t0 = time.perf_counter()
+    slots = asyncio.Semaphore(max(1, INGEST_WORKERS))
+    save_lock = asyncio.Lock()
+    superseded = {}
+
+    async def ingest(name, path, st):
+        async with slots:
+            try:
+                await _ingest_file(name, path, st, manifest, run, superseded, save_lock)
+            except Exception:
+                # unreadable, vanished or not stored; left out of the manifest so it is retried
+                logging.exception("Ingest failed")
+                run["failed"] += 1
+
+    await asyncio.gather(*(ingest(*item) for item in todo))
+    if superseded:
+        await _supersede(superseded, manifest, run)
+
+    elapsed = time.perf_counter() - t0
+    run["seconds"] = round(elapsed, 3)
+    run["mb_per_sec"] = round(run["bytes"] / 1e6 / elapsed, 3) if elapsed else 0.0
+    run["chunks_per_sec"] = round(run["chunks"] / elapsed, 1) if elapsed else 0.0
+    for k in ("files", "unchanged", "skipped", "failed", "superseded", "bytes", "chunks", "duplicates"):
+        _stats[k] += run[k]
+    _stats["runs"] += 1
+    _stats["seconds"] += elapsed
+    _stats["last_run"] = run
+    if run["files"]:
+        logging.info(f"Ingest run: {run['files']} file(s), {run['chunks']} chunks, "
+                     f"{run['mb_per_sec']} MB/s, {run['chunks_per_sec']} chunks/s")
+    return run
+
+
+def ingest_stats() -> dict:
+    total = dict(_stats)
+    secs = total["seconds"]
+    total["seconds"] = round(secs, 3)
+    total["mb_per_sec"] = round(total["bytes"] / 1e6 / secs, 3) if secs else 0.0
+    total["chunks_per_sec"] = round(total["chunks"] / secs, 1) if secs else 0.0
+    return total
+
+
+def shutdown_ingest():
+    global _pool, _manager
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    if _manager is not None:
+        _manager.shutdown()  # a job still putting batches gets an error and ends
+        _manager = None
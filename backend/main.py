@@ -1,17 +1,38 @@
-import os, json, asyncio, logging
-from fastapi import FastAPI
+import os, json, codecs, asyncio, logging
+from typing import Optional
+import env  # .env before any module reads its settings
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import StreamingResponse
-from autonomous_agent import monitor_new_files, process_all_tasks, get_pending_tasks
-from task_generator import generate_new_tasks
-from memory import vector_db, get_knowledge_graph
+from starlette.responses import StreamingResponse, PlainTextResponse
+from events import Broadcaster, token_streams, END, LAGGED
+from http_client import http
+from notifier import dispatcher as notifications, notifier_stats
+from cache import cache_stats
+import metrics
+from task_store import get_task_store
+from result_store import get_result_store
+from memory import (memory_count, memory_stats, get_knowledge_graph, get_graph_changes,
+                    get_neighborhood, set_graph_listener, compact_memory_if_due)
+from startup import (mark, load_pipeline, restore_state, startup_stats, FirstRequestMarker,
+                     LAB_LAZY_START)
+# the task pipeline (autonomous_agent, agent, ingest, task_generator, retention)
+# is imported by _boot(), off the event loop when LAB_LAZY_START is on
 
 INTERVAL = int(os.getenv("LAB_LOOP_INTERVAL", "30"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT_SEC", "300"))
+# 0 = scale out: every process (uvicorn --workers N, or several servers sharing
+# this directory) runs a worker pool; the lock holder also ingests and generates
+LAB_SINGLETON = os.getenv("LAB_SINGLETON", "1") == "1"
+# token streams of a task running in another process are followed through its partial file
+STREAM_TAIL_POLL_SEC = float(os.getenv("STREAM_TAIL_POLL_SEC", "0.2"))
 
 app = FastAPI(title="AgenticPY")
 
 logging.basicConfig(filename='agentic_lab.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
+mark("app_imported")
+
+app.add_middleware(FirstRequestMarker)
 
 # Basic CORS (adjust as needed)
 app.add_middleware(
@@ -23,6 +44,7 @@ app.add_middleware(
 )
 
 shutdown_event = asyncio.Event()
+_pipeline_loaded = asyncio.Event()  # set once _boot() has imported the task pipeline
 
 # ---------- singleton guard to avoid multiple background loops ----------
 # Only start lab loop in a single process (useful when uvicorn reload/workers > 1)
@@ -44,51 +66,483 @@ def _acquire_singleton() -> bool:
 
 
 # ---------- background loop ----------
+_worker_pool = None
+_ingest_run = None
+_retention_run = None
+_compact_run = None
+_graph_events: Optional[Broadcaster] = None
+_task_events: Optional[Broadcaster] = None
+
+
+async def _sleep_or_shutdown(seconds: float):
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _standby():
+    """Scale-out follower: take over the lab loop if its holder goes away."""
+    while not shutdown_event.is_set():
+        await _sleep_or_shutdown(INTERVAL)
+        if not shutdown_event.is_set() and _acquire_singleton():
+            logging.info("Acquired singleton lock; taking over the background loop.")
+            await lab_loop()
+            return
+
+
+async def _compact_once():
+    try:
+        await asyncio.to_thread(compact_memory_if_due)
+    except Exception:
+        logging.exception("Compaction error")
+
+
+def _pool_workers() -> int:
+    from autonomous_agent import LAB_WORKERS
+    return LAB_WORKERS if LAB_SINGLETON else max(LAB_WORKERS, 1)
+
+
+async def _pipeline():
+    """Wait for the task pipeline imports (only matters right after a lazy start)."""
+    await _pipeline_loaded.wait()
+
+
+async def _ingest_once():
+    from ingest import ingest_uploads
+    try:
+        await ingest_uploads()
+    except Exception:
+        logging.exception("Ingest error")
+
+
+async def _retention_once():
+    from retention import run_retention
+    try:
+        await run_retention()
+    except Exception:
+        logging.exception("Retention error")
+
+
 async def lab_loop():
+    global _worker_pool, _ingest_run, _retention_run, _compact_run
+    from autonomous_agent import process_all_tasks, run_worker_pool, wake_workers
+    from agent import track_queue
+    from task_generator import generate_new_tasks, GEN_HORIZON_SEC
+    from retention import retention_enabled, MEMORY_RETENTION_SEC
+    workers = _pool_workers()
     logging.info("Lab loop started.")
+    if workers > 0 and _worker_pool is None:
+        # pool mode: workers claim back-to-back; this loop only ingests and generates
+        _worker_pool = asyncio.create_task(run_worker_pool(shutdown_event, workers))
+        logging.info(f"Worker pool started with {workers} worker(s).")
+    loop = asyncio.get_running_loop()
+    last_retention = None
     while not shutdown_event.is_set():
         try:
-            monitor_new_files()
-            await process_all_tasks()
-            # Optional auto-task: throttle so we don't flood the queue
-            generate_new_tasks()
-            await asyncio.sleep(INTERVAL)
+            # ingestion runs beside the loop; a big upload must not hold up tasks
+            if _ingest_run is None or _ingest_run.done():
+                _ingest_run = asyncio.create_task(_ingest_once())
+            # so does retention (it rewrites the store when it evicts)
+            if retention_enabled() and (_retention_run is None or _retention_run.done()) and \
+                    (last_retention is None or loop.time() - last_retention >= MEMORY_RETENTION_SEC):
+                _retention_run = asyncio.create_task(_retention_once())
+                last_retention = loop.time()
+            if _worker_pool is None:
+                await process_all_tasks()
+            # top up the queue from graph gaps if the workers would run dry before the next pass
+            if await asyncio.to_thread(generate_new_tasks, max(workers, 1), INTERVAL + GEN_HORIZON_SEC):
+                wake_workers()
+            # graph log compaction happens here, not inline in the task's add_node/add_edge
+            if _compact_run is None or _compact_run.done():
+                _compact_run = asyncio.create_task(_compact_once())
+            # keep the model loaded longer while there is work for it
+            counts = await asyncio.to_thread(lambda: get_task_store().counts())
+            await track_queue(counts.get("pending", 0) + counts.get("running", 0))
+            await _sleep_or_shutdown(INTERVAL)
         except Exception as e:
             logging.exception("Lab loop error")
-            await asyncio.sleep(INTERVAL)
+            await _sleep_or_shutdown(INTERVAL)
     logging.info("Lab loop stopped.")
 
 
 # ---------- routes ----------
+def _sse(name: str, event_id: int, data) -> str:
+    return f"event: {name}\nid: {event_id}\ndata: {json.dumps(data)}\n\n"
+
+
+def _last_event_id(request: Request, since: Optional[int]) -> Optional[int]:
+    last_id = request.headers.get("last-event-id")
+    return int(last_id) if last_id and last_id.isdigit() else since
+
+
+async def _follow(q: asyncio.Queue, last: int, key: str, field: str):
+    """Relay a Broadcaster queue as `event: changes` batches of items with
+    item[key] > last; keepalive comments when idle, `event: lagged` (then
+    stop) if the client fell behind.
+    """
+    while not shutdown_event.is_set():
+        try:
+            item = await asyncio.wait_for(q.get(), timeout=15)
+        except asyncio.TimeoutError:
+            yield ": keepalive\n\n"
+            continue
+        items = [item]
+        while not q.empty():  # batch whatever else is already queued
+            items.append(q.get_nowait())
+        stop = next((i for i in items if i is END or i is LAGGED), None)
+        items = [dict(i) for i in items if isinstance(i, dict) and i[key] > last]
+        if items:
+            last = items[-1][key]
+            yield _sse("changes", last, {field: last, "changes": items})
+        if stop is LAGGED:
+            yield "event: lagged\ndata: {}\n\n"
+        if stop is not None:
+            return
+
+
 @app.get("/tasks_stream")
-async def tasks_stream():
+async def tasks_stream(request: Request, since: Optional[int] = None):
+    """`event: snapshot` with the pending queue, then `event: changes` carrying
+    {"seq", "kind", "task"} per state change (added, claimed, completed,
+    retry, failed, requeued, expired). Resumes from Last-Event-ID (or ?since)
+    with only the missed changes when they are still retained.
+    """
+    since = _last_event_id(request, since)
+    # opening the store can still be part of a lazy start's restore: not on the loop
+    store = await asyncio.to_thread(get_task_store)
+
     async def event_generator():
-        while not shutdown_event.is_set():
-            pending = await get_pending_tasks()
-            yield f"data: {json.dumps(pending)}\n\n"
-            await asyncio.sleep(5)
+        q = _task_events.subscribe()
+        try:
+            events = await asyncio.to_thread(store.events_since, since) if since is not None else None
+            if events is None:
+                seq, pending = await asyncio.to_thread(store.snapshot)
+                yield _sse("snapshot", seq, {"seq": seq, "tasks": pending})
+            else:
+                seq = since
+                while events:  # page through the backlog; later changes arrive on q
+                    seq = events[-1]["seq"]
+                    yield _sse("changes", seq, {"seq": seq, "changes": events})
+                    events = await asyncio.to_thread(store.events_since, seq)
+            async for chunk in _follow(q, seq, "seq", "seq"):
+                yield chunk
+        finally:
+            _task_events.unsubscribe(q)
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+async def _tail_partial(task_id: int, path: str):
+    """SSE of a task another process is running: poll its partial file (same
+    host) until the file is removed when the task ends. Bytes written just
+    before the removal can be missed; the full text is at /results/{task_id}.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    pos = 0
+    while not shutdown_event.is_set():
+        try:
+            with open(path, "rb") as f:
+                f.seek(pos)
+                raw = f.read()
+        except FileNotFoundError:
+            raw = None
+        if raw:
+            pos += len(raw)
+            text = decoder.decode(raw)
+            if text:
+                yield f"data: {json.dumps({'text': text})}\n\n"
+        elif raw is None:
+            if pos:
+                break  # removed: the task finished
+            task = await asyncio.to_thread(lambda: get_task_store().get(task_id))
+            if task is None or task["status"] != "running":
+                break
+        await asyncio.sleep(STREAM_TAIL_POLL_SEC)
+    yield "event: done\ndata: {}\n\n"
+
+
+@app.get("/tasks/{task_id}/stream")
+async def task_output_stream(task_id: int):
+    """Tokens of a running task as they are generated: `data: {"text": ...}` events,
+    then `event: done`. Late joiners first get everything written so far. A task
+    running in another process (scale-out) is followed through its partial file.
+    """
+    await _pipeline()
+    from autonomous_agent import partial_result_path
+
+    async def event_generator():
+        q = token_streams.subscribe(task_id)
+        if q is None:
+            async for chunk in _tail_partial(task_id, partial_result_path(task_id)):
+                yield chunk
+            return
+        try:
+            try:
+                with open(partial_result_path(task_id), "rb") as f:
+                    sent = f.read()
+            except FileNotFoundError:
+                sent = b""
+            if sent:
+                yield f"data: {json.dumps({'text': sent.decode('utf-8', 'replace')})}\n\n"
+            while not shutdown_event.is_set():
+                ev = await q.get()
+                if ev is END or ev is LAGGED:
+                    # a lagged client reconnects and resyncs from the partial file
+                    yield "event: done\ndata: {}\n\n" if ev is END else "event: lagged\ndata: {}\n\n"
+                    break
+                if ev["pos"] < len(sent):
+                    continue  # already included in the file snapshot
+                yield f"data: {json.dumps({'text': ev['text']})}\n\n"
+        finally:
+            token_streams.unsubscribe(task_id, q)
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+# ---------- results ----------
+@app.get("/results")
+async def list_results(limit: int = 50, cursor: Optional[int] = None, task_id: Optional[int] = None,
+                       since: Optional[str] = None, until: Optional[str] = None):
+    """Result metadata, newest first; pass next_cursor back as ?cursor= for the next page.
+    since/until are ISO timestamps (UTC).
+    """
+    store = await asyncio.to_thread(get_result_store)
+    return await asyncio.to_thread(store.list, max(1, min(limit, 500)), cursor, task_id, since, until)
+
+
+@app.get("/results/search")
+async def search_results(q: str, limit: int = 20, offset: int = 0):
+    """Full-text search over result text and task descriptions, best match first."""
+    store = await asyncio.to_thread(get_result_store)
+    return await asyncio.to_thread(store.search, q, max(1, min(limit, 100)), max(0, offset))
+
+
+@app.get("/results/export")
+async def export_results(task_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None):
+    """Every matching result with its text as NDJSON, streamed oldest first."""
+    store = await asyncio.to_thread(get_result_store)
+    rows = store.export(task_id, since, until)  # a generator: Starlette pulls it from a thread
+    return StreamingResponse((json.dumps(r) + "\n" for r in rows), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": 'attachment; filename="results.ndjson"'})
+
+
+@app.get("/results/{task_id}")
+async def get_result(task_id: int, result_id: Optional[int] = None):
+    """A task's latest result (or ?result_id=) with its text."""
+    store = await asyncio.to_thread(get_result_store)
+    result = await asyncio.to_thread(store.get, task_id, result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No result for this task")
+    return result
+
+
+@app.get("/results/{task_id}/download")
+async def download_result(task_id: int, result_id: Optional[int] = None):
+    store = await asyncio.to_thread(get_result_store)
+    result = await asyncio.to_thread(store.get, task_id, result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No result for this task")
+    raw = (result.get("text") or "").encode("utf-8")
+    pieces = (raw[i:i + 65536] for i in range(0, len(raw), 65536))
+    return StreamingResponse(pieces, media_type="text/plain; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="task_{task_id:06d}.txt"'})
+
+
+@app.get("/result_metrics")
+async def result_metrics():
+    store = await asyncio.to_thread(get_result_store)
+    return await asyncio.to_thread(store.stats)
+
+
 @app.get("/memory_metrics")
 async def memory_metrics():
-    return {"memory_count": len(vector_db["documents"])}
+    stats = await asyncio.to_thread(memory_stats)
+    await _pipeline()
+    from retention import retention_stats
+    stats["retention"] = retention_stats()
+    return stats
+
+
+@app.get("/cache_metrics")
+async def cache_metrics():
+    return await asyncio.to_thread(cache_stats)
+
+
+@app.get("/ingest_metrics")
+async def ingest_metrics():
+    await _pipeline()
+    from ingest import ingest_stats
+    return ingest_stats()
+
+
+@app.get("/notification_metrics")
+async def notification_metrics():
+    return notifier_stats()
+
+
+@app.get("/generator_metrics")
+async def generator_metrics():
+    await _pipeline()
+    from task_generator import generator_stats
+    return generator_stats()
+
+
+@app.get("/inference_metrics")
+async def inference_metrics():
+    await _pipeline()
+    from agent import scheduler
+    return scheduler.stats()
+
+
+@app.get("/startup_metrics")
+async def startup_metrics():
+    """Boot milestones in seconds since process start (app_imported, serving,
+    first_request, pipeline_loaded, state_restored, model_loaded, first_task),
+    background step durations, and the model keep_alive policy.
+    """
+    stats = startup_stats()
+    if _pipeline_loaded.is_set():
+        from agent import residency_stats
+        stats["model"] = residency_stats()
+    return stats
+
+
+# read at scrape time, beside the histograms and counters the pipeline records
+metrics.Gauge("lab_tasks", "Tasks in the queue, by status.",
+              lambda: {(k,): v for k, v in get_task_store().counts().items()}, ("status",))
+metrics.Gauge("lab_memory_documents", "Documents in the memory store.", lambda: {(): memory_count()})
+metrics.Gauge("lab_memory_bytes", "Document text in the memory store, bytes.",
+              lambda: {(): memory_stats()["memory_bytes"]})
+def _inference_requests():
+    if not _pipeline_loaded.is_set():
+        return {}
+    from agent import scheduler
+    return {(m, state): s[state] for m, s in scheduler.stats().items() for state in ("active", "waiting")}
+
+
+metrics.Gauge("lab_inference_requests", "Model calls in flight (active) or waiting for a slot.",
+              _inference_requests, ("model", "state"))
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint. Per process: with several server processes,
+    each reports its own tasks and stages.
+    """
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/knowledge_graph")
-async def knowledge_graph():
-    return get_knowledge_graph()
+async def knowledge_graph(since: Optional[int] = None, cursor: int = 0, limit: Optional[int] = None):
+    """Full graph (optionally paged by node: cursor/limit -> next_cursor), or with
+    ?since=<version> only the ops after it. Every response carries "version".
+    """
+    if since is None:
+        return await asyncio.to_thread(get_knowledge_graph, cursor, limit)
+    return await asyncio.to_thread(get_graph_changes, since)
 
 
-@app.on_event("startup")
-async def startup_event():
+@app.get("/knowledge_graph/neighborhood/{node_id}")
+async def knowledge_graph_neighborhood(node_id: str, depth: int = 1, limit: int = 500):
+    return await asyncio.to_thread(get_neighborhood, node_id, max(0, min(depth, 5)), limit)
+
+
+@app.get("/knowledge_graph/stream")
+async def knowledge_graph_stream(request: Request, since: Optional[int] = None):
+    """`event: snapshot` (full graph) or `event: changes` (ops since the client's
+    version, from ?since or Last-Event-ID on reconnect), then `event: changes`
+    as the graph grows. `event: lagged` means reconnect to resync.
+    """
+    since = _last_event_id(request, since)
+
+    async def event_generator():
+        q = _graph_events.subscribe()
+        try:
+            # subscribe before reading so nothing falls between the read and the stream
+            delta = await asyncio.to_thread(get_graph_changes, since) if since is not None else {"changes": None}
+            if delta["changes"] is None:
+                graph = await asyncio.to_thread(get_knowledge_graph)
+                version = graph["version"]
+                yield _sse("snapshot", version, graph)
+            else:
+                version = delta["version"]
+                if delta["changes"]:
+                    yield _sse("changes", version, delta)
+            async for chunk in _follow(q, version, "v", "version"):
+                yield chunk
+        finally:
+            _graph_events.unsubscribe(q)
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+async def _warm_model():
+    from agent import load_models
+    if await load_models():
+        mark("model_loaded")
+
+
+async def _boot():
+    """Import the task pipeline, pre-warm the model, reopen the persisted
+    stores, then start this process's task feed and background loop.
+    """
+    global _worker_pool
+    await asyncio.gather(asyncio.to_thread(load_pipeline), http.open())
+    _pipeline_loaded.set()
+    from agent import OLLAMA_PREWARM
+    from autonomous_agent import run_worker_pool, run_task_feed
+    asyncio.create_task(run_task_feed(_task_events, shutdown_event))
+    if OLLAMA_PREWARM:
+        # the model loads on the Ollama side while the stores reopen here
+        asyncio.create_task(_warm_model())
+    await asyncio.to_thread(restore_state)
+    if shutdown_event.is_set():
+        return
     if _acquire_singleton():
         asyncio.create_task(lab_loop())
         logging.info("Startup acquired singleton lock; background loop active.")
+    elif not LAB_SINGLETON:
+        # leases + fencing in the task store keep concurrent claimers safe
+        workers = _pool_workers()
+        _worker_pool = asyncio.create_task(run_worker_pool(shutdown_event, workers))
+        asyncio.create_task(_standby())
+        logging.info(f"Scale-out: {workers} worker(s) in this process; another process runs the lab loop.")
     else:
         logging.warning("Another process holds the lab_loop lock; skipping background loop.")
 
 
+async def _boot_or_log():
+    try:
+        await _boot()
+    except Exception:
+        logging.exception("Startup failed")
+
+
+@app.on_event("startup")
+async def startup_event():
+    global _graph_events, _task_events
+    _graph_events = Broadcaster()
+    set_graph_listener(_graph_events.publish_threadsafe)
+    # every process feeds its own SSE clients; only one runs the lab loop
+    _task_events = Broadcaster()
+    notifications.start()
+    if LAB_LAZY_START:
+        # serve right away; routes that need the pipeline wait for it
+        asyncio.create_task(_boot_or_log())
+    else:
+        await _boot()
+    mark("serving")
+
+
 @app.on_event("shutdown")
 async def shutdown():
-    shutdown_event.set()
\ No newline at end of file
+    shutdown_event.set()
+    if _worker_pool is not None:
+        try:
+            # let in-flight tasks finish; leases of anything cut off are recovered after TTL
+            await asyncio.wait_for(_worker_pool, timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Worker pool did not drain in time; in-flight tasks will be re-leased.")
+    if _pipeline_loaded.is_set():
+        from ingest import shutdown_ingest
+        shutdown_ingest()
+    await notifications.aclose()  # before the HTTP client: webhook digests still queued go out
+    await http.aclose()
\ No newline at end of file
@@ -1,30 +1,127 @@
-from collections import defaultdict
+import os, threading
 
-vector_db = {"documents": []}
-knowledge_graph = defaultdict(list)
-node_metadata = {}
+MEMORY_DIR = os.getenv("MEMORY_DIR", "./memory_store")
+# several processes use the store at once when the lab runs scaled out (LAB_SINGLETON=0)
+MEMORY_SHARED = os.getenv("MEMORY_SHARED", "0" if os.getenv("LAB_SINGLETON", "1") == "1" else "1") == "1"
+
+_store = None
+_store_lock = threading.Lock()
+_graph_listener = None
+
+# numpy, the store and the embedding backend load on first use, not at import
+def _get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            from memory_store import MemoryStore
+            _store = MemoryStore(MEMORY_DIR, shared=MEMORY_SHARED)
+            _store.set_graph_listener(_graph_listener)
+        return _store
+
+def _embed(texts):
+    from embeddings import get_embedder
+    return get_embedder().embed(texts)
+
+def restore_memory():
+    """Open the store (graph log replay, vector map, IVF layout) and the embedder ahead of first use."""
+    from embeddings import get_embedder
+    _get_store()
+    get_embedder()
+
+def add_many_to_memory(texts, metadatas=None, vecs=None):
+    """Embed and persist a batch of documents in one pass (vecs: precomputed embeddings)."""
+    texts = list(texts)
+    if not texts:
+        return
+    metadatas = list(metadatas) if metadatas is not None else [None] * len(texts)
+    _get_store().add_many(texts, metadatas, _embed(texts) if vecs is None else vecs)
 
 def add_to_memory(text, metadata=None):
-    vector_db["documents"].append({"text": text, "metadata": metadata})
+    add_many_to_memory([text], [metadata])
+
+def retrieve_scored(query, k=5):
+    """Top-k documents by cosine similarity to the query, as (text, score) pairs."""
+    hits = _get_store().search_records(_embed([query])[0], k)
+    return [(rec["text"], score) for rec, score in hits]
 
 def retrieve_from_memory(query, k=5):
-    # simplistic: return last k docs
-    return [doc["text"] for doc in vector_db["documents"][-k:]]
+    """Top-k documents by cosine similarity to the query."""
+    return [text for text, _ in retrieve_scored(query, k)]
+
+def memory_count() -> int:
+    return _get_store().refresh()
+
+def compact_memory():
+    _get_store().compact()
+
+def compact_memory_if_due() -> bool:
+    """Compact when the graph log is mostly superseded ops; blocking, run it in a thread."""
+    return _get_store().maybe_compact()
+
+def memory_stats() -> dict:
+    store = _get_store()
+    count = store.refresh()
+    return {"memory_count": count, "memory_bytes": store.log_end, "graph_nodes": len(store.node_metadata),
+            "graph_edges": sum(len(v) for v in store.knowledge_graph.values())}
+
+# retention (see retention.py); row numbers are only valid within the generation they came from
+def retention_view():
+    return _get_store().retention_view()
+
+def memory_records(gen, rows):
+    return _get_store().records(gen, rows)
+
+def evict_rows(gen, rows):
+    return _get_store().evict(gen, rows)
+
+def prune_graph(max_nodes, low_water=1.0):
+    return _get_store().prune_graph(max_nodes, low_water)
+
+def graph_gaps(limit, followed):
+    """Graph nodes no task has followed up yet (see MemoryStore.graph_gaps)."""
+    return _get_store().graph_gaps(limit, tuple(followed))
 
 def add_node(node_id: str, node_type="task", label=None):
-    node_metadata[node_id] = {"type": node_type, "label": label or node_id}
+    _get_store().add_node(node_id, node_type, label or node_id)
 
 def add_relationship(source_id: str, target_id: str, relation_type="related"):
-    knowledge_graph[source_id].append({"target": target_id, "type": relation_type})
-    if source_id not in node_metadata:
+    store = _get_store()
+    store.add_edge(source_id, target_id, relation_type)
+    if source_id not in store.node_metadata:
         add_node(source_id)
-    if target_id not in node_metadata:
+    if target_id not in store.node_metadata:
         add_node(target_id)
 
-def get_knowledge_graph():
-    nodes = [{"id": k, "type": node_metadata[k]["type"], "label": node_metadata[k]["label"]} for k in knowledge_graph.keys()]
-    edges = []
-    for src, targets in knowledge_graph.items():
-        for t in targets:
-            edges.append({"source": src, "target": t["target"], "type": t["type"]})
-    return {"nodes": nodes, "links": edges}
\ No newline at end of file
+def _graph_json(store, version, node_ids, edges):
+    meta = store.node_metadata
+    nodes = [{"id": n, **meta.get(n, {"type": "task", "label": n})} for n in node_ids]
+    links = [{"source": src, "target": e["target"], "type": e["type"]} for src, e in edges]
+    return {"version": version, "nodes": nodes, "links": links}
+
+def get_knowledge_graph(cursor=0, limit=None):
+    """Snapshot (or one page of it) with the version it reflects."""
+    store = _get_store()
+    version, node_ids, edges, next_cursor = store.graph_page(cursor, limit)
+    graph = _graph_json(store, version, node_ids, edges)
+    graph["next_cursor"] = next_cursor
+    return graph
+
+def get_graph_changes(since):
+    """Ops after version `since`: {"version", "changes"}; "changes" is None
+    when the client is too far behind and should reload the snapshot.
+    """
+    version, ops = _get_store().graph_changes(since)
+    return {"version": version, "changes": None if ops is None else [dict(op) for op in ops]}
+
+def get_neighborhood(node_id, depth=1, limit=500):
+    store = _get_store()
+    version, node_ids, edges = store.neighborhood(node_id, depth, limit)
+    return _graph_json(store, version, node_ids, edges)
+
+def set_graph_listener(fn):
+    """Call fn(op) for every graph op; applied when the store opens if it is not open yet."""
+    global _graph_listener
+    with _store_lock:
+        _graph_listener = fn
+        if _store is not None:
+            _store.set_graph_listener(fn)
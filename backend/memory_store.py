@@ -0,0 +1,808 @@
+import os, json, time, shutil, threading, bisect, logging, fcntl
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from vector_index import VectorIndex
+
+# ------- Config ----------
+MEMORY_CACHE_BYTES = int(os.getenv("MEMORY_CACHE_BYTES", str(32 * 1024 * 1024)))  # resident text cache
+GRAPH_COMPACT_MIN = int(os.getenv("GRAPH_COMPACT_MIN", "10000"))  # graph log ops before compaction is considered
+GRAPH_CHANGELOG = int(os.getenv("GRAPH_CHANGELOG", "50000"))  # recent graph ops kept for ?since deltas
+COMPACT_CHUNK_ROWS = 65536  # vectors copied per step by compaction
+
+# On-disk layout (one directory per generation; CURRENT names the live one):
+#   CURRENT              -> "gen-000003"
+#   gen-000003/docs.log    append-only JSONL, one {"text","metadata"} record per row
+#   gen-000003/offsets.i64 row -> byte offset in docs.log (memmap)
+#   gen-000003/vectors.f32 row -> embedding (memmap)
+#   gen-000003/rows.f64    row -> added_at, last_hit_at, hits, source id (memmap; for retention)
+#   gen-000003/ivf.npz     IVF clustering of the vectors, if trained
+#   gen-000003/graph.log   append-only JSONL of node/edge/del_node ops, each stamped with a version "v"
+#   gen-000003/meta.json   committed row count, dim, docs.log length, source names and
+#                          the graph version/delta floor carried over by compaction
+#   LOCK                   flock held by a reader (shared) or writer (exclusive) in shared mode
+#   COMPACT                flock held for a whole compaction in shared mode (one at a time per root)
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_files(path: str):
+    """fsync every file in directory `path` (not the directory itself)."""
+    for name in os.listdir(path):
+        fd = os.open(os.path.join(path, name), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _atomic_write_json(path: str, data: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _atomic_write_text(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_ops(path: str, ops, mode: str = "wb"):
+    with open(path, mode) as out:
+        for op in ops:
+            out.write(json.dumps(op).encode("utf-8") + b"\n")
+        out.flush()
+        os.fsync(out.fileno())
+
+
+def source_of(metadata: Optional[dict]) -> str:
+    """Retention class of a document: metadata["source"], else inferred from its fields."""
+    md = metadata or {}
+    if md.get("source"):
+        return str(md["source"])
+    if "task_id" in md:
+        return "task"
+    if "filename" in md:
+        return "upload"
+    return "other"
+
+
+# row stats columns
+_ADDED, _LAST_HIT, _HITS, _SOURCE = range(4)
+
+
+# ---------- memory-mapped arrays ----------
+class _MappedArray:
+    """A memmap over a raw file that grows in place (file is extended, then remapped)."""
+
+    def __init__(self, path: str, dtype, width: int = 0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width  # 0 -> 1-D
+        self.arr = self._map()
+
+    def _row_bytes(self) -> int:
+        return self.dtype.itemsize * (self.width or 1)
+
+    def _shape(self, rows: int):
+        return (rows, self.width) if self.width else (rows,)
+
+    def _map(self):
+        rows = os.path.getsize(self.path) // self._row_bytes() if os.path.exists(self.path) else 0
+        if rows == 0:
+            return np.empty(self._shape(0), dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r+", shape=self._shape(rows))
+
+    def remap(self):
+        """Pick up growth of the file by another process."""
+        self.arr = self._map()
+
+    def resize(self, rows: int):
+        self.flush()
+        self.arr = None  # drop the old mapping before extending the file
+        with open(self.path, "ab") as f:
+            f.truncate(rows * self._row_bytes())
+        self.arr = self._map()
+
+    def ensure(self, rows: int, grow_by: int = 4096):
+        cap = len(self.arr)
+        if rows > cap:
+            self.resize(max(rows, cap + max(grow_by, cap // 2)))
+
+    def flush(self):
+        if isinstance(self.arr, np.memmap):
+            self.arr.flush()
+
+
+class _MappedIndex(VectorIndex):
+    """VectorIndex whose matrix lives in vectors.f32 and whose IVF layout is saved to ivf.npz."""
+
+    def __init__(self, gen_dir: str, dim: int, n: int):
+        self._vectors = _MappedArray(os.path.join(gen_dir, "vectors.f32"), np.float32, dim)
+        self._ivf_path = os.path.join(gen_dir, "ivf.npz")
+        super().__init__(dim, mat=self._vectors.arr, n=n)
+        if os.path.exists(self._ivf_path):
+            with np.load(self._ivf_path) as z:
+                state = {key: z[key] for key in z.files}
+            if int(state["ivf_n"]) <= n:  # ignore a layout newer than the committed rows
+                self.load_ivf_state(state)
+
+    def _resize(self, capacity: int):
+        self._vectors.resize(capacity)
+        self._mat = self._vectors.arr
+
+    def refresh(self, n: int):
+        """Adopt rows [0, n) and any IVF layout committed by another process."""
+        self._vectors.remap()
+        self._mat = self._vectors.arr
+        self._n = n
+        if os.path.exists(self._ivf_path):
+            with np.load(self._ivf_path) as z:
+                if int(z["ivf_n"]) != self._ivf_n and int(z["ivf_n"]) <= n:
+                    self.load_ivf_state({key: z[key] for key in z.files})
+
+    def _on_reindex(self):
+        tmp = f"{self._ivf_path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **self.ivf_state())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._ivf_path)
+
+    def flush(self):
+        self._vectors.flush()
+
+
+# ---------- store ----------
+class MemoryStore:
+    """Disk-backed documents, embeddings and knowledge graph.
+
+    Opening only maps files and replays the (small) graph log; document text
+    stays on disk and is read by offset, with a byte-bounded LRU in front.
+    Every append commits by atomically rewriting meta.json, so a crash
+    mid-append is rolled back to the last committed row on the next open.
+
+    With shared=True several processes on one host may open the same root:
+    writers hold an exclusive flock on LOCK, readers a shared one, and each
+    catches up with the others' commits (new rows, graph ops, a compacted
+    generation) when it takes the lock. Compaction holds LOCK only to take a
+    snapshot and to switch generations; the copy in between runs under COMPACT.
+    """
+
+    def __init__(self, root: str, shared: bool = False):
+        self.root = root
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._graph_listener = None
+        self._flock_depth = 0
+        os.makedirs(root, exist_ok=True)
+        self._flock_fd = os.open(os.path.join(root, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644) if shared else None
+        self._compact_lock = threading.Lock()
+        self._compact_fd = os.open(os.path.join(root, "COMPACT"), os.O_RDWR | os.O_CREAT, 0o644) if shared else None
+        with self._lock:
+            if shared:
+                fcntl.flock(self._flock_fd, fcntl.LOCK_EX)  # repairs below must not race a writer
+            try:
+                current = os.path.join(root, "CURRENT")
+                if os.path.exists(current):
+                    self._gen = self._read_current()
+                else:
+                    self._gen = 1
+                    os.makedirs(self._gen_dir(self._gen), exist_ok=True)
+                    _atomic_write_text(current, self._gen_name(self._gen))
+                    _fsync_dir(root)
+                self._remove_stale_generations_unless_compacting()
+                self._open_generation()
+            finally:
+                if shared:
+                    fcntl.flock(self._flock_fd, fcntl.LOCK_UN)
+
+    # ---------- cross-process access ----------
+    @contextmanager
+    def _guard(self, exclusive: bool):
+        """The in-process lock, plus in shared mode the LOCK flock and a
+        catch-up with other processes on first entry.
+        """
+        with self._lock:
+            if not self.shared or self._flock_depth:
+                self._flock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._flock_depth -= 1
+                return
+            fcntl.flock(self._flock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._flock_depth = 1
+            try:
+                self._sync(repair=exclusive)
+                yield
+            finally:
+                self._flock_depth = 0
+                fcntl.flock(self._flock_fd, fcntl.LOCK_UN)
+
+    def _read_current(self) -> int:
+        with open(os.path.join(self.root, "CURRENT"), encoding="utf-8") as f:
+            return int(f.read().strip().split("-")[-1])
+
+    def _sync(self, repair: bool):
+        gen = self._read_current()
+        if gen != self._gen:  # another process compacted
+            self.close()
+            self._gen = gen
+            self._open_generation(repair)
+            return
+        gdir = self._gen_dir(self._gen)
+        meta_path = os.path.join(gdir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if int(meta["count"]) > self.count:
+                self.count, self.dim, self.log_end = int(meta["count"]), meta["dim"], int(meta["log_end"])
+                self._offsets.remap()
+                self._rowstats.remap()
+                self._sources = meta.get("sources", self._sources)
+                if self.index is None:
+                    self.index = _MappedIndex(gdir, self.dim, self.count)
+                else:
+                    self.index.refresh(self.count)
+        graph_path = os.path.join(gdir, "graph.log")
+        if os.path.getsize(graph_path) > self._graph_pos:
+            ops, self._graph_pos = self._replay_graph(graph_path, self._graph_pos, repair, notify=True)
+            self._graph_ops += ops
+
+    def refresh(self) -> int:
+        """Catch up with other processes (shared mode); returns the row count."""
+        with self._guard(exclusive=False):
+            return self.count
+
+    # ---------- generations ----------
+    @staticmethod
+    def _gen_name(gen: int) -> str:
+        return f"gen-{gen:06d}"
+
+    def _gen_dir(self, gen: int) -> str:
+        return os.path.join(self.root, self._gen_name(gen))
+
+    def _remove_stale_generations(self):
+        live = self._gen_name(self._gen)
+        for name in os.listdir(self.root):
+            if name.startswith("gen-") and name != live:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def _remove_stale_generations_unless_compacting(self):
+        """Left-overs of a crashed compaction; skipped while another process is
+        writing the next generation (its compactor removes the old one itself).
+        """
+        if self._compact_fd is None:
+            self._remove_stale_generations()
+            return
+        try:
+            fcntl.flock(self._compact_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            self._remove_stale_generations()
+        finally:
+            fcntl.flock(self._compact_fd, fcntl.LOCK_UN)
+
+    def _open_generation(self, repair: bool = True):
+        gdir = self._gen_dir(self._gen)
+        meta_path = os.path.join(gdir, "meta.json")
+        meta = {"count": 0, "dim": None, "log_end": 0, "sources": [], "graph_base": 0, "graph_floor": 0}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta.update(json.load(f))
+        self.count = int(meta["count"])
+        self.dim = meta["dim"]
+        self.log_end = int(meta["log_end"])
+        self._sources = list(meta["sources"])
+        self._graph_base = int(meta["graph_base"])    # version when this generation was compacted
+        self._graph_floor = int(meta["graph_floor"])  # last delete folded away by a compaction
+        self._sources_dirty = False
+
+        # not O_APPEND: appends go to log_end explicitly, past any torn bytes
+        self._log = os.fdopen(os.open(os.path.join(gdir, "docs.log"), os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        if repair:
+            self._log.truncate(self.log_end)  # drop a torn, uncommitted append
+        self._offsets = _MappedArray(os.path.join(gdir, "offsets.i64"), np.int64)
+        self._rowstats = _MappedArray(os.path.join(gdir, "rows.f64"), np.float64, 4)
+        self.index = _MappedIndex(gdir, self.dim, self.count) if self.dim else None
+        if repair and len(self._rowstats.arr) < self.count:
+            self._backfill_rowstats()
+
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+        self.knowledge_graph = defaultdict(list)   # source -> [{"target", "type", "v"}]
+        self.reverse_graph = defaultdict(list)     # target -> [{"source", "type", "v"}]
+        self.node_metadata = {}
+        self._node_version = {}
+        self.graph_version = self._graph_base
+        self._changes = deque()   # recent ops in version order
+        # deltas are complete only for since >= this: compaction drops deleted items with their ops
+        self._changes_floor = self._graph_floor
+        self._last_delete = 0
+        self._graph_ops, self._graph_pos = self._replay_graph(os.path.join(gdir, "graph.log"), 0, repair)
+        self._graph_log = open(os.path.join(gdir, "graph.log"), "ab")
+
+    def _write_meta(self):
+        _atomic_write_json(os.path.join(self._gen_dir(self._gen), "meta.json"),
+                           {"count": self.count, "dim": self.dim, "log_end": self.log_end, "sources": self._sources,
+                            "graph_base": self._graph_base, "graph_floor": self._graph_floor})
+
+    def _backfill_rowstats(self):
+        """Row stats for a store written before they existed: everything counts as added now."""
+        start = len(self._rowstats.arr)
+        self._rowstats.ensure(self.count)
+        stats = self._rowstats.arr
+        stats[start:self.count, _ADDED] = time.time()
+        for row in range(start, self.count):
+            stats[row, _SOURCE] = self._source_id(source_of(self._read_record(row).get("metadata")))
+        self._rowstats.flush()
+        if self._sources_dirty:
+            self._write_meta()
+
+    def _source_id(self, source: str) -> int:
+        try:
+            return self._sources.index(source)
+        except ValueError:
+            self._sources.append(source)
+            self._sources_dirty = True
+            return len(self._sources) - 1
+
+    def _read_record(self, row: int) -> dict:
+        start = int(self._offsets.arr[row])
+        end = int(self._offsets.arr[row + 1]) if row + 1 < self.count else self.log_end
+        return json.loads(os.pread(self._log.fileno(), end - start, start))
+
+    def close(self):
+        with self._lock:
+            self._offsets.flush()
+            self._rowstats.flush()
+            if self.index is not None:
+                self.index.flush()
+            self._log.close()
+            self._graph_log.close()
+
+    # ---------- documents ----------
+    def add_many(self, texts: List[str], metadatas: List[Optional[dict]], vecs: np.ndarray) -> np.ndarray:
+        with self._guard(exclusive=True):
+            if self.index is None:
+                self.dim = int(vecs.shape[1])
+                self.index = _MappedIndex(self._gen_dir(self._gen), self.dim, 0)
+            elif vecs.shape[1] != self.dim:
+                raise ValueError(f"embedding dim {vecs.shape[1]} does not match store dim {self.dim}")
+
+            lines = [json.dumps({"text": t, "metadata": m}).encode("utf-8") + b"\n" for t, m in zip(texts, metadatas)]
+            starts = self.log_end + np.concatenate(([0], np.cumsum([len(l) for l in lines])[:-1]))
+            self._log.seek(self.log_end)
+            self._log.write(b"".join(lines))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+            n = len(lines)
+            self._offsets.ensure(self.count + n)
+            self._offsets.arr[self.count:self.count + n] = starts
+            self._offsets.flush()
+            self._rowstats.ensure(self.count + n)
+            new = self._rowstats.arr[self.count:self.count + n]
+            new[:, _ADDED], new[:, _LAST_HIT], new[:, _HITS] = time.time(), 0, 0
+            new[:, _SOURCE] = [self._source_id(source_of(m)) for m in metadatas]
+            self._rowstats.flush()
+            ids = self.index.add(vecs)
+            self.index.flush()
+
+            self.count += n
+            self.log_end += sum(len(l) for l in lines)
+            self._write_meta()
+            self._sources_dirty = False
+            return ids
+
+    def get(self, row: int) -> dict:
+        """Read one {"text","metadata"} record, through the LRU text cache."""
+        with self._guard(exclusive=False):
+            hit = self._cache.get(row)
+            if hit is not None:
+                self._cache.move_to_end(row)
+                return hit[0]
+            start = int(self._offsets.arr[row])
+            end = int(self._offsets.arr[row + 1]) if row + 1 < self.count else self.log_end
+            rec = json.loads(os.pread(self._log.fileno(), end - start, start))
+            self._cache[row] = (rec, end - start)
+            self._cache_bytes += end - start
+            while self._cache_bytes > MEMORY_CACHE_BYTES and len(self._cache) > 1:
+                _, (_, size) = self._cache.popitem(last=False)
+                self._cache_bytes -= size
+            return rec
+
+    def search(self, vec: np.ndarray, k: int):
+        with self._guard(exclusive=False):
+            if self.index is None or self.count == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            return self.index.search(vec, k)
+
+    def search_records(self, vec: np.ndarray, k: int):
+        """search() + get() under one lock, so rows can't be renumbered in between.
+        Counts a retrieval hit on each returned row (unsynchronised between
+        processes, so approximate; it only orders LRU eviction).
+        """
+        with self._guard(exclusive=False):
+            ids, scores = self.search(vec, k)
+            if len(ids):
+                stats = self._rowstats.arr
+                stats[ids, _LAST_HIT] = time.time()
+                stats[ids, _HITS] += 1
+            return [(self.get(int(i)), float(sc)) for i, sc in zip(ids, scores)]
+
+    # ---------- retention ----------
+    def retention_view(self) -> dict:
+        """Per-row inputs for a retention plan, tagged with the generation they
+        describe (row numbers are only valid within it).
+        """
+        with self._guard(exclusive=False):
+            n = self.count
+            offsets = np.append(self._offsets.arr[:n], self.log_end)
+            stats = np.array(self._rowstats.arr[:n])
+            return {"gen": self._gen, "count": n, "sources": list(self._sources), "sizes": np.diff(offsets),
+                    "added": stats[:, _ADDED], "last_hit": stats[:, _LAST_HIT], "hits": stats[:, _HITS],
+                    "source": stats[:, _SOURCE].astype(np.int64)}
+
+    def records(self, gen: int, rows) -> Optional[List[dict]]:
+        """Records for `rows` of generation `gen`; None if it has been compacted since."""
+        with self._guard(exclusive=False):
+            if gen != self._gen:
+                return None
+            return [self._read_record(int(r)) for r in rows]
+
+    def evict(self, gen: int, rows) -> Optional[int]:
+        """Drop `rows` of generation `gen` by compacting; rows added since the
+        plan are kept. None (nothing done) if another compaction got there first.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        keep = np.ones(int(rows.max()) + 1 if len(rows) else 0, dtype=bool)
+        keep[rows] = False
+        if self.compact(keep, gen=gen) is None:
+            return None
+        return int((~keep).sum())
+
+    # ---------- graph ----------
+    def _replay_graph(self, path: str, start: int = 0, repair: bool = True, notify: bool = False):
+        """Apply ops from byte `start`; returns (ops applied, end of the last whole line)."""
+        ops = 0
+        if not os.path.exists(path):
+            return ops, start
+        good = start
+        with open(path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    op = json.loads(line)
+                except ValueError:
+                    break  # torn tail from a crash; truncated below
+                self._apply_graph_op(op)
+                if notify:
+                    self._notify_graph(op)
+                good += len(line)
+                ops += 1
+        if repair:
+            os.truncate(path, good)
+        return ops, good
+
+    def _apply_graph_op(self, op: dict):
+        if "v" not in op:  # logs written before versioning: number ops in log order
+            op["v"] = self.graph_version + 1
+        v = op["v"]
+        self.graph_version = max(self.graph_version, v)
+        if op["op"] == "node":
+            self.node_metadata[op["id"]] = {"type": op["type"], "label": op["label"]}
+            self._node_version[op["id"]] = v
+        elif op["op"] == "edge":
+            self.knowledge_graph[op["source"]].append({"target": op["target"], "type": op["type"], "v": v})
+            self.reverse_graph[op["target"]].append({"source": op["source"], "type": op["type"], "v": v})
+        elif op["op"] == "del_node":  # the node and every edge touching it
+            self._last_delete = v
+            node_id = op["id"]
+            self.node_metadata.pop(node_id, None)
+            self._node_version.pop(node_id, None)
+            for e in self.knowledge_graph.pop(node_id, ()):
+                self._drop_edges(self.reverse_graph, e["target"], "source", node_id)
+            for e in self.reverse_graph.pop(node_id, ()):
+                self._drop_edges(self.knowledge_graph, e["source"], "target", node_id)
+        self._changes.append(op)
+        if len(self._changes) > GRAPH_CHANGELOG:
+            self._changes_floor = self._changes.popleft()["v"]
+
+    @staticmethod
+    def _drop_edges(adjacency, node_id: str, field: str, other: str):
+        edges = adjacency.get(node_id)
+        if edges:
+            edges[:] = [e for e in edges if e[field] != other]
+            if not edges:
+                del adjacency[node_id]
+
+    def _log_graph_op(self, op: dict):
+        self._log_graph_ops([op])
+
+    def _log_graph_ops(self, ops: List[dict]):
+        """Apply and durably append ops (one fsync for the batch)."""
+        lines = []
+        for op in ops:
+            op["v"] = self.graph_version + 1
+            self._apply_graph_op(op)
+            lines.append(json.dumps(op).encode("utf-8") + b"\n")
+        if os.fstat(self._graph_log.fileno()).st_size != self._graph_pos:
+            self._graph_log.truncate(self._graph_pos)  # torn tail left by a crashed writer
+        data = b"".join(lines)
+        self._graph_log.write(data)
+        self._graph_log.flush()
+        os.fsync(self._graph_log.fileno())
+        self._graph_pos += len(data)
+        self._graph_ops += len(ops)
+        for op in ops:
+            self._notify_graph(op)
+
+    def _notify_graph(self, op: dict):
+        if self._graph_listener is not None:
+            try:
+                self._graph_listener(op)
+            except Exception:
+                logging.exception("Graph listener failed")  # the op itself is already durable
+
+    def set_graph_listener(self, fn: Optional[Callable[[dict], None]]):
+        """fn(op) is called after every durable graph change, from the writing thread."""
+        self._graph_listener = fn
+
+    def graph_changes(self, since: int):
+        """(version, ops with v > since in order), or (version, None) when the
+        change log no longer reaches back to `since` and a full reload is needed.
+        """
+        with self._guard(exclusive=False):
+            if since < self._changes_floor or since > self.graph_version:
+                return self.graph_version, None
+            i = bisect.bisect_right(self._changes, since, key=lambda op: op["v"])
+            return self.graph_version, [self._changes[j] for j in range(i, len(self._changes))]
+
+    def graph_page(self, cursor: int = 0, limit: Optional[int] = None):
+        """Nodes [cursor, cursor+limit) in creation order with their outgoing
+        edges; next_cursor is None on the last page.
+        """
+        with self._guard(exclusive=False):
+            ids = list(self.node_metadata)
+            end = len(ids) if limit is None else min(len(ids), cursor + limit)
+            page = ids[cursor:end]
+            edges = [(src, e) for src in page for e in self.knowledge_graph.get(src, ())]
+            return self.graph_version, page, edges, (end if end < len(ids) else None)
+
+    def neighborhood(self, node_id: str, depth: int = 1, limit: int = 500):
+        """Nodes within `depth` hops of node_id (either edge direction), breadth
+        first and capped at `limit`, plus the edges among them.
+        """
+        with self._guard(exclusive=False):
+            if node_id not in self.node_metadata and node_id not in self.knowledge_graph \
+                    and node_id not in self.reverse_graph:
+                return self.graph_version, [], []
+            seen = {node_id: None}
+            frontier = [node_id]
+            for _ in range(depth):
+                nxt = []
+                for n in frontier:
+                    for nb in [e["target"] for e in self.knowledge_graph.get(n, ())] + \
+                              [e["source"] for e in self.reverse_graph.get(n, ())]:
+                        if nb not in seen and len(seen) < limit:
+                            seen[nb] = None
+                            nxt.append(nb)
+                frontier = nxt
+            edges = [(src, e) for src in seen for e in self.knowledge_graph.get(src, ()) if e["target"] in seen]
+            return self.graph_version, list(seen), edges
+
+    def graph_gaps(self, limit: int, followed: Tuple[str, ...]) -> List[dict]:
+        """Nodes no task has followed up yet (an incoming edge of a `followed`
+        type), newest first: documents, then tasks with a produced insight
+        that were not themselves generated to follow something up.
+        Returns up to `limit` of {"kind": "document"|"task", "id", "label"}.
+        """
+        with self._guard(exclusive=False):
+            gaps = {"document": [], "task": []}
+            for node_id, meta in self.node_metadata.items():
+                kind = meta["type"]
+                if kind not in gaps or any(e["type"] in followed for e in self.reverse_graph.get(node_id, ())):
+                    continue
+                out = self.knowledge_graph.get(node_id, ())
+                if kind == "task" and (any(e["type"] in followed for e in out)
+                                       or not any(e["type"] == "produces" for e in out)):
+                    continue
+                gaps[kind].append(node_id)
+            found = []
+            for kind in ("document", "task"):
+                for node_id in sorted(gaps[kind], key=lambda n: -self._node_version.get(n, 0)):
+                    found.append({"kind": kind, "id": node_id, "label": self.node_metadata[node_id]["label"]})
+            return found[:limit]
+
+    def add_node(self, node_id: str, node_type: str, label: str):
+        with self._guard(exclusive=True):
+            if self.node_metadata.get(node_id) == {"type": node_type, "label": label}:
+                return
+            self._log_graph_op({"op": "node", "id": node_id, "type": node_type, "label": label})
+
+    def add_edge(self, source_id: str, target_id: str, relation_type: str):
+        with self._guard(exclusive=True):
+            self._log_graph_op({"op": "edge", "source": source_id, "target": target_id, "type": relation_type})
+
+    def prune_graph(self, max_nodes: int, low_water: float = 1.0) -> int:
+        """Delete the least recently active nodes (newest op on the node or its
+        edges) until at most max_nodes * low_water remain, if over max_nodes.
+        Returns the number deleted.
+        """
+        with self._guard(exclusive=True):
+            nodes = set(self.node_metadata) | set(self.knowledge_graph) | set(self.reverse_graph)
+            if len(nodes) <= max_nodes:
+                return 0
+            active = {n: self._node_version.get(n, 0) for n in nodes}
+            for src, edges in self.knowledge_graph.items():
+                for e in edges:
+                    active[src] = max(active[src], e["v"])
+                    active[e["target"]] = max(active[e["target"]], e["v"])
+            victims = sorted(nodes, key=active.__getitem__)[:len(nodes) - int(max_nodes * low_water)]
+            self._log_graph_ops([{"op": "del_node", "id": n} for n in victims])
+        self.maybe_compact()  # after releasing the guard: compaction takes it itself
+        return len(victims)
+
+    # ---------- compaction ----------
+    def maybe_compact(self) -> bool:
+        """Compact if the graph log has grown well past the live graph. Not called
+        from the mutators: the lab loop runs it in the background.
+        """
+        with self._guard(exclusive=False):
+            live = len(self.node_metadata) + sum(len(v) for v in self.knowledge_graph.values())
+            due = self._graph_ops > max(GRAPH_COMPACT_MIN, 2 * live)
+        if due:
+            self.compact()
+        return due
+
+    @contextmanager
+    def _compacting(self):
+        """One compaction at a time: across threads, and in shared mode across processes."""
+        with self._compact_lock:
+            if self._compact_fd is None:
+                yield
+                return
+            fcntl.flock(self._compact_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._compact_fd, fcntl.LOCK_UN)
+
+    def _live_graph_ops(self) -> List[dict]:
+        """The live graph as ops, each item keeping its last version, in version order."""
+        ops = [{"op": "node", "id": node_id, **meta, "v": self._node_version[node_id]}
+               for node_id, meta in self.node_metadata.items()]
+        ops += [{"op": "edge", "source": src, "target": t["target"], "type": t["type"], "v": t["v"]}
+                for src, targets in self.knowledge_graph.items() for t in targets]
+        ops.sort(key=lambda op: op["v"])
+        return ops
+
+    def compact(self, keep: Optional[np.ndarray] = None, gen: Optional[int] = None) -> Optional[np.ndarray]:
+        """Rewrite the live state into a fresh generation and switch CURRENT to it.
+
+        `keep` is an optional boolean mask over rows; dropped rows are not
+        copied, rows past its end are kept, and surviving rows are renumbered
+        (the old->new map is returned, -1 for dropped). With `gen`, returns
+        None without compacting unless that generation is still the live one.
+
+        The store lock is held twice, briefly: for a snapshot (row count,
+        graph), then to append what was added during the copy and switch
+        generations. The bulk copy runs without it, so readers and writers
+        carry on meanwhile. Must not be called with the guard held. A crash
+        before CURRENT is replaced leaves the old generation live; the
+        half-written one is removed on the next open.
+        """
+        with self._compacting():
+            with self._guard(exclusive=False):
+                if gen is not None and gen != self._gen:
+                    return None
+                old_gen, new_gen = self._gen, self._gen + 1
+                n0, end0, v0 = self.count, self.log_end, self.graph_version
+                mask = np.ones(n0, dtype=bool)
+                if keep is not None:
+                    mask[:min(len(keep), n0)] = keep[:n0]
+                # committed rows are never rewritten, and growth remaps without unmapping these
+                offsets = self._offsets.arr[:n0]
+                vectors = self.index.vectors[:n0] if self.index is not None else None
+                graph = self._live_graph_ops()
+            rows = np.flatnonzero(mask)
+            odir, ndir = self._gen_dir(old_gen), self._gen_dir(new_gen)
+            shutil.rmtree(ndir, ignore_errors=True)
+            os.makedirs(ndir)
+
+            log_end = 0
+            new_offsets = np.empty(len(rows), dtype=np.int64)
+            src = os.open(os.path.join(odir, "docs.log"), os.O_RDONLY)
+            try:
+                with open(os.path.join(ndir, "docs.log"), "wb") as out:
+                    for new_row, row in enumerate(rows):
+                        start = int(offsets[row])
+                        end = int(offsets[row + 1]) if row + 1 < n0 else end0
+                        raw = os.pread(src, end - start, start)
+                        new_offsets[new_row] = log_end
+                        out.write(raw)
+                        log_end += len(raw)
+                    out.flush()
+                    os.fsync(out.fileno())
+            finally:
+                os.close(src)
+            new_offsets.tofile(os.path.join(ndir, "offsets.i64"))
+            if vectors is not None:
+                with open(os.path.join(ndir, "vectors.f32"), "wb") as out:
+                    for i in range(0, len(rows), COMPACT_CHUNK_ROWS):
+                        np.ascontiguousarray(vectors[rows[i:i + COMPACT_CHUNK_ROWS]]).tofile(out)
+            _write_ops(os.path.join(ndir, "graph.log"), graph)
+            _fsync_files(ndir)  # the bulk of it, before taking the lock
+
+            with self._guard(exclusive=True):
+                # rows and graph ops committed during the copy (here or by another process)
+                n1 = self.count
+                if n1 > n0:
+                    start = int(self._offsets.arr[n0])
+                    raw = os.pread(self._log.fileno(), self.log_end - start, start)
+                    with open(os.path.join(ndir, "docs.log"), "ab") as out:
+                        out.write(raw)
+                        out.flush()
+                        os.fsync(out.fileno())
+                    with open(os.path.join(ndir, "offsets.i64"), "ab") as out:
+                        (self._offsets.arr[n0:n1] - start + log_end).astype(np.int64).tofile(out)
+                    with open(os.path.join(ndir, "vectors.f32"), "ab") as out:
+                        np.ascontiguousarray(self.index.vectors[n0:n1]).tofile(out)
+                    log_end += len(raw)
+                    rows = np.concatenate((rows, np.arange(n0, n1)))
+                # hit counts kept moving during the copy: taken now
+                np.ascontiguousarray(self._rowstats.arr[rows]).tofile(os.path.join(ndir, "rows.f64"))
+                if keep is None and self.index is not None and self.index.ivf_state() is not None:
+                    shutil.copyfile(self._ivf_path(old_gen), os.path.join(ndir, "ivf.npz"))
+                if self._changes_floor > v0:  # more ops than the change log holds: snapshot again
+                    _write_ops(os.path.join(ndir, "graph.log"), self._live_graph_ops())
+                else:
+                    i = bisect.bisect_right(self._changes, v0, key=lambda op: op["v"])
+                    _write_ops(os.path.join(ndir, "graph.log"),
+                               [self._changes[j] for j in range(i, len(self._changes))], "ab")
+
+                # a client older than the last delete can't be brought up to date from the live ops alone
+                floor = max(self._graph_floor, self._last_delete)
+                _atomic_write_json(os.path.join(ndir, "meta.json"),
+                                   {"count": len(rows), "dim": self.dim, "log_end": log_end, "sources": self._sources,
+                                    "graph_base": self.graph_version, "graph_floor": floor})
+                # every data file durable before CURRENT points at them and the old copy goes
+                _fsync_files(ndir)
+                _fsync_dir(ndir)
+                _atomic_write_text(os.path.join(self.root, "CURRENT"), self._gen_name(new_gen))
+                _fsync_dir(self.root)
+
+                remap = None
+                if keep is not None:
+                    remap = np.full(n1, -1, dtype=np.int64)
+                    remap[rows] = np.arange(len(rows))
+                self.close()
+                self._gen = new_gen
+                self._open_generation()
+                shutil.rmtree(odir, ignore_errors=True)
+                return remap
+
+    def _ivf_path(self, gen: int) -> str:
+        return os.path.join(self._gen_dir(gen), "ivf.npz")
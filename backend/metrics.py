@@ -0,0 +1,189 @@
+import os, time, bisect, threading, contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ------- Config ----------
+# write task_<id>_<stamp>.trace.json (per-stage spans) next to each result
+TASK_TRACE = os.getenv("TASK_TRACE", "0") == "1"
+# seconds; stages range from sub-millisecond memory inserts to minutes of generation
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()  # spans also close on to_thread workers
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _fmt(self, key: tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labels, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return super().render() + [f"{self.name}{self._fmt(k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Read at scrape time from fn() -> {label values tuple (or ()): value}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn: Callable[[], Dict[tuple, float]], labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def render(self):
+        return super().render() + [f"{self.name}{self._fmt(tuple(map(str, k)))} {_num(v)}"
+                                   for k, v in sorted(self.fn().items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {}  # key -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = super().render()
+        for key, row in items:
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), row):
+                total += n
+                out.append(f"{self.name}_bucket{self._fmt(key, ('le', _num(bound)))} {total}")
+            out.append(f"{self.name}_sum{self._fmt(key)} {_num(row[-1])}")
+            out.append(f"{self.name}_count{self._fmt(key)} {total}")
+        return out
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v) -> str:
+    return v if isinstance(v, str) else str(v) if isinstance(v, int) else repr(float(v))
+
+
+_registry: List[_Metric] = []
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- lab metrics ----------
+STAGE_SECONDS = Histogram("lab_stage_seconds", "Wall time per task pipeline stage.", ("stage",))
+TASK_SECONDS = Histogram("lab_task_seconds", "Wall time per task, claim to completion.", ("outcome",))
+TASKS = Counter("lab_tasks_total", "Tasks finished, by outcome.", ("outcome",))
+LLM_SECONDS = Histogram("lab_llm_seconds", "Ollama-reported time per call: prompt_eval or eval (generation).",
+                        ("model", "phase"))
+LLM_TOKENS = Counter("lab_llm_tokens_total", "Ollama-reported tokens: prompt or completion.", ("model", "kind"))
+LLM_CALLS = Counter("lab_llm_calls_total", "Chat calls by model and how they were served.", ("model", "source"))
+
+
+# ---------- spans ----------
+class Trace:
+    """Spans of one task, offsets relative to its start."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans: List[dict] = []
+
+    def add(self, stage: str, start: float, seconds: float, **extra):
+        self.spans.append({"stage": stage, "at": round(start - self.t0, 4), "seconds": round(seconds, 4), **extra})
+
+    def to_dict(self) -> dict:
+        return {"seconds": round(time.perf_counter() - self.t0, 4), "spans": self.spans}
+
+
+# copied into tasks and to_thread calls, so spans anywhere under a task land in its trace
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("lab_trace", default=None)
+
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def record(stage: str, seconds: float, start: Optional[float] = None, **extra):
+    """Add a span measured elsewhere (e.g. the claim before the trace started)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(stage, start if start is not None else time.perf_counter() - seconds, seconds, **extra)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block into lab_stage_seconds{stage} and the current task trace."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t, start=t)
+
+
+def record_llm(model: str, data: dict):
+    """Ollama's final reply carries its own timings (ns): prompt evaluation,
+    then generation. Traced as sub-spans ending now, inside the call's wall time.
+    """
+    end = time.perf_counter()
+    prompt_s = (data.get("prompt_eval_duration") or 0) / 1e9
+    eval_s = (data.get("eval_duration") or 0) / 1e9
+    trace = _trace.get()
+    for phase, seconds, start, count, kind in (
+            ("prompt_eval", prompt_s, end - eval_s - prompt_s, "prompt_eval_count", "prompt"),
+            ("eval", eval_s, end - eval_s, "eval_count", "completion")):
+        if seconds:
+            LLM_SECONDS.observe(seconds, model=model, phase=phase)
+            if trace is not None:
+                trace.add(f"llm_{phase}", start, seconds, model=model, tokens=data.get(count, 0))
+        if data.get(count):
+            LLM_TOKENS.inc(data[count], model=model, kind=kind)
@@ -1,23 +1,286 @@
-# import smtplib
-# from email.message import EmailMessage
-# import requests
-# from config import EMAIL_USER, EMAIL_PASSWORD
-
-
-def notify(subject, body, method="console", recipient=None, webhook_url=None):
-    if method == "console":
-        print(f"[NOTIFICATION]\nSubject: {subject}\nMessage: {body}\n")
-
-# def notify_email(subject, body, recipient=EMAIL_USER):
-#     msg = EmailMessage()
-#     msg.set_content(body)
-#     msg['Subject'] = subject
-#     msg['From'] = EMAIL_USER
-#     msg['To'] = recipient
-#     with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-#         server.login(EMAIL_USER, EMAIL_PASSWORD)
-#         server.send_message(msg)
-
-# def notify_slack(message, webhook_url):
-#     payload = {"text": message}
-#     requests.post(webhook_url, json=payload)
\ No newline at end of file
+import os, json, time, random, asyncio, logging, smtplib
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+from http_client import http
+from metrics import Counter
+
+# ------- Config ----------
+# comma list of console, slack, webhook, email; notify() only enqueues, delivery runs in the background
+NOTIFY_CHANNELS = os.getenv("NOTIFY_CHANNELS", "console")
+NOTIFY_SLACK_WEBHOOK = os.getenv("NOTIFY_SLACK_WEBHOOK", "")  # Slack incoming-webhook URL: {"text": ...}
+NOTIFY_WEBHOOK_URL = os.getenv("NOTIFY_WEBHOOK_URL", "")      # any endpoint: {"text", "notifications": [...]}
+NOTIFY_SMTP_HOST = os.getenv("NOTIFY_SMTP_HOST", "smtp.gmail.com")
+NOTIFY_SMTP_PORT = int(os.getenv("NOTIFY_SMTP_PORT", "465"))
+NOTIFY_SMTP_TLS = os.getenv("NOTIFY_SMTP_TLS", "ssl")         # ssl, starttls or 0 (plain, e.g. a local sink)
+EMAIL_USER = os.getenv("EMAIL_USER", "")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
+NOTIFY_EMAIL_TO = os.getenv("NOTIFY_EMAIL_TO", "") or EMAIL_USER
+# per channel, "name=value,...": a digest goes out at NOTIFY_BATCH_MAX notifications or NOTIFY_BATCH_SEC
+# after the first one, whichever comes first; at most NOTIFY_RATE_PER_MIN deliveries a minute (0 = no limit)
+NOTIFY_BATCH_MAX = os.getenv("NOTIFY_BATCH_MAX", "console=1,slack=20,webhook=20,email=50")
+NOTIFY_BATCH_SEC = os.getenv("NOTIFY_BATCH_SEC", "console=0,slack=60,webhook=60,email=300")
+NOTIFY_RATE_PER_MIN = os.getenv("NOTIFY_RATE_PER_MIN", "console=0,slack=20,webhook=60,email=4")
+NOTIFY_RETRIES = int(os.getenv("NOTIFY_RETRIES", "4"))
+NOTIFY_BACKOFF_SEC = float(os.getenv("NOTIFY_BACKOFF_SEC", "2"))
+NOTIFY_QUEUE = int(os.getenv("NOTIFY_QUEUE", "10000"))        # per channel; notifications past it are dropped
+NOTIFY_DEAD_LETTER = os.getenv("NOTIFY_DEAD_LETTER", "./notify_dead_letter.jsonl")
+
+NOTIFICATIONS = Counter("lab_notifications_total", "Notifications by channel and outcome.", ("channel", "outcome"))
+_SEND_TIMEOUT = 30.0
+
+
+def _per_channel(spec: str) -> Dict[str, float]:
+    out = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, value = item.partition("=")
+        out[name.strip()] = float(value or 0)
+    return out
+
+
+def _digest(batch: List[dict]) -> tuple:
+    """(subject, body) for one delivery: the notification itself, or a digest of several."""
+    if len(batch) == 1:
+        return batch[0]["subject"], batch[0]["body"]
+    lines = [f"- {n['subject']}: {n['body']}" for n in batch]
+    return f"{len(batch)} notifications", "\n".join(lines)
+
+
+class RateLimiter:
+    """Token bucket: `per_min` deliveries a minute, bursting to one minute's worth."""
+
+    def __init__(self, per_min: float):
+        self.rate = per_min / 60.0
+        self.capacity = max(1.0, per_min)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ---------- channels: each sends one (possibly digested) batch or raises ----------
+async def _send_console(batch: List[dict]):
+    subject, body = _digest(batch)
+    print(f"[NOTIFICATION]\nSubject: {subject}\nMessage: {body}\n")
+
+
+async def _post(url: str, payload: dict):
+    # retried by the dispatcher (with the dead letter behind it), not by the shared client
+    async with http.slots(url):
+        resp = await http.client().post(url, json=payload, timeout=_SEND_TIMEOUT)
+    resp.raise_for_status()
+
+
+async def _send_slack(batch: List[dict]):
+    subject, body = _digest(batch)
+    await _post(NOTIFY_SLACK_WEBHOOK, {"text": f"*{subject}*\n{body}"})
+
+
+async def _send_webhook(batch: List[dict]):
+    subject, body = _digest(batch)
+    await _post(NOTIFY_WEBHOOK_URL, {"text": f"{subject}\n{body}", "notifications": batch})
+
+
+def _smtp_send(subject: str, body: str, recipient: str):
+    msg = EmailMessage()
+    msg.set_content(body)
+    msg["Subject"] = subject
+    msg["From"] = EMAIL_USER or "agentic-lab@localhost"
+    msg["To"] = recipient
+    if NOTIFY_SMTP_TLS == "ssl":
+        server = smtplib.SMTP_SSL(NOTIFY_SMTP_HOST, NOTIFY_SMTP_PORT, timeout=_SEND_TIMEOUT)
+    else:
+        server = smtplib.SMTP(NOTIFY_SMTP_HOST, NOTIFY_SMTP_PORT, timeout=_SEND_TIMEOUT)
+    with server:
+        if NOTIFY_SMTP_TLS == "starttls":
+            server.starttls()
+        if EMAIL_USER and EMAIL_PASSWORD:
+            server.login(EMAIL_USER, EMAIL_PASSWORD)
+        server.send_message(msg)
+
+
+async def _send_email(batch: List[dict]):
+    # one message per recipient; smtplib blocks, so it runs on a thread
+    by_recipient: Dict[str, List[dict]] = {}
+    for n in batch:
+        by_recipient.setdefault(n.get("recipient") or NOTIFY_EMAIL_TO, []).append(n)
+    for recipient, group in by_recipient.items():
+        subject, body = _digest(group)
+        await asyncio.to_thread(_smtp_send, subject, body, recipient)
+
+
+_SENDERS = {"console": _send_console, "slack": _send_slack, "webhook": _send_webhook, "email": _send_email}
+
+
+class _Channel:
+    def __init__(self, name: str, batch_max: int, batch_sec: float, rate_per_min: float):
+        self.name = name
+        self.send = _SENDERS[name]
+        self.batch_max = max(1, batch_max)
+        self.batch_sec = batch_sec
+        self.limiter = RateLimiter(rate_per_min)
+        self.queue: asyncio.Queue = asyncio.Queue(NOTIFY_QUEUE)
+        self.current: List[dict] = []  # taken off the queue, not yet delivered
+        self.stats = {"queued": 0, "sent": 0, "deliveries": 0, "retries": 0, "dead": 0, "dropped": 0}
+
+
+class NotificationDispatcher:
+    """Delivers notify() calls off the task path.
+
+    Each channel has its own queue and delivery task: notifications are
+    batched into one digest (up to the channel's batch size, or its batch
+    window after the first), deliveries are rate limited, and failures are
+    retried with exponential backoff before the batch goes to the dead-letter
+    file. A slow or failing channel holds up only itself. Binds to the running
+    event loop on first use; start fresh on a new loop.
+    """
+
+    def __init__(self, channels: str = NOTIFY_CHANNELS):
+        self.names = [c.strip() for c in channels.split(",") if c.strip()]
+        unknown = [c for c in self.names if c not in _SENDERS]
+        if unknown:
+            raise ValueError(f"Unknown notification channel(s): {', '.join(unknown)}")
+        self._batch_max = _per_channel(NOTIFY_BATCH_MAX)
+        self._batch_sec = _per_channel(NOTIFY_BATCH_SEC)
+        self._rate = _per_channel(NOTIFY_RATE_PER_MIN)
+        self._loop = None
+        self._channels: Dict[str, _Channel] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._channels = {name: _Channel(name, int(self._batch_max.get(name, 1)), self._batch_sec.get(name, 0),
+                                         self._rate.get(name, 0)) for name in self.names}
+        self._tasks = [loop.create_task(self._run(ch)) for ch in self._channels.values()]
+
+    def start(self):
+        self._ensure_loop()
+
+    def notify(self, subject: str, body: str, method: Optional[str] = None, recipient: Optional[str] = None):
+        """Queue a notification for every configured channel (or just `method`). Never blocks."""
+        try:
+            self._ensure_loop()
+        except RuntimeError:  # no running loop (a script): deliver to the console right away
+            print(f"[NOTIFICATION]\nSubject: {subject}\nMessage: {body}\n")
+            return
+        item = {"subject": subject, "body": body, "recipient": recipient, "at": datetime.now().isoformat()}
+        for ch in self._channels.values():
+            if method and ch.name != method:
+                continue
+            try:
+                ch.queue.put_nowait(item)
+                ch.stats["queued"] += 1
+            except asyncio.QueueFull:
+                ch.stats["dropped"] += 1
+                NOTIFICATIONS.inc(channel=ch.name, outcome="dropped")
+                logging.warning(f"Notification queue for {ch.name} is full; dropped: {subject}")
+
+    async def _next_batch(self, ch: _Channel) -> List[dict]:
+        batch = [await ch.queue.get()]
+        deadline = self._loop.time() + ch.batch_sec
+        while len(batch) < ch.batch_max:
+            try:
+                batch.append(ch.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(ch.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self, ch: _Channel):
+        while True:
+            ch.current = await self._next_batch(ch)
+            await ch.limiter.acquire()
+            await self._deliver(ch, ch.current)
+            ch.current = []
+
+    async def _deliver(self, ch: _Channel, batch: List[dict]):
+        for attempt in range(NOTIFY_RETRIES + 1):
+            try:
+                await ch.send(batch)
+                ch.stats["sent"] += len(batch)
+                ch.stats["deliveries"] += 1
+                NOTIFICATIONS.inc(len(batch), channel=ch.name, outcome="sent")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == NOTIFY_RETRIES:
+                    await asyncio.to_thread(self._dead_letter, ch, batch, e)
+                    return
+                ch.stats["retries"] += 1
+                delay = NOTIFY_BACKOFF_SEC * (2 ** attempt) * (0.5 + random.random())
+                logging.warning(f"Notification via {ch.name} failed ({e}); retry {attempt + 1}/{NOTIFY_RETRIES} "
+                                f"in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _dead_letter(self, ch: _Channel, batch: List[dict], err: Exception):
+        ch.stats["dead"] += len(batch)
+        NOTIFICATIONS.inc(len(batch), channel=ch.name, outcome="dead")
+        logging.error(f"Notification via {ch.name} failed {NOTIFY_RETRIES + 1} times; "
+                      f"{len(batch)} written to {NOTIFY_DEAD_LETTER}: {err}")
+        with open(NOTIFY_DEAD_LETTER, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"channel": ch.name, "error": str(err), "failed_at": datetime.now().isoformat(),
+                                "notifications": batch}) + "\n")
+
+    async def aclose(self, timeout: float = 10.0):
+        """Stop the delivery tasks, first sending what is queued (one attempt each,
+        no batch window or rate limit); what cannot go out in time is dead-lettered.
+        """
+        if self._loop is not asyncio.get_running_loop():
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        async def flush(ch: _Channel):
+            pending, ch.current = ch.current, []
+            while not ch.queue.empty():
+                pending.append(ch.queue.get_nowait())
+            for i in range(0, len(pending), ch.batch_max):
+                batch = pending[i:i + ch.batch_max]
+                try:
+                    await asyncio.wait_for(ch.send(batch), timeout)
+                    ch.stats["sent"] += len(batch)
+                    ch.stats["deliveries"] += 1
+                    NOTIFICATIONS.inc(len(batch), channel=ch.name, outcome="sent")
+                except Exception as e:
+                    self._dead_letter(ch, batch, e)
+        await asyncio.gather(*(flush(ch) for ch in self._channels.values()))
+        self._loop = None
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {name: {**ch.stats, "pending": ch.queue.qsize() + len(ch.current)} for name, ch in self._channels.items()}
+
+
+dispatcher = NotificationDispatcher()
+
+
+def notify(subject, body, method=None, recipient=None):
+    """Queue a notification; delivery (and any retries) happens in the background."""
+    dispatcher.notify(subject, body, method, recipient)
+
+
+def notifier_stats() -> dict:
+    return dispatcher.stats()
@@ -0,0 +1,391 @@
+import os, re, sys, json, zlib, time, struct, asyncio, logging, sqlite3, threading
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from config import RESULTS_FOLDER
+
+# Task results: zlib-compressed records appended to segment files, indexed
+# (task id, time, full text) in SQLite. Each process appends to its own
+# segments, so writers never share a file; readers go through the index.
+# ------- Config ----------
+RESULT_DB = os.getenv("RESULT_DB", os.path.join(RESULTS_FOLDER, "results.db"))
+RESULT_SEGMENT_DIR = os.getenv("RESULT_SEGMENT_DIR", os.path.join(RESULTS_FOLDER, "segments"))
+RESULT_SEGMENT_BYTES = int(os.getenv("RESULT_SEGMENT_BYTES", str(64 << 20)))  # roll to a new segment past this
+RESULT_COMPRESS_LEVEL = int(os.getenv("RESULT_COMPRESS_LEVEL", "6"))
+# group commit: results that arrive while a commit is in progress share the next fsync and transaction;
+# RESULT_COMMIT_MS > 0 also holds each commit open that long for more to join (worth it on slow disks)
+RESULT_COMMIT_MS = float(os.getenv("RESULT_COMMIT_MS", "0"))
+RESULT_COMMIT_MAX = int(os.getenv("RESULT_COMMIT_MAX", "256"))
+RESULT_FSYNC = os.getenv("RESULT_FSYNC", "1") == "1"
+
+_FRAME = struct.Struct("<II")  # compressed length, crc32 of the compressed bytes
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id          INTEGER PRIMARY KEY,
+    task_id     INTEGER NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    created_at  TEXT NOT NULL,
+    segment     TEXT NOT NULL,
+    offset      INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    size        INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_task ON results(task_id, id);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results(created_at, id);
+"""
+# contentless: the text lives (compressed) in the segments, the FTS table only holds the index
+_FTS_SCHEMA = ("CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5("
+               "description, text, content='', tokenize='porter unicode61')")
+_LIST_COLUMNS = "id, task_id, description, created_at, size"
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+
+
+def _match_query(q: str) -> str:
+    """Free text -> FTS5 query: every word must appear (prefix match on the last one)."""
+    terms = _TERM_RE.findall(q)
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def snippet(text: str, q: str, width: int = 160) -> str:
+    """About `width` chars of text around the first query term found."""
+    low = text.lower()
+    hits = [i for i in (low.find(t.lower()) for t in _TERM_RE.findall(q)) if i >= 0]
+    start = max(0, min(hits) - width // 3) if hits else 0
+    out = " ".join(text[start:start + width].split())
+    return ("..." if start else "") + out + ("..." if start + width < len(text) else "")
+
+
+class ResultStore:
+    """Append-only result segments plus a SQLite (WAL) index.
+
+    write_batch() appends a batch of records to this process's active segment
+    with one fsync, then indexes them in one transaction. A crash in between
+    leaves unindexed bytes in a segment, never an index row without data (the
+    task is not completed yet, so it reruns). reindex() rebuilds the index
+    from the segments.
+    """
+
+    def __init__(self, db_path: str = RESULT_DB, segment_dir: str = RESULT_SEGMENT_DIR):
+        self.db_path = db_path
+        self.segment_dir = segment_dir
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._segment: Optional[str] = None
+        self._segment_seq = 0
+        self._stats = {"results": 0, "commits": 0, "bytes": 0, "compressed_bytes": 0, "seconds": 0.0}
+        os.makedirs(segment_dir, exist_ok=True)
+        db = self._conn()
+        db.executescript(_SCHEMA)
+        try:
+            db.execute(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            logging.warning("SQLite has no FTS5; result search falls back to matching descriptions")
+            self.fts = False
+
+    # ---------- connections ----------
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            # the segments carry durability; a lost index tail is rebuilt by reindex()
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # ---------- segments ----------
+    def _active_segment(self, incoming: int) -> str:
+        path = self._segment and os.path.join(self.segment_dir, self._segment)
+        if path is None or (os.path.exists(path) and os.path.getsize(path) + incoming > RESULT_SEGMENT_BYTES
+                            and os.path.getsize(path) > 0):
+            self._segment_seq += 1
+            stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+            self._segment = f"seg_{stamp}_{os.getpid()}_{self._segment_seq:04d}.rz"
+        return self._segment
+
+    @staticmethod
+    def _encode(record: dict) -> bytes:
+        payload = zlib.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"), RESULT_COMPRESS_LEVEL)
+        return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def write_batch(self, records: List[dict]) -> List[dict]:
+        """Persist records ({task_id, description, text, ...}); returns their index rows."""
+        if not records:
+            return []
+        t0 = time.perf_counter()
+        stamp = _now_iso()
+        for rec in records:
+            rec.setdefault("created_at", stamp)
+        frames = [self._encode(rec) for rec in records]
+        with self._write_lock:
+            name = self._active_segment(sum(len(f) for f in frames))
+            with open(os.path.join(self.segment_dir, name), "ab") as f:
+                offset = f.tell()
+                f.write(b"".join(frames))
+                f.flush()
+                if RESULT_FSYNC:
+                    os.fsync(f.fileno())
+            rows = []
+            for rec, frame in zip(records, frames):
+                rows.append({"task_id": int(rec["task_id"]), "description": rec.get("description") or "",
+                             "created_at": rec["created_at"], "segment": name, "offset": offset,
+                             "length": len(frame), "size": len(rec.get("text") or "")})
+                offset += len(frame)
+            self._index(rows, records)
+        self._stats["results"] += len(records)
+        self._stats["commits"] += 1
+        self._stats["bytes"] += sum(r["size"] for r in rows)
+        self._stats["compressed_bytes"] += sum(len(f) for f in frames)
+        self._stats["seconds"] += time.perf_counter() - t0
+        return rows
+
+    def _index(self, rows: List[dict], records: List[dict]):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for row, rec in zip(rows, records):
+                cur = db.execute("INSERT INTO results (task_id, description, created_at, segment, offset, length, size) "
+                                 "VALUES (:task_id, :description, :created_at, :segment, :offset, :length, :size)", row)
+                row["id"] = cur.lastrowid
+                if self.fts:
+                    db.execute("INSERT INTO results_fts (rowid, description, text) VALUES (?, ?, ?)",
+                               (row["id"], row["description"], rec.get("text") or ""))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def read(self, row) -> dict:
+        """The full record behind an index row."""
+        with open(os.path.join(self.segment_dir, row["segment"]), "rb") as f:
+            raw = os.pread(f.fileno(), row["length"], row["offset"])
+        length, crc = _FRAME.unpack_from(raw)
+        payload = raw[_FRAME.size:_FRAME.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise ValueError(f"Corrupt result record in {row['segment']} at {row['offset']}")
+        return json.loads(zlib.decompress(payload))
+
+    @staticmethod
+    def iter_segment(path: str) -> Iterator[Tuple[int, int, dict]]:
+        """(offset, length, record) for every intact frame; stops at a torn tail."""
+        with open(path, "rb") as f:
+            offset = 0
+            while True:
+                head = f.read(_FRAME.size)
+                if len(head) < _FRAME.size:
+                    return
+                length, crc = _FRAME.unpack(head)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                yield offset, _FRAME.size + length, json.loads(zlib.decompress(payload))
+                offset += _FRAME.size + length
+
+    # ---------- queries ----------
+    def list(self, limit: int = 50, before: Optional[int] = None, task_id: Optional[int] = None,
+             since: Optional[str] = None, until: Optional[str] = None) -> dict:
+        """Newest first, keyset-paged: pass the returned next_cursor as `before`."""
+        where, args = [], []
+        if before is not None:
+            where.append("id < ?"); args.append(before)
+        if task_id is not None:
+            where.append("task_id = ?"); args.append(task_id)
+        if since:
+            where.append("created_at >= ?"); args.append(since)
+        if until:
+            where.append("created_at < ?"); args.append(until)
+        sql = f"SELECT {_LIST_COLUMNS} FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._conn().execute(sql + " ORDER BY id DESC LIMIT ?", (*args, limit + 1)).fetchall()
+        items = [dict(r) for r in rows[:limit]]
+        return {"items": items, "next_cursor": items[-1]["id"] if len(rows) > limit else None}
+
+    def get(self, task_id: int, result_id: Optional[int] = None) -> Optional[dict]:
+        """A task's latest result (or a specific one), with its text."""
+        if result_id is None:
+            row = self._conn().execute("SELECT * FROM results WHERE task_id = ? ORDER BY id DESC LIMIT 1",
+                                       (task_id,)).fetchone()
+        else:
+            row = self._conn().execute("SELECT * FROM results WHERE id = ? AND task_id = ?",
+                                       (result_id, task_id)).fetchone()
+        if row is None:
+            return None
+        rec = self.read(row)
+        return {**rec, **{k: row[k] for k in ("id", "task_id", "created_at", "size")}}
+
+    def search(self, q: str, limit: int = 20, offset: int = 0) -> dict:
+        """Best matches first (bm25), with a snippet each; page with offset."""
+        db = self._conn()
+        if self.fts:
+            match = _match_query(q)
+            if not match:
+                return {"items": [], "next_offset": None}
+            rows = db.execute("SELECT r.* FROM results_fts JOIN results r ON r.id = results_fts.rowid "
+                              "WHERE results_fts MATCH ? ORDER BY results_fts.rank LIMIT ? OFFSET ?",
+                              (match, limit + 1, offset)).fetchall()
+        else:
+            like = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")  # match them literally
+            rows = db.execute("SELECT * FROM results WHERE description LIKE ? ESCAPE '\\' "
+                              "ORDER BY id DESC LIMIT ? OFFSET ?",
+                              (f"%{like}%", limit + 1, offset)).fetchall()
+        items = []
+        for row in rows[:limit]:
+            text = self.read(row).get("text") or ""
+            items.append({**{k: row[k] for k in ("id", "task_id", "description", "created_at", "size")},
+                          "snippet": snippet(text, q)})
+        return {"items": items, "next_offset": offset + limit if len(rows) > limit else None}
+
+    def export(self, task_id: Optional[int] = None, since: Optional[str] = None,
+               until: Optional[str] = None, batch: int = 500) -> Iterator[dict]:
+        """Every matching result with its text, oldest first, read a batch of index rows at a time."""
+        after = 0
+        while True:
+            where, args = ["id > ?"], [after]
+            if task_id is not None:
+                where.append("task_id = ?"); args.append(task_id)
+            if since:
+                where.append("created_at >= ?"); args.append(since)
+            if until:
+                where.append("created_at < ?"); args.append(until)
+            rows = self._conn().execute(f"SELECT * FROM results WHERE {' AND '.join(where)} ORDER BY id LIMIT ?",
+                                        (*args, batch)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield {"id": row["id"], **self.read(row)}
+            after = rows[-1]["id"]
+
+    def stats(self) -> dict:
+        db = self._conn()
+        count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        segments = [n for n in os.listdir(self.segment_dir) if n.endswith(".rz")]
+        on_disk = sum(os.path.getsize(os.path.join(self.segment_dir, n)) for n in segments)
+        written = dict(self._stats)
+        written["seconds"] = round(written["seconds"], 3)
+        written["results_per_commit"] = round(written["results"] / written["commits"], 2) if written["commits"] else 0.0
+        return {"results": count, "text_bytes": size, "segment_bytes": on_disk, "segments": len(segments),
+                "fts": self.fts, "written": written}
+
+    # ---------- maintenance ----------
+    def reindex(self) -> int:
+        """Rebuild the index from the segment files (e.g. after losing results.db)."""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM results")
+        if self.fts:
+            db.execute("DROP TABLE results_fts")
+            db.execute(_FTS_SCHEMA)
+        db.execute("COMMIT")
+        n = 0
+        for name in sorted(n for n in os.listdir(self.segment_dir) if n.endswith(".rz")):
+            rows, records = [], []
+            for offset, length, rec in self.iter_segment(os.path.join(self.segment_dir, name)):
+                rows.append({"task_id": int(rec["task_id"]), "description": rec.get("description") or "",
+                             "created_at": rec.get("created_at") or _now_iso(), "segment": name,
+                             "offset": offset, "length": length, "size": len(rec.get("text") or "")})
+                records.append(rec)
+            self._index(rows, records)
+            n += len(rows)
+        return n
+
+    def import_files(self, folder: str = RESULTS_FOLDER) -> int:
+        """Load loose task_XXXXXX_<stamp>.txt results (the old layout) and remove them."""
+        pattern = re.compile(r"task_(\d+)_(\d{14})\.txt$")
+        names = sorted(n for n in os.listdir(folder) if pattern.match(n))
+        for i in range(0, len(names), RESULT_COMMIT_MAX):
+            records, paths = [], []
+            for name in names[i:i + RESULT_COMMIT_MAX]:
+                task_id, stamp = pattern.match(name).groups()
+                path = os.path.join(folder, name)
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+                created = datetime.strptime(stamp, "%Y%m%d%H%M%S").isoformat(timespec="microseconds") + "Z"
+                records.append({"task_id": int(task_id), "description": "", "text": text, "created_at": created})
+                paths.append(path)
+            self.write_batch(records)
+            for path in paths:
+                os.remove(path)
+        return len(names)
+
+
+class GroupCommitter:
+    """Async front end: put() waits until its record is durable, but puts
+    that arrive while a commit is in progress (or within RESULT_COMMIT_MS)
+    share the next segment fsync and index transaction. Binds to the running
+    event loop on first use.
+    """
+
+    def __init__(self, store: ResultStore):
+        self.store = store
+        self._loop = None
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def put(self, record: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._pending, self._flusher = loop, [], None
+        fut = loop.create_future()
+        self._pending.append((record, fut))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush())
+        return await asyncio.shield(fut)  # a cancelled caller does not cancel the shared commit
+
+    async def _flush(self):
+        while self._pending:
+            if RESULT_COMMIT_MS and len(self._pending) < RESULT_COMMIT_MAX:
+                await asyncio.sleep(RESULT_COMMIT_MS / 1000)
+            batch, self._pending = self._pending[:RESULT_COMMIT_MAX], self._pending[RESULT_COMMIT_MAX:]
+            try:
+                rows = await asyncio.to_thread(self.store.write_batch, [rec for rec, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for row, (_, fut) in zip(rows, batch):
+                if not fut.done():
+                    fut.set_result(row)
+
+
+_store: Optional[ResultStore] = None
+_committer: Optional[GroupCommitter] = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
+
+
+async def save_result(task_id: int, description: str, text: str, **extra) -> dict:
+    """Durably store a task's result (group-committed); returns its index row."""
+    global _committer
+    if _committer is None:
+        _committer = GroupCommitter(get_result_store())
+    return await _committer.put({"task_id": task_id, "description": description, "text": text, **extra})
+
+
+if __name__ == "__main__":
+    # python result_store.py import   (load loose results/*.txt)  |  python result_store.py reindex
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "import"
+    store = get_result_store()
+    if cmd == "reindex":
+        print(f"indexed {store.reindex()} result(s) from {store.segment_dir}")
+    else:
+        print(f"imported {store.import_files()} result file(s) into {store.segment_dir}")
@@ -0,0 +1,166 @@
+import os, re, time, asyncio, logging
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from memory import retention_view, memory_records, evict_rows, prune_graph, add_many_to_memory
+from metrics import Counter
+
+# ------- Config ----------
+MEMORY_MAX_DOCS = int(os.getenv("MEMORY_MAX_DOCS", "0"))     # 0 = unbounded
+MEMORY_MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", "0"))   # document text on disk; 0 = unbounded
+# max age per source, e.g. "task=30d,upload=0,summary=180d" (0 or unlisted = forever). The source is
+# metadata["source"], else "task" (task results), "upload" (file chunks) or "other"
+MEMORY_TTL = os.getenv("MEMORY_TTL", "")
+# past a cap, evict down to this fraction of it, so eviction compactions don't run back to back
+MEMORY_LOW_WATER = float(os.getenv("MEMORY_LOW_WATER", "0.9"))
+# merge evicted task results into summary documents: "0", "extract" (leading sentences) or "llm"
+MEMORY_SUMMARIZE = os.getenv("MEMORY_SUMMARIZE", "0")
+MEMORY_SUMMARY_GROUP = int(os.getenv("MEMORY_SUMMARY_GROUP", "20"))  # task results per summary
+GRAPH_MAX_NODES = int(os.getenv("GRAPH_MAX_NODES", "0"))           # 0 = unbounded
+MEMORY_RETENTION_SEC = float(os.getenv("MEMORY_RETENTION_SEC", "300"))  # lab_loop runs a pass this often
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def parse_ttl(spec: str) -> Dict[str, float]:
+    """"task=30d,upload=12h" -> {"task": 2592000.0, "upload": 43200.0}; 0 entries are dropped."""
+    out = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        source, _, value = item.partition("=")
+        value = value.strip().lower()
+        seconds = float(value[:-1]) * _UNITS[value[-1]] if value[-1:] in _UNITS else float(value or 0)
+        if seconds > 0:
+            out[source.strip()] = seconds
+    return out
+
+
+_TTL = parse_ttl(MEMORY_TTL)
+
+EVICTED = Counter("lab_memory_evicted_total", "Memory documents evicted, by reason.", ("reason",))
+GRAPH_PRUNED = Counter("lab_graph_pruned_total", "Knowledge-graph nodes deleted by the node cap.")
+_stats = {"runs": 0, "evicted_ttl": 0, "evicted_lru": 0, "evicted_bytes": 0, "summarized": 0, "summaries": 0,
+          "graph_pruned": 0, "skipped": 0, "seconds": 0.0, "last_run": None}
+
+
+def plan(view: dict, now: float) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Rows to evict: past their source's TTL, then least recently used
+    (added or last retrieved; fewer hits first on ties) until the rest is under
+    MEMORY_LOW_WATER of both caps. Returns (rows, {"ttl": n, "lru": n}).
+    """
+    n = view["count"]
+    drop = np.zeros(n, dtype=bool)
+    for source_id, name in enumerate(view["sources"]):
+        ttl = _TTL.get(name)
+        if ttl:
+            drop |= (view["source"] == source_id) & (now - view["added"] > ttl)
+    expired = int(drop.sum())
+
+    sizes = view["sizes"]
+    live_docs, live_bytes = n - expired, int(sizes[~drop].sum())
+    over_docs = MEMORY_MAX_DOCS and live_docs > MEMORY_MAX_DOCS
+    over_bytes = MEMORY_MAX_BYTES and live_bytes > MEMORY_MAX_BYTES
+    lru = 0
+    if over_docs or over_bytes:
+        last_used = np.maximum(view["added"], view["last_hit"])
+        order = np.lexsort((view["hits"], last_used))
+        order = order[~drop[order]]
+        k = 0
+        if MEMORY_MAX_DOCS:
+            k = max(k, live_docs - int(MEMORY_MAX_DOCS * MEMORY_LOW_WATER))
+        if MEMORY_MAX_BYTES:
+            excess = live_bytes - int(MEMORY_MAX_BYTES * MEMORY_LOW_WATER)
+            if excess > 0:
+                k = max(k, int(np.searchsorted(np.cumsum(sizes[order]), excess)) + 1)
+        lru = min(k, len(order))
+        drop[order[:lru]] = True
+    return np.flatnonzero(drop), {"ttl": expired, "lru": lru}
+
+
+def _lead(text: str, limit: int = 300) -> str:
+    """Leading sentences of a text, up to about `limit` chars."""
+    out = ""
+    for sentence in _SENTENCE_RE.split(" ".join(text.split())):
+        if out and len(out) + len(sentence) > limit:
+            break
+        out = f"{out} {sentence}".strip()
+    return out[:limit]
+
+
+async def _summaries(records: List[dict]) -> Tuple[List[str], List[dict]]:
+    """Summary documents for evicted task results, MEMORY_SUMMARY_GROUP per document."""
+    texts, metas = [], []
+    for i in range(0, len(records), MEMORY_SUMMARY_GROUP):
+        group = records[i:i + MEMORY_SUMMARY_GROUP]
+        ids = [(r.get("metadata") or {}).get("task_id") for r in group]
+        body = None
+        if MEMORY_SUMMARIZE == "llm":
+            from agent import summarize  # only when configured: pulls in the model client
+            try:
+                body = await summarize([r["text"] for r in group])
+            except Exception:
+                logging.exception("Memory summary failed; falling back to extracts")
+        if not body:
+            body = "\n".join(f"- task {tid}: {_lead(r['text'])}" for tid, r in zip(ids, group))
+        texts.append(f"Summary of {len(group)} earlier task results:\n{body}")
+        metas.append({"source": "summary", "task_ids": ids, "created_at": datetime.now().isoformat()})
+    return texts, metas
+
+
+async def run_retention() -> dict:
+    """One retention pass: evict by TTL and caps (summarizing evicted task
+    results first, if enabled), then prune the graph to GRAPH_MAX_NODES.
+    Eviction compacts the store into a new generation. Returns this pass's counts.
+    """
+    t0 = time.perf_counter()
+    run = {"evicted_ttl": 0, "evicted_lru": 0, "evicted_bytes": 0, "summarized": 0, "summaries": 0,
+           "graph_pruned": 0, "skipped": 0}
+    view = await asyncio.to_thread(retention_view)
+    rows, reasons = plan(view, time.time())
+    if len(rows):
+        if MEMORY_SUMMARIZE != "0" and "task" in view["sources"]:
+            tasks = rows[view["source"][rows] == view["sources"].index("task")]
+            records = await asyncio.to_thread(memory_records, view["gen"], tasks) if len(tasks) else []
+            if records:
+                texts, metas = await _summaries(records)
+                # added before evicting: a crash in between leaves duplicates, never a gap
+                await asyncio.to_thread(add_many_to_memory, texts, metas)
+                run["summarized"], run["summaries"] = len(records), len(texts)
+        evicted = await asyncio.to_thread(evict_rows, view["gen"], rows)
+        if evicted is None:
+            run["skipped"] = 1  # another process compacted first; the next pass re-plans
+        else:
+            run["evicted_ttl"], run["evicted_lru"] = reasons["ttl"], reasons["lru"]
+            run["evicted_bytes"] = int(view["sizes"][rows].sum())
+            EVICTED.inc(reasons["ttl"], reason="ttl")
+            EVICTED.inc(reasons["lru"], reason="lru")
+    if GRAPH_MAX_NODES:
+        run["graph_pruned"] = await asyncio.to_thread(prune_graph, GRAPH_MAX_NODES, MEMORY_LOW_WATER)
+        GRAPH_PRUNED.inc(run["graph_pruned"])
+
+    elapsed = time.perf_counter() - t0
+    run["seconds"] = round(elapsed, 3)
+    for k in ("evicted_ttl", "evicted_lru", "evicted_bytes", "summarized", "summaries", "graph_pruned", "skipped"):
+        _stats[k] += run[k]
+    _stats["runs"] += 1
+    _stats["seconds"] += elapsed
+    _stats["last_run"] = run
+    if run["evicted_ttl"] or run["evicted_lru"] or run["graph_pruned"]:
+        logging.info(f"Retention: evicted {run['evicted_ttl']} expired + {run['evicted_lru']} LRU docs "
+                     f"({run['evicted_bytes']} bytes), {run['summaries']} summaries, "
+                     f"pruned {run['graph_pruned']} graph nodes in {run['seconds']}s")
+    return run
+
+
+def retention_enabled() -> bool:
+    return bool(MEMORY_MAX_DOCS or MEMORY_MAX_BYTES or _TTL or GRAPH_MAX_NODES)
+
+
+def retention_stats() -> dict:
+    total = dict(_stats)
+    total["seconds"] = round(total["seconds"], 3)
+    total["policy"] = {"max_docs": MEMORY_MAX_DOCS, "max_bytes": MEMORY_MAX_BYTES, "ttl_sec": _TTL,
+                       "low_water": MEMORY_LOW_WATER, "summarize": MEMORY_SUMMARIZE, "graph_max_nodes": GRAPH_MAX_NODES}
+    return total
@@ -0,0 +1,43 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+# ------- Config ----------
+DEFAULT_PRIORITY = 1                                             # higher runs sooner
+TASK_AGING_SEC = float(os.getenv("TASK_AGING_SEC", "300"))       # waiting this long = +1 priority
+DEADLINE_LEAD_SEC = float(os.getenv("DEADLINE_LEAD_SEC", "600")) # aim to start this long before a deadline
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SEC = float(os.getenv("RETRY_BASE_SEC", "30"))
+RETRY_MAX_SEC = float(os.getenv("RETRY_MAX_SEC", "3600"))
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _ts(dt: datetime) -> float:
+    return (dt - _EPOCH).total_seconds()
+
+
+def task_rank(priority: Optional[int], created_at: datetime, deadline: Optional[datetime] = None) -> float:
+    """Scheduling key; the lowest rank is claimed first.
+
+    Aging is linear: after waiting w seconds a task's effective priority is
+    priority + w / TASK_AGING_SEC. Every task ages at the same rate, so
+    comparing effective priorities at any instant gives the same order as
+    comparing created - priority * TASK_AGING_SEC. The key is therefore fixed
+    at insert time and can live in an index. Later arrivals get later keys,
+    so a low-priority task cannot starve. A deadline pulls the key forward
+    to "start by deadline - DEADLINE_LEAD_SEC".
+    """
+    p = DEFAULT_PRIORITY if priority is None else priority
+    rank = _ts(created_at) - p * TASK_AGING_SEC
+    if deadline is not None:
+        rank = min(rank, _ts(deadline) - DEADLINE_LEAD_SEC)
+    return rank
+
+
+def retry_at(attempts: int, now: datetime) -> Optional[datetime]:
+    """When a task that has failed `attempts` times may run again; None = give up."""
+    if attempts >= TASK_MAX_ATTEMPTS:
+        return None
+    delay = min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** (attempts - 1)))
+    return now + timedelta(seconds=delay)
@@ -1,25 +1,36 @@
-import os, requests
-from dotenv import load_dotenv
+import os, httpx
 
-load_dotenv()  # load SERPER_API_KEY, WEB_TOPK, WEB_MAX_SNIPPET from .env
+import env  # SERPER_API_KEY, WEB_TOPK, WEB_MAX_SNIPPET from .env
+from http_client import http, host_of
+from cache import get_cache, content_key
 
 SERPER_KEY = os.getenv("SERPER_API_KEY")
 TOPK = int(os.getenv("WEB_TOPK", "3"))
 SNIP = int(os.getenv("WEB_MAX_SNIPPET", "400"))
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
+http.set_host_limit(host_of(SERPER_URL), int(os.getenv("SERPER_CONCURRENCY", "4")))
 
-def web_brief(query: str) -> str:
-    """Return a compact markdown WebBrief. Empty string if no key/query."""
+async def web_brief(query: str) -> str:
+    """Return a compact markdown WebBrief. Empty string if no key/query.
+    Briefs are cached per normalised query for WEB_CACHE_TTL_SEC.
+    """
     if not SERPER_KEY or not query:
         return ""
-    r = requests.post(
-        "https://google.serper.dev/search",
+    key = content_key(" ".join(query.lower().split()), TOPK, SNIP)
+    cached = await get_cache("web").aget(key)
+    if cached is not None:
+        return cached
+    data = await http.post_json(
+        SERPER_URL,
+        {"q": query, "num": TOPK},
         headers={"X-API-KEY": SERPER_KEY, "Content-Type": "application/json"},
-        json={"q": query, "num": TOPK},
-        timeout=12,
+        timeout=httpx.Timeout(12),
     )
-    r.raise_for_status()
-    rows = (r.json().get("organic") or [])[:TOPK]
-    return "\n".join(
+    rows = (data.get("organic") or [])[:TOPK]
+    brief = "\n".join(
         f"- **{(x.get('title') or x.get('link'))}** • {x.get('link')}\n  {(x.get('snippet') or '')[:SNIP]}"
         for x in rows
     )
+    if brief:
+        await get_cache("web").aset(key, brief)
+    return brief
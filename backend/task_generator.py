@@ -1,41 +1,124 @@
-import json, os
-from config import TASK_FILE
-import fcntl
-
-def _atomic_write_json(path: str, data: list):
-    tmp = f"{path}.tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-        f.flush(); os.fsync(f.fileno())
-    os.replace(tmp, path)
-
-def generate_new_tasks():
-    """Safely add ONE new auto task if and only if there are no pending tasks.
-    Uses a file lock to avoid duplicate IDs across processes.
+import os, re, math, time, logging
+from collections import OrderedDict
+from typing import List
+
+from task_store import get_task_store
+from memory import graph_gaps, add_node, add_relationship
+from metrics import Counter
+
+# ------- Config ----------
+# fill the queue to what the workers get through in this many seconds (at the recent completion rate)
+GEN_HORIZON_SEC = float(os.getenv("GEN_HORIZON_SEC", "60"))
+GEN_RATE_WINDOW_SEC = float(os.getenv("GEN_RATE_WINDOW_SEC", "300"))  # completions counted for the rate
+GEN_MAX_QUEUE = int(os.getenv("GEN_MAX_QUEUE", "50"))     # never fill past this many ready tasks
+GEN_BATCH_MAX = int(os.getenv("GEN_BATCH_MAX", "10"))     # tasks added per pass
+GEN_PRIORITY = int(os.getenv("GEN_PRIORITY", "0"))        # behind real tasks (default priority 1)
+GEN_RECENT = int(os.getenv("GEN_RECENT", "200"))          # recent tasks a new one is compared with
+GEN_DEDUP_JACCARD = float(os.getenv("GEN_DEDUP_JACCARD", "0.7"))  # word overlap that counts as a repeat
+GEN_DUP_RETRY_SEC = float(os.getenv("GEN_DUP_RETRY_SEC", "900"))  # a gap skipped as a repeat is rechecked after this
+
+# relation from a generated task to the graph node it came from; nodes with one are not gaps any more
+_FOLLOWS = {"document": "explores", "task": "follows_up"}
+_TEMPLATES = {
+    "document": "Summarize the key points of the uploaded document '{label}' and relate them to earlier findings.",
+    "task": "Follow up on '{label}': what is still open, and what should be checked next?",
+}
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# generated tasks are compared with earlier ones from the same template, on their subject words only
+_PREFIXES = {kind: t.split("{label}")[0] for kind, t in _TEMPLATES.items()}
+_TEMPLATE_WORDS = set(_WORD_RE.findall(" ".join(_TEMPLATES.values()).lower())) - {"label"}
+
+GENERATED = Counter("lab_generated_tasks_total", "Tasks added by the generator, by source.", ("source",))
+_stats = {"passes": 0, "added": 0, "skipped_duplicates": 0, "last": None}
+# gaps skipped as near-duplicates -> when; oldest first, at most GEN_RECENT of them. They expire so a
+# node is rechecked once the task it repeated has aged out of the recent ones it is compared with.
+_duplicate_nodes = OrderedDict()
+
+
+def _words(text: str) -> set:
+    return set(_WORD_RE.findall(text.lower())) - _TEMPLATE_WORDS
+
+
+def _near_duplicate(words: set, seen: List[set]) -> bool:
+    for other in seen:
+        union = len(words | other)
+        if union and len(words & other) / union >= GEN_DEDUP_JACCARD:
+            return True
+    return False
+
+
+def _expire_duplicates(now: float):
+    while _duplicate_nodes and (len(_duplicate_nodes) > GEN_RECENT
+                                or now - next(iter(_duplicate_nodes.values())) > GEN_DUP_RETRY_SEC):
+        _duplicate_nodes.popitem(last=False)
+
+
+def target_depth(workers: int, rate: float, horizon_sec: float) -> int:
+    """Ready tasks to keep queued: enough for `horizon_sec` at `rate` tasks/s, at least one per worker."""
+    return min(GEN_MAX_QUEUE, max(workers, math.ceil(rate * horizon_sec)))
+
+
+def generate_new_tasks(workers: int = 1, horizon_sec: float = GEN_HORIZON_SEC) -> List[dict]:
+    """Top up the queue from knowledge-graph gaps when the workers would otherwise run dry.
+
+    Only reads (queue depth, recent completions) unless the ready queue is
+    below target. Candidates are graph nodes nothing has followed up yet;
+    ones too similar to a recently generated task are skipped. Added tasks are linked to
+    their node so it stops being a gap; with no gaps nothing is added (no
+    placeholder tasks). The pending cap is rechecked under the store's write
+    lock. Returns the tasks that were added.
     """
-    with open(TASK_FILE, "r+", encoding="utf-8") as f:
-        fcntl.flock(f, fcntl.LOCK_EX)
-        try:
-            tasks = json.load(f)
-            if not isinstance(tasks, list):
-                tasks = []
-        except Exception:
-            tasks = []
-
-        # only add if queue is empty (pending)
-        if any(t.get("status") == "pending" for t in tasks):
-            fcntl.flock(f, fcntl.LOCK_UN)
-            return
-
-        new_id = max([t.get("id", 0) for t in tasks], default=0) + 1
-        tasks.append({
-            "id": new_id,
-            "description": f"Auto task {new_id}",
-            "status": "pending",
-            "priority": 1
-        })
-
-        f.seek(0); f.truncate()
-        json.dump(tasks, f, indent=2)
-        f.flush(); os.fsync(f.fileno())
-        fcntl.flock(f, fcntl.LOCK_UN)
+    store = get_task_store()
+    ready = store.ready_count()
+    rate = store.completed_since(GEN_RATE_WINDOW_SEC) / GEN_RATE_WINDOW_SEC
+    target = target_depth(workers, rate, horizon_sec)
+    decision = {"ready": ready, "rate_per_sec": round(rate, 3), "target": target, "added": 0, "duplicates": 0}
+    _stats["passes"] += 1
+    _stats["last"] = decision
+    if ready >= target:
+        return []
+
+    want = min(GEN_BATCH_MAX, target - ready)
+    seen = {kind: [] for kind in _TEMPLATES}
+    for description in store.recent_descriptions(GEN_RECENT):
+        for kind, prefix in _PREFIXES.items():
+            if description.startswith(prefix):
+                seen[kind].append(_words(description))
+    picks = []
+    now = time.monotonic()
+    _expire_duplicates(now)
+    for gap in graph_gaps(want * 4 + len(_duplicate_nodes), _FOLLOWS.values()):
+        if gap["id"] in _duplicate_nodes:
+            continue
+        description = _TEMPLATES[gap["kind"]].format(label=gap["label"])
+        words = _words(description)
+        if _near_duplicate(words, seen[gap["kind"]]):
+            _duplicate_nodes[gap["id"]] = now
+            decision["duplicates"] += 1
+            continue
+        seen[gap["kind"]].append(words)
+        picks.append({"description": description, "priority": GEN_PRIORITY, "origin": "generator",
+                      "source": gap["kind"], "node": gap["id"]})
+        if len(picks) == want:
+            break
+    _stats["skipped_duplicates"] += decision["duplicates"]
+    _expire_duplicates(now)
+    if not picks:
+        return []
+
+    added = store.add_tasks(picks, max_ready=ready + want)
+    for task in added:
+        add_node(f"task_{task['id']}", node_type="task", label=task["description"])
+        add_relationship(f"task_{task['id']}", task["node"], _FOLLOWS[task["source"]])
+        GENERATED.inc(source=task["source"])
+    decision["added"] = len(added)
+    _stats["added"] += len(added)
+    if added:
+        logging.info(f"Generated {len(added)} task(s): {ready} ready, target {target} "
+                     f"at {rate:.2f} tasks/s, {decision['duplicates']} near-duplicates skipped")
+    return added
+
+
+def generator_stats() -> dict:
+    return {**_stats, "policy": {"horizon_sec": GEN_HORIZON_SEC, "max_queue": GEN_MAX_QUEUE,
+                                 "batch_max": GEN_BATCH_MAX, "priority": GEN_PRIORITY}}
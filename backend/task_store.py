@@ -0,0 +1,443 @@
+import os, sys, json, hashlib, logging, sqlite3, threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from config import TASK_FILE
+from scheduler import DEFAULT_PRIORITY, task_rank, retry_at
+
+# SQLite (WAL) task queue. tasks.json is still honoured: tasks added to it are
+# imported on open and whenever its mtime changes, and export_json() writes
+# the whole queue back out in the old format.
+TASK_DB = os.getenv("TASK_DB", os.path.splitext(TASK_FILE)[0] + ".db")
+TASK_DB_SYNC = os.getenv("TASK_DB_SYNC", "FULL")  # FULL = fsync per commit, like the old JSON writes
+TASK_EVENTS_KEEP = int(os.getenv("TASK_EVENTS_KEEP", "10000"))  # state-change events kept for resume
+
+_COLUMNS = ("id", "description", "status", "priority", "owner", "lease_at",
+            "started_at", "completed_at", "failed_at", "error",
+            "created_at", "deadline", "not_before", "attempts", "fence", "rank")
+_TIME_COLUMNS = ("lease_at", "started_at", "completed_at", "failed_at", "created_at", "deadline", "not_before")
+_INTERNAL = ("rank",)  # scheduling key; not part of the task as callers see it
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id           INTEGER PRIMARY KEY,
+    description  TEXT NOT NULL DEFAULT '',
+    status       TEXT NOT NULL DEFAULT 'pending',
+    priority     INTEGER NOT NULL DEFAULT 1,
+    owner        TEXT,
+    lease_at     TEXT,
+    started_at   TEXT,
+    completed_at TEXT,
+    failed_at    TEXT,
+    error        TEXT,
+    created_at   TEXT,
+    deadline     TEXT,
+    not_before   TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    fence        INTEGER NOT NULL DEFAULT 0,
+    rank         REAL,
+    extra        TEXT
+);
+CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT);
+-- tasks.json entries already imported: content hash (and which identical copy) -> the id they got
+CREATE TABLE IF NOT EXISTS json_imports (entry TEXT PRIMARY KEY, task_id INTEGER NOT NULL);
+-- one row per state change, written in the same transaction as the change
+CREATE TABLE IF NOT EXISTS task_events (
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER NOT NULL,
+    kind    TEXT NOT NULL,
+    at      TEXT NOT NULL
+);
+"""
+# columns added after the first release of the store; ALTERed into older DBs
+_ADDED_COLUMNS = (
+    ("created_at", "TEXT"),
+    ("deadline", "TEXT"),
+    ("not_before", "TEXT"),
+    ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("rank", "REAL"),
+    ("fence", "INTEGER NOT NULL DEFAULT 0"),
+)
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_tasks_status_id ON tasks(status, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_running_lease ON tasks(lease_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_tasks_pending_rank ON tasks(rank) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_tasks_pending_deadline ON tasks(deadline)
+    WHERE status = 'pending' AND deadline IS NOT NULL;
+"""
+_INSERT = (f"INSERT INTO tasks ({', '.join(_COLUMNS)}, extra) "
+           f"VALUES ({', '.join(':' + c for c in _COLUMNS)}, :extra)")
+_READY_COUNT = "SELECT COUNT(*) FROM tasks WHERE status = 'pending' AND (not_before IS NULL OR not_before <= ?)"
+
+
+def _iso(dt: datetime) -> str:
+    # fixed width so ISO strings compare correctly in SQL
+    return dt.isoformat(timespec="microseconds") + "Z"
+
+
+def _now_iso() -> str:
+    return _iso(datetime.utcnow())
+
+
+def _parse_iso(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", ""))
+    except ValueError:
+        return None
+
+
+def _normalize_iso(value) -> Optional[str]:
+    dt = _parse_iso(value)
+    return _iso(dt) if dt else None
+
+
+def _log_events(db: sqlite3.Connection, kind: str, task_ids: Iterable[int], stamp: Optional[str] = None):
+    stamp = stamp or _now_iso()
+    db.executemany("INSERT INTO task_events (task_id, kind, at) VALUES (?, ?, ?)",
+                   [(task_id, kind, stamp) for task_id in task_ids])
+
+
+def _row_to_task(row: sqlite3.Row) -> dict:
+    task = json.loads(row["extra"]) if row["extra"] else {}
+    for col in _COLUMNS:
+        if row[col] is not None and col not in _INTERNAL:
+            task[col] = row[col]
+    return task
+
+
+def _task_to_params(task: dict) -> dict:
+    params = {col: task.get(col) for col in _COLUMNS}
+    params["description"] = params["description"] or ""
+    params["status"] = params["status"] or "pending"
+    params["priority"] = int(params["priority"] if params["priority"] is not None else DEFAULT_PRIORITY)
+    params["attempts"] = int(params["attempts"] or 0)
+    params["fence"] = int(params["fence"] or 0)
+    params["created_at"] = params["created_at"] or _now_iso()
+    for col in _TIME_COLUMNS:
+        params[col] = _normalize_iso(params[col])
+    params["rank"] = task_rank(params["priority"], _parse_iso(params["created_at"]), _parse_iso(params["deadline"]))
+    extra = {k: v for k, v in task.items() if k not in _COLUMNS}
+    params["extra"] = json.dumps(extra) if extra else None
+    return params
+
+
+class TaskStore:
+    """Indexed task queue. Claim/complete/fail touch O(log n) rows via the
+    pending-rank and running-lease indexes instead of rewriting every task.
+    The pending-rank index is the priority queue (see scheduler.task_rank).
+    """
+
+    def __init__(self, path: str = TASK_DB, json_path: Optional[str] = TASK_FILE):
+        self.path = path
+        self.json_path = json_path
+        self._local = threading.local()
+        self._migrate()
+        self.sync_json()
+
+    # ---------- connections ----------
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA synchronous={TASK_DB_SYNC}")
+            self._local.db = db
+        return db
+
+    class _Tx:
+        def __init__(self, db: sqlite3.Connection):
+            self.db = db
+
+        def __enter__(self):
+            self.db.execute("BEGIN IMMEDIATE")  # take the write lock up front
+            return self.db
+
+        def __exit__(self, exc_type, exc, tb):
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def _tx(self) -> "_Tx":
+        return self._Tx(self._conn())
+
+    def _migrate(self):
+        db = self._conn()
+        db.executescript(_SCHEMA)
+        cols = {r["name"] for r in db.execute("PRAGMA table_info(tasks)")}
+        with self._tx():
+            for name, decl in _ADDED_COLUMNS:
+                if name not in cols:
+                    db.execute(f"ALTER TABLE tasks ADD COLUMN {name} {decl}")
+            # give queued tasks from an older DB a scheduling key (oldest first, as before)
+            for row in db.execute("SELECT * FROM tasks WHERE rank IS NULL AND status = 'pending'").fetchall():
+                created = _parse_iso(row["created_at"]) or datetime.utcnow()
+                db.execute("UPDATE tasks SET rank = ? WHERE id = ?", (task_rank(row["priority"], created), row["id"]))
+        db.executescript(_INDEXES)
+
+    # ---------- JSON compatibility ----------
+    def import_json(self, path: str) -> int:
+        """Insert the entries of a tasks.json list that were not imported before.
+
+        Each entry is imported once, recognised by its content. It keeps its
+        id if that is free; an entry without one, or whose id belongs to a
+        different task, gets the next free id (a taken id is logged). An
+        entry whose id holds the same task already (e.g. a file written by
+        export_json) only counts as imported.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if not isinstance(data, list):
+            return 0
+        copies = {}
+        with self._tx() as db:
+            next_id = (db.execute("SELECT MAX(id) FROM tasks").fetchone()[0] or 0) + 1
+            added = []
+            for task in data:
+                if not isinstance(task, dict):
+                    continue
+                digest = hashlib.sha256(json.dumps(task, sort_keys=True).encode("utf-8")).hexdigest()
+                copies[digest] = copies.get(digest, 0) + 1
+                entry = f"{digest}:{copies[digest]}"  # the n-th identical entry is a task of its own
+                if db.execute("SELECT 1 FROM json_imports WHERE entry = ?", (entry,)).fetchone():
+                    continue
+                task_id = task.get("id")
+                if task_id is not None:
+                    row = db.execute("SELECT description FROM tasks WHERE id = ?", (int(task_id),)).fetchone()
+                    if row is not None and row["description"] == (task.get("description") or ""):
+                        db.execute("INSERT INTO json_imports (entry, task_id) VALUES (?, ?)", (entry, int(task_id)))
+                        continue
+                    if row is not None:
+                        logging.warning(f"{path}: task id {task_id} is taken by another task; imported as {next_id}")
+                        task_id = None
+                task = {**task, "id": next_id if task_id is None else int(task_id)}
+                db.execute(_INSERT, _task_to_params(task))
+                db.execute("INSERT INTO json_imports (entry, task_id) VALUES (?, ?)", (entry, task["id"]))
+                next_id = max(next_id, task["id"] + 1)
+                added.append(task["id"])
+            _log_events(db, "added", added)
+        return len(added)
+
+    def sync_json(self) -> int:
+        """Import tasks.json if it changed since the last import (one stat() when it has not)."""
+        if not self.json_path:
+            return 0
+        try:
+            mtime = str(os.stat(self.json_path).st_mtime_ns)
+        except OSError:
+            return 0
+        seen = self._conn().execute("SELECT value FROM store_meta WHERE key = 'json_mtime'").fetchone()
+        if seen and seen[0] == mtime:
+            return 0
+        added = self.import_json(self.json_path)
+        with self._tx() as db:
+            db.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('json_mtime', ?)", (mtime,))
+        return added
+
+    def export_json(self, path: str):
+        tasks = [_row_to_task(r) for r in self._conn().execute("SELECT * FROM tasks ORDER BY id")]
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(tasks, f, indent=2)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    # ---------- queue operations ----------
+    def add_tasks(self, tasks: Iterable, max_ready: Optional[int] = None) -> List[dict]:
+        """Insert new tasks, assigning ids after the current maximum.
+
+        Each item is a dict, or a callable that builds the dict from its
+        assigned id. With max_ready, only enough are added to bring the
+        claimable pending tasks up to it (counted under the same write lock).
+        """
+        out = []
+        with self._tx() as db:
+            if max_ready is not None:
+                room = max_ready - db.execute(_READY_COUNT, (_now_iso(),)).fetchone()[0]
+                if room <= 0:
+                    return out
+                tasks = list(tasks)[:room]
+            next_id = (db.execute("SELECT MAX(id) FROM tasks").fetchone()[0] or 0) + 1
+            for task in tasks:
+                if callable(task):
+                    task = task(next_id)
+                task = {"status": "pending", "priority": DEFAULT_PRIORITY, **task, "id": next_id}
+                db.execute(_INSERT, _task_to_params(task))
+                out.append(task)
+                next_id += 1
+            _log_events(db, "added", [t["id"] for t in out])
+        return out
+
+    def claim(self, owner: str, lease_ttl_sec: float) -> Optional[dict]:
+        """Recover expired leases, fail tasks past their deadline, then lease the
+        lowest-rank pending task that is not backing off to `owner`.
+
+        Each claim bumps the task's `fence`; renew/complete/fail must present
+        it, so a worker whose lease expired and was re-claimed is rejected.
+        """
+        now = datetime.utcnow()
+        stamp = _iso(now)
+        cutoff = _iso(now - timedelta(seconds=lease_ttl_sec))
+        with self._tx() as db:
+            requeued = db.execute(
+                "UPDATE tasks SET status = 'pending', owner = NULL, lease_at = NULL "
+                "WHERE status = 'running' AND (lease_at IS NULL OR lease_at < ?) RETURNING id",
+                (cutoff,),
+            ).fetchall()
+            _log_events(db, "requeued", [r["id"] for r in requeued], stamp)
+            expired = db.execute(
+                "UPDATE tasks SET status = 'failed', error = 'deadline exceeded', failed_at = ? "
+                "WHERE status = 'pending' AND deadline IS NOT NULL AND deadline < ? RETURNING id",
+                (stamp, stamp),
+            ).fetchall()
+            _log_events(db, "expired", [r["id"] for r in expired], stamp)
+            row = db.execute(
+                "SELECT id FROM tasks WHERE status = 'pending' AND (not_before IS NULL OR not_before <= ?) "
+                "ORDER BY rank LIMIT 1",
+                (stamp,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = 'running', started_at = COALESCE(started_at, ?), "
+                "owner = ?, lease_at = ?, fence = fence + 1 WHERE id = ?",
+                (stamp, owner, stamp, row["id"]),
+            )
+            _log_events(db, "claimed", [row["id"]], stamp)
+            return _row_to_task(db.execute("SELECT * FROM tasks WHERE id = ?", (row["id"],)).fetchone())
+
+    def renew(self, task_id: int, owner: str, fence: int) -> bool:
+        """Heartbeat: extend the lease. False means it was lost (expired and re-claimed)."""
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE tasks SET lease_at = ? WHERE id = ? AND owner = ? AND fence = ? AND status = 'running'",
+                (_now_iso(), task_id, owner, fence),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, task_id: int, owner: str, fence: int) -> bool:
+        stamp = _now_iso()
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE tasks SET status = 'completed', completed_at = ?, owner = NULL, lease_at = NULL "
+                "WHERE id = ? AND owner = ? AND fence = ? AND status = 'running'",
+                (stamp, task_id, owner, fence),
+            )
+            if cur.rowcount != 1:
+                return False
+            _log_events(db, "completed", [task_id], stamp)
+            return True
+
+    def fail(self, task_id: int, owner: str, fence: int, error: str) -> bool:
+        """Release the lease and requeue with exponential backoff, or mark the
+        task failed for good once TASK_MAX_ATTEMPTS is reached.
+        """
+        now = datetime.utcnow()
+        with self._tx() as db:
+            row = db.execute("SELECT attempts FROM tasks WHERE id = ? AND owner = ? AND fence = ? AND status = 'running'",
+                             (task_id, owner, fence)).fetchone()
+            if row is None:
+                return False
+            attempts = row["attempts"] + 1
+            again = retry_at(attempts, now)
+            db.execute(
+                "UPDATE tasks SET status = ?, error = ?, failed_at = ?, attempts = ?, not_before = ?, "
+                "owner = NULL, lease_at = NULL WHERE id = ?",
+                ("pending" if again else "failed", error, _iso(now), attempts,
+                 _iso(again) if again else None, task_id),
+            )
+            _log_events(db, "retry" if again else "failed", [task_id], _iso(now))
+            return True
+
+    def pending(self, limit: Optional[int] = None) -> List[dict]:
+        sql = "SELECT * FROM tasks WHERE status = 'pending' ORDER BY rank"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [_row_to_task(r) for r in self._conn().execute(sql)]
+
+    # ---------- change feed ----------
+    def snapshot(self):
+        """(last event seq, pending tasks) read in one transaction, so the
+        events after that seq are exactly the changes since the list.
+        """
+        db = self._conn()
+        db.execute("BEGIN")
+        try:
+            seq = db.execute("SELECT COALESCE(MAX(seq), 0) FROM task_events").fetchone()[0]
+            tasks = [_row_to_task(r) for r in db.execute("SELECT * FROM tasks WHERE status = 'pending' ORDER BY rank")]
+        finally:
+            db.execute("COMMIT")
+        return seq, tasks
+
+    def events_since(self, seq: int, limit: int = 500) -> Optional[List[dict]]:
+        """Events after `seq` with each task's current state, oldest first;
+        None if `seq` is no longer (or not yet) covered by the event table.
+        """
+        db = self._conn()
+        first, last = db.execute("SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM task_events").fetchone()
+        if (first is not None and seq < first - 1) or seq > last:
+            return None  # pruned, or from a queue that has since been wiped
+        rows = db.execute(
+            "SELECT e.seq AS event_seq, e.kind AS event_kind, t.* FROM task_events e "
+            "JOIN tasks t ON t.id = e.task_id WHERE e.seq > ? ORDER BY e.seq LIMIT ?",
+            (seq, limit),
+        ).fetchall()
+        return [{"seq": r["event_seq"], "kind": r["event_kind"], "task": _row_to_task(r)} for r in rows]
+
+    def last_event_seq(self) -> int:
+        return self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM task_events").fetchone()[0]
+
+    def prune_events(self, keep: int = TASK_EVENTS_KEEP) -> int:
+        with self._tx() as db:
+            return db.execute("DELETE FROM task_events WHERE seq <= (SELECT MAX(seq) FROM task_events) - ?",
+                              (keep,)).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """Tasks per status."""
+        return dict(self._conn().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def ready_count(self) -> int:
+        """Pending tasks a worker could claim now (not backing off)."""
+        return self._conn().execute(_READY_COUNT, (_now_iso(),)).fetchone()[0]
+
+    def completed_since(self, seconds: float) -> int:
+        """Tasks completed in the last `seconds` (as far back as the kept events reach)."""
+        cutoff = _iso(datetime.utcnow() - timedelta(seconds=seconds))
+        return self._conn().execute("SELECT COUNT(*) FROM task_events WHERE kind = 'completed' AND at >= ?",
+                                    (cutoff,)).fetchone()[0]
+
+    def recent_descriptions(self, limit: int) -> List[str]:
+        return [r[0] for r in self._conn().execute("SELECT description FROM tasks ORDER BY id DESC LIMIT ?", (limit,))]
+
+    def has_pending(self) -> bool:
+        return self._conn().execute("SELECT 1 FROM tasks WHERE status = 'pending' LIMIT 1").fetchone() is not None
+
+    def get(self, task_id: int) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return _row_to_task(row) if row else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_task_store() -> TaskStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TaskStore()
+        return _store
+
+
+if __name__ == "__main__":
+    # python task_store.py export [path]  |  python task_store.py import [path]
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "export"
+    target = sys.argv[2] if len(sys.argv) > 2 else TASK_FILE
+    store = TaskStore(json_path=None)
+    if cmd == "import":
+        print(f"imported {store.import_json(target)} task(s) from {target}")
+    else:
+        store.export_json(target)
+        print(f"exported tasks to {target}")
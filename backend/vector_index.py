@@ -0,0 +1,141 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# ------- Config ----------
+VECTOR_GROW_BY = int(os.getenv("VECTOR_GROW_BY", "4096"))   # rows added per reallocation (at least)
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "50000"))      # switch from exact to IVF search
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))             # clusters probed per query
+_IVF_TRAIN_ITERS = 8
+_IVF_TRAIN_SAMPLE = 64  # training rows per cluster
+
+
+class VectorIndex:
+    """Cosine top-k over a contiguous float32 matrix.
+
+    Rows are L2-normalized, so a dot product is the similarity. Below
+    IVF_MIN_ROWS a query is one matrix-vector product; above it the rows
+    are clustered (spherical k-means) and only the nearest IVF_NPROBE
+    clusters plus the not-yet-clustered tail are scored.
+    """
+
+    def __init__(self, dim: int, grow_by: int = VECTOR_GROW_BY,
+                 ivf_min_rows: int = IVF_MIN_ROWS, nprobe: int = IVF_NPROBE,
+                 mat: Optional[np.ndarray] = None, n: int = 0):
+        self.dim = dim
+        self.grow_by = grow_by
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        # storage may be handed in (e.g. a memmap); rows [0, n) are live
+        self._mat = mat if mat is not None else np.empty((0, dim), dtype=np.float32)
+        self._n = n
+        # IVF state: rows [0, _ivf_n) are clustered, sorted by cluster in _order
+        self._centroids = None
+        self._order = None
+        self._offsets = None
+        self._ivf_n = 0
+        self._trained_n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._mat[:self._n]
+
+    # ---------- storage ----------
+    def _reserve(self, rows: int):
+        cap = self._mat.shape[0]
+        if self._n + rows <= cap:
+            return
+        self._resize(max(self._n + rows, cap + max(self.grow_by, cap // 2)))
+
+    def _resize(self, capacity: int):
+        """Reallocate backing storage; subclasses may grow a file instead."""
+        mat = np.empty((capacity, self.dim), dtype=np.float32)
+        mat[:self._n] = self._mat[:self._n]
+        self._mat = mat
+
+    def add(self, vecs: np.ndarray) -> np.ndarray:
+        """Append rows; returns their row ids."""
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(-1, self.dim)
+        self._reserve(len(vecs))
+        start = self._n
+        self._mat[start:start + len(vecs)] = vecs
+        self._n += len(vecs)
+        self._maybe_reindex()
+        return np.arange(start, self._n)
+
+    # ---------- IVF ----------
+    def _maybe_reindex(self):
+        if self._n < self.ivf_min_rows:
+            return
+        if self._centroids is None or self._n >= 4 * self._trained_n:
+            self._train()
+        elif self._n - self._ivf_n > max(self.grow_by, self._ivf_n // 10):
+            self._assign()
+
+    def _train(self):
+        n = self._n
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = self._mat[rng.choice(n, size=min(n, nlist * _IVF_TRAIN_SAMPLE), replace=False)]
+        cents = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(_IVF_TRAIN_ITERS):
+            labels = np.argmax(sample @ cents.T, axis=1)
+            sums = np.zeros_like(cents)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = cents[empty]
+            cents = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+        self._centroids = cents.astype(np.float32)
+        self._trained_n = n
+        self._assign()
+
+    def _assign(self, block: int = 65536):
+        n = self._n
+        labels = np.empty(n, dtype=np.int32)
+        for i in range(0, n, block):
+            labels[i:i + block] = np.argmax(self._mat[i:min(i + block, n)] @ self._centroids.T, axis=1)
+        self._order = np.argsort(labels, kind="stable").astype(np.int64)
+        counts = np.bincount(labels, minlength=len(self._centroids))
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._ivf_n = n
+        self._on_reindex()
+
+    def _on_reindex(self):
+        """Hook called after the IVF layout changes (persisting stores save it here)."""
+
+    def ivf_state(self) -> Optional[dict]:
+        if self._centroids is None:
+            return None
+        return {"centroids": self._centroids, "order": self._order, "offsets": self._offsets,
+                "ivf_n": np.int64(self._ivf_n), "trained_n": np.int64(self._trained_n)}
+
+    def load_ivf_state(self, state: dict):
+        self._centroids = np.asarray(state["centroids"], dtype=np.float32)
+        self._order = state["order"]
+        self._offsets = state["offsets"]
+        self._ivf_n = int(state["ivf_n"])
+        self._trained_n = int(state["trained_n"])
+
+    # ---------- query ----------
+    def search(self, query: np.ndarray, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row ids, scores) of the k most similar rows, best first."""
+        if self._n == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        if self._centroids is None:
+            ids = None
+            scores = self._mat[:self._n] @ q
+        else:
+            probes = np.argsort(self._centroids @ q)[::-1][:self.nprobe]
+            parts = [self._order[self._offsets[c]:self._offsets[c + 1]] for c in probes]
+            parts.append(np.arange(self._ivf_n, self._n))
+            ids = np.concatenate(parts)
+            scores = self._mat[ids] @ q
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if ids is None else ids[top]), scores[top]
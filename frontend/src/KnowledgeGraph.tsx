@@ -1,30 +1,84 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import ForceGraph2D from "react-force-graph-2d";
-import axios from "axios";
 
 interface Node {
   id: string;
+  type?: string;
+  label?: string;
 }
 interface Edge {
   source: string;
   target: string;
   type: string;
 }
+interface GraphOp {
+  op: "node" | "edge" | "del_node";
+  v: number;
+  id?: string;
+  source?: string;
+  target?: string;
+  type: string;
+  label?: string;
+}
+
+// the graph library replaces link ends with the node objects once laid out
+const endId = (end: string | { id: string }) => (typeof end === "string" ? end : end.id);
 
 export default function KnowledgeGraph() {
   const [graphData, setGraphData] = useState<{ nodes: Node[]; links: Edge[] }>({
     nodes: [],
     links: [],
   });
+  const version = useRef<number | null>(null);
 
   useEffect(() => {
-    const fetchGraph = async () => {
-      const res = await axios.get("http://localhost:8000/knowledge_graph");
-      setGraphData(res.data);
+    let eventSource: EventSource;
+
+    const applyOps = (ops: GraphOp[]) =>
+      setGraphData((prev) => {
+        const nodes = new Map(prev.nodes.map((n) => [n.id, n]));
+        let links = [...prev.links];
+        for (const op of ops) {
+          if (op.op === "del_node") {
+            // pruned by the server's node cap, with every edge touching it
+            nodes.delete(op.id!);
+            links = links.filter((l) => endId(l.source) !== op.id && endId(l.target) !== op.id);
+          } else if (op.op === "node") {
+            // keep the existing object so the layout doesn't jump
+            const node = nodes.get(op.id!);
+            if (node) Object.assign(node, { type: op.type, label: op.label });
+            else nodes.set(op.id!, { id: op.id!, type: op.type, label: op.label });
+          } else {
+            for (const id of [op.source!, op.target!]) {
+              if (!nodes.has(id)) nodes.set(id, { id });
+            }
+            links.push({ source: op.source!, target: op.target!, type: op.type });
+          }
+        }
+        return { nodes: [...nodes.values()], links };
+      });
+
+    const connect = () => {
+      // the browser resends Last-Event-ID on its own reconnects; ?since covers ours
+      const since = version.current === null ? "" : `?since=${version.current}`;
+      eventSource = new EventSource(`http://localhost:8000/knowledge_graph/stream${since}`);
+      eventSource.addEventListener("snapshot", (e) => {
+        const data = JSON.parse((e as MessageEvent).data);
+        version.current = data.version;
+        setGraphData({ nodes: data.nodes, links: data.links });
+      });
+      eventSource.addEventListener("changes", (e) => {
+        const data = JSON.parse((e as MessageEvent).data);
+        version.current = data.version;
+        applyOps(data.changes);
+      });
+      eventSource.addEventListener("lagged", () => {
+        eventSource.close();
+        connect();
+      });
     };
-    fetchGraph();
-    const interval = setInterval(fetchGraph, 10000);
-    return () => clearInterval(interval);
+    connect();
+    return () => eventSource.close();
   }, []);
 
   return (
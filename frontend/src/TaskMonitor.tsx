@@ -6,24 +6,59 @@ interface Task {
   status: string;
   priority?: number;
 }
+interface TaskChange {
+  seq: number;
+  kind: string;
+  task: Task;
+}
 
 export default function TaskMonitor() {
-  const [tasks, setTasks] = useState<Task[]>([]);
+  const [tasks, setTasks] = useState<Map<number, Task>>(new Map());
 
   useEffect(() => {
-    const eventSource = new EventSource("http://localhost:8000/tasks_stream");
-    eventSource.onmessage = (e) => {
-      const data: Task[] = JSON.parse(e.data);
-      setTasks(data);
+    let eventSource: EventSource;
+    let seq: number | null = null;
+
+    const connect = () => {
+      // the browser resends Last-Event-ID on its own reconnects; ?since covers ours
+      eventSource = new EventSource(
+        `http://localhost:8000/tasks_stream${seq === null ? "" : `?since=${seq}`}`
+      );
+      eventSource.addEventListener("snapshot", (e) => {
+        const data = JSON.parse((e as MessageEvent).data);
+        seq = data.seq;
+        setTasks(new Map(data.tasks.map((t: Task) => [t.id, t])));
+      });
+      eventSource.addEventListener("changes", (e) => {
+        const data = JSON.parse((e as MessageEvent).data);
+        seq = data.seq;
+        setTasks((prev) => {
+          const next = new Map(prev);
+          for (const { task } of data.changes as TaskChange[]) {
+            if (task.status === "pending") next.set(task.id, task);
+            else next.delete(task.id);
+          }
+          return next;
+        });
+      });
+      eventSource.addEventListener("lagged", () => {
+        eventSource.close();
+        connect();
+      });
     };
+    connect();
     return () => eventSource.close();
   }, []);
 
+  const pending = [...tasks.values()].sort(
+    (a, b) => (b.priority ?? 1) - (a.priority ?? 1) || a.id - b.id
+  );
+
   return (
     <div>
       <h2>Pending Tasks</h2>
       <ul>
-        {tasks.map((task) => (
+        {pending.map((task) => (
           <li key={task.id}>
             {task.description} - <strong>{task.status}</strong> (Priority:{" "}
             {task.priority})